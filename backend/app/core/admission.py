@@ -0,0 +1,176 @@
+"""
+Admission control for upload requests.
+
+Runs as ASGI middleware in front of the upload routes, before FastAPI parses
+the multipart body (which python-multipart spools to a temp file):
+
+- a declared Content-Length above the route's request limit is rejected
+  with 413 without reading the body
+- the body is counted as it arrives and the request fails with 413 as soon
+  as it passes the declared length or the limit (chunked uploads included)
+- uploads in progress are bounded per instance, by count and by declared
+  bytes (503), and per client (429). Rejections are immediate, never queued.
+  Batch shares are counted against a separate budget (BATCH_MAX_*), so a
+  large batch cannot starve single uploads.
+"""
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from app.core.config import (
+    MAX_FILE_SIZE, UPLOAD_REQUEST_OVERHEAD, UPLOAD_MAX_CONCURRENT, UPLOAD_MAX_BYTES_IN_FLIGHT,
+    UPLOAD_MAX_PER_CLIENT, TRUST_FORWARDED_FOR, TRUSTED_PROXY_HOPS, BATCH_MAX_FILES, BATCH_MAX_TOTAL_SIZE,
+    BATCH_MAX_CONCURRENT, BATCH_MAX_BYTES_IN_FLIGHT, BATCH_MAX_PER_CLIENT
+)
+
+# Routes whose request bodies carry file data -> (maximum request size, 413 message)
+UPLOAD_PATHS: Dict[str, Tuple[int, str]] = {
+    "/api/upload": (
+        MAX_FILE_SIZE + UPLOAD_REQUEST_OVERHEAD,
+        f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB"
+    ),
+    "/api/shares": (
+        BATCH_MAX_TOTAL_SIZE + BATCH_MAX_FILES * UPLOAD_REQUEST_OVERHEAD,
+        f"Batch exceeds maximum total size of {BATCH_MAX_TOTAL_SIZE / (1024*1024)}MB"
+    ),
+}
+
+
+def client_address(scope) -> str:
+    """
+    Client IP. With TRUST_FORWARDED_FOR, the X-Forwarded-For address appended
+    by the outermost of TRUSTED_PROXY_HOPS proxies; entries left of it are
+    client-controlled and ignored.
+    """
+    if TRUST_FORWARDED_FOR:
+        hops = []
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                hops.extend(hop.strip() for hop in value.decode("latin-1").split(","))
+        hops = [hop for hop in hops if hop]
+        if hops:
+            return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class UploadAdmission:
+    """Counts uploads and declared bytes in progress, globally and per client"""
+
+    def __init__(self, max_concurrent: int, max_bytes: int, max_per_client: int):
+        self.max_concurrent = max_concurrent
+        self.max_bytes = max_bytes
+        self.max_per_client = max_per_client
+        self.in_flight = 0
+        self.bytes_in_flight = 0
+        self.per_client: Dict[str, int] = {}
+        self.admitted = 0
+        self.rejected = {"too_large": 0, "client_limit": 0, "busy": 0}
+
+    def try_acquire(self, client: str, size: int) -> Optional[Tuple[int, str]]:
+        """
+        Reserve a slot for an upload of `size` declared bytes.
+        Returns None when admitted, else the (status code, message) to reject with.
+        """
+        if self.per_client.get(client, 0) >= self.max_per_client:
+            self.rejected["client_limit"] += 1
+            return 429, "Too many uploads in progress from this client, please retry shortly"
+        if self.in_flight >= self.max_concurrent or (
+            self.in_flight and self.bytes_in_flight + size > self.max_bytes
+        ):
+            self.rejected["busy"] += 1
+            return 503, "Server is busy with other uploads, please retry shortly"
+        self.in_flight += 1
+        self.bytes_in_flight += size
+        self.per_client[client] = self.per_client.get(client, 0) + 1
+        self.admitted += 1
+        return None
+
+    def release(self, client: str, size: int):
+        self.in_flight -= 1
+        self.bytes_in_flight -= size
+        remaining = self.per_client.get(client, 1) - 1
+        if remaining > 0:
+            self.per_client[client] = remaining
+        else:
+            self.per_client.pop(client, None)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "bytes_in_flight": self.bytes_in_flight,
+            "clients": len(self.per_client),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+class UploadAdmissionMiddleware:
+    """ASGI middleware applying the route's admission budget to POST requests on UPLOAD_PATHS"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in UPLOAD_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        admission = ADMISSIONS[scope["path"]]
+        max_request_size, too_large = UPLOAD_PATHS[scope["path"]]
+        declared = None
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = None
+                break
+
+        if declared is not None and declared > max_request_size:
+            admission.rejected["too_large"] += 1
+            await self._reject(scope, receive, send, 413, too_large)
+            return
+
+        limit = max_request_size if declared is None else declared
+        client = client_address(scope)
+        rejection = admission.try_acquire(client, limit)
+        if rejection is not None:
+            await self._reject(scope, receive, send, *rejection)
+            return
+
+        received = 0
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    admission.rejected["too_large"] += 1
+                    # FastAPI re-raises HTTPExceptions from body parsing, so this becomes a 413
+                    if declared is not None and declared < max_request_size:
+                        raise HTTPException(status_code=413, detail="Request body exceeds its declared Content-Length")
+                    raise HTTPException(status_code=413, detail=too_large)
+            return message
+
+        try:
+            await self.app(scope, counted_receive, send)
+        finally:
+            admission.release(client, limit)
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, detail: str):
+        headers = {"Retry-After": "1"} if status_code in (429, 503) else {"Connection": "close"}
+        response = JSONResponse(status_code=status_code, content={"detail": detail}, headers=headers)
+        await response(scope, receive, send)
+
+
+# Singleton instances
+upload_admission = UploadAdmission(UPLOAD_MAX_CONCURRENT, UPLOAD_MAX_BYTES_IN_FLIGHT, UPLOAD_MAX_PER_CLIENT)
+batch_admission = UploadAdmission(BATCH_MAX_CONCURRENT, BATCH_MAX_BYTES_IN_FLIGHT, BATCH_MAX_PER_CLIENT)
+
+# Route -> admission budget
+ADMISSIONS: Dict[str, UploadAdmission] = {
+    "/api/upload": upload_admission,
+    "/api/shares": batch_admission,
+}
@@ -4,24 +4,182 @@ from pathlib import Path
 # Base directory
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
-# Storage directory for encrypted files
+# Storage directory for encrypted files (created by the local storage backend on first use)
 STORAGE_DIR = BASE_DIR / "storage"
-STORAGE_DIR.mkdir(exist_ok=True)
+# Hashed subdirectory levels (2 hex chars each) so no directory grows unbounded; 0 = flat
+STORAGE_SHARD_LEVELS = int(os.getenv("STORAGE_SHARD_LEVELS", "2"))
+# Threads for local file I/O, kept off the event loop
+LOCAL_IO_WORKERS = int(os.getenv("LOCAL_IO_WORKERS", "16"))
+# fsync policy for new blobs: "always" (file + directory), "file" or "none"
+LOCAL_FSYNC = os.getenv("LOCAL_FSYNC", "always").lower()
 
 # Encryption key - in production, use environment variable
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY", "your-secret-key-32-chars-long!!")[:32].encode()
+# Keyring: pre-derived 32-byte keys as "id:urlsafe-base64" pairs, comma separated.
+# Key ID 0 is the key derived from ENCRYPTION_KEY; configure it here to skip PBKDF2 at startup.
+ENCRYPTION_KEYS = os.getenv("ENCRYPTION_KEYS", "")
+ENCRYPTION_KEYS_FILE = os.getenv("ENCRYPTION_KEYS_FILE", None)  # JSON object {"id": "urlsafe-base64", ...}
+ENCRYPTION_PRIMARY_KEY_ID = int(os.environ["ENCRYPTION_PRIMARY_KEY_ID"]) if os.getenv("ENCRYPTION_PRIMARY_KEY_ID") else None  # Default: highest key ID
+# Signed download tokens issued by /access (default secret is derived from ENCRYPTION_KEY)
+DOWNLOAD_TOKEN_SECRET = os.getenv("DOWNLOAD_TOKEN_SECRET", None)
+DOWNLOAD_TOKEN_TTL = int(os.getenv("DOWNLOAD_TOKEN_TTL", "300"))  # Seconds
+# Progress checkpoint of the key rotation job (python -m app.services.rotation)
+ROTATION_STATE_FILE = os.getenv("ROTATION_STATE_FILE", str(BASE_DIR / "key_rotation_state.json"))
 
 # Database URL - SQLite for development, can be swapped for PostgreSQL/MySQL
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite+aiosqlite:///{BASE_DIR}/documents.db")
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+# Connection pool (PostgreSQL/MySQL and file-based SQLite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Reconnect after this many seconds (-1 to disable)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# SQLite pragmas applied to every new connection
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")  # Empty to keep the file's current mode
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable in WAL mode except on power loss
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # Milliseconds to wait for a write lock
 
 # File upload settings
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
 ALLOWED_EXTENSIONS = None  # None means all files allowed
 
+# Upload admission control - rejects before the body is spooled to disk
+# Multipart framing (boundaries, part headers, passcode field) allowed on top of MAX_FILE_SIZE
+UPLOAD_REQUEST_OVERHEAD = int(os.getenv("UPLOAD_REQUEST_OVERHEAD", str(64 * 1024)))
+UPLOAD_MAX_CONCURRENT = int(os.getenv("UPLOAD_MAX_CONCURRENT", "32"))  # Uploads in progress per instance (503 above)
+# Declared request bytes in progress per instance; chunked uploads count as the maximum size
+UPLOAD_MAX_BYTES_IN_FLIGHT = int(os.getenv("UPLOAD_MAX_BYTES_IN_FLIGHT", str(1024 * 1024 * 1024)))
+UPLOAD_MAX_PER_CLIENT = int(os.getenv("UPLOAD_MAX_PER_CLIENT", "4"))  # Uploads in progress per client IP (429 above)
+# Identify clients by X-Forwarded-For; only enable behind a proxy that sets it
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+# Proxies in front of the app that append to X-Forwarded-For; the client is the address the outermost one appended
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+# Passcode brute-force throttling - failures per client IP and per document, checked before any DB query or hash
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "true").lower() == "true"
+THROTTLE_BACKEND = os.getenv("THROTTLE_BACKEND", "memory")  # "memory" or "package.module:ClassName"
+THROTTLE_MAX_ENTRIES = int(os.getenv("THROTTLE_MAX_ENTRIES", "100000"))  # Keys tracked by the memory backend
+THROTTLE_WINDOW = float(os.getenv("THROTTLE_WINDOW", "300"))  # Seconds over which failures are counted
+THROTTLE_CLIENT_FAILURES = int(os.getenv("THROTTLE_CLIENT_FAILURES", "10"))  # Failures per window before a client is locked out
+THROTTLE_DOCUMENT_FAILURES = int(os.getenv("THROTTLE_DOCUMENT_FAILURES", "30"))  # Failures per window before a document is locked out
+THROTTLE_LOCKOUT = float(os.getenv("THROTTLE_LOCKOUT", "60"))  # Seconds of the first lockout, doubled per repeat
+THROTTLE_MAX_LOCKOUT = float(os.getenv("THROTTLE_MAX_LOCKOUT", "3600"))
+# Passcode attempts (right or wrong) are token buckets taken before the hash runs: refill per second, burst
+THROTTLE_CLIENT_ATTEMPT_RATE = float(os.getenv("THROTTLE_CLIENT_ATTEMPT_RATE", "1"))
+THROTTLE_CLIENT_ATTEMPT_BURST = int(os.getenv("THROTTLE_CLIENT_ATTEMPT_BURST", "20"))
+THROTTLE_DOCUMENT_ATTEMPT_RATE = float(os.getenv("THROTTLE_DOCUMENT_ATTEMPT_RATE", "5"))
+THROTTLE_DOCUMENT_ATTEMPT_BURST = int(os.getenv("THROTTLE_DOCUMENT_ATTEMPT_BURST", "60"))
+
+# Batch shares (POST /api/shares) - many files under one passcode and share ID
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "200"))
+# Sum of file sizes per request; by default a quarter of the batch budget below
+BATCH_MAX_TOTAL_SIZE = int(os.getenv("BATCH_MAX_TOTAL_SIZE", str(UPLOAD_MAX_BYTES_IN_FLIGHT // 8)))
+BATCH_UPLOAD_CONCURRENCY = int(os.getenv("BATCH_UPLOAD_CONCURRENCY", "4"))  # Files encrypted and stored at once
+# Batches are admitted against their own budget, so they never hold back single uploads
+BATCH_MAX_CONCURRENT = int(os.getenv("BATCH_MAX_CONCURRENT", "4"))  # Batch requests in progress per instance
+BATCH_MAX_BYTES_IN_FLIGHT = int(os.getenv("BATCH_MAX_BYTES_IN_FLIGHT", str(UPLOAD_MAX_BYTES_IN_FLIGHT // 2)))
+BATCH_MAX_PER_CLIENT = int(os.getenv("BATCH_MAX_PER_CLIENT", "1"))  # Batch requests in progress per client IP
+
+# Content-addressed dedup: identical uploads share one encrypted blob (reference counted)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "false").lower() == "true"
+
+# Streaming encryption settings
+# Plaintext bytes per AES-GCM segment (each segment adds a 16-byte tag on disk)
+ENCRYPTION_CHUNK_SIZE = int(os.getenv("ENCRYPTION_CHUNK_SIZE", str(64 * 1024)))
+# Bytes pulled from the upload stream per read (a whole number of segments is encrypted at a time)
+UPLOAD_READ_SIZE = int(os.getenv("UPLOAD_READ_SIZE", str(1024 * 1024)))
+# Encrypted bytes fetched from storage per read when streaming a download
+DOWNLOAD_READ_SIZE = int(os.getenv("DOWNLOAD_READ_SIZE", str(1024 * 1024)))
+
+# Document metadata cache (read-through, in front of lookups by document ID)
+DOCUMENT_CACHE_ENABLED = os.getenv("DOCUMENT_CACHE_ENABLED", "true").lower() == "true"
+DOCUMENT_CACHE_BACKEND = os.getenv("DOCUMENT_CACHE_BACKEND", "memory")  # "memory" or "package.module:ClassName"
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", "10000"))  # Max entries (LRU)
+DOCUMENT_CACHE_TTL = float(os.getenv("DOCUMENT_CACHE_TTL", "300"))  # Seconds, never past the document expiry
+DOCUMENT_CACHE_NEGATIVE_TTL = float(os.getenv("DOCUMENT_CACHE_NEGATIVE_TTL", "30"))  # Seconds to remember unknown IDs
+
+# Local cache of encrypted S3 blobs for hot documents (ciphertext only, LRU within a byte budget)
+BLOB_CACHE_ENABLED = os.getenv("BLOB_CACHE_ENABLED", "false").lower() == "true"
+BLOB_CACHE_SIZE = int(os.getenv("BLOB_CACHE_SIZE", str(512 * 1024 * 1024)))  # Total cached bytes
+BLOB_CACHE_MAX_OBJECT_SIZE = int(os.getenv("BLOB_CACHE_MAX_OBJECT_SIZE", str(32 * 1024 * 1024)))  # Larger blobs are always streamed from S3
+BLOB_CACHE_DIR = os.getenv("BLOB_CACHE_DIR", "")  # Keep entries on local disk here instead of in memory
+
+# Compression before encryption: "none", "zlib" or "zstd" (needs the zstandard package)
+COMPRESSION_CODEC = os.getenv("COMPRESSION_CODEC", "none").lower()
+COMPRESSION_LEVEL = int(os.environ["COMPRESSION_LEVEL"]) if os.getenv("COMPRESSION_LEVEL") else None  # Default: codec's own
+# MIME types stored uncompressed (already compressed formats); "*" wildcards allowed
+COMPRESSION_SKIP_MIME_TYPES = os.getenv(
+    "COMPRESSION_SKIP_MIME_TYPES",
+    "image/jpeg,image/png,image/gif,image/webp,image/heic,image/avif,video/*,audio/*,"
+    "application/zip,application/x-zip-compressed,application/gzip,application/x-gzip,application/zstd,"
+    "application/x-7z-compressed,application/x-rar-compressed,application/vnd.rar,application/x-bzip2,"
+    "application/x-xz,application/pdf,application/vnd.openxmlformats-officedocument.*,"
+    "application/vnd.oasis.opendocument.*,application/epub+zip"
+).split(",")
+
+# Passcode hashing - "bcrypt", "scrypt" or "argon2" (needs argon2-cffi)
+PASSCODE_HASH_ALGORITHM = os.getenv("PASSCODE_HASH_ALGORITHM", "bcrypt").lower()
+# Cost is calibrated at startup so one verification takes about this long
+PASSCODE_VERIFY_TARGET_MS = float(os.getenv("PASSCODE_VERIFY_TARGET_MS", "250"))
+# Fixed cost instead of calibrating: bcrypt rounds, scrypt log2(N) or argon2 time cost
+PASSCODE_HASH_COST = int(os.environ["PASSCODE_HASH_COST"]) if os.getenv("PASSCODE_HASH_COST") else None
+PASSCODE_MEMORY_KB = int(os.getenv("PASSCODE_MEMORY_KB", "65536"))  # argon2 memory per hash
+
+# CPU work executor (bcrypt, encryption) - keeps heavy work off the event loop
+CPU_EXECUTOR_WORKERS = int(os.getenv("CPU_EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+# Calls allowed to wait for a worker before new work is rejected with 503
+CPU_EXECUTOR_QUEUE = int(os.getenv("CPU_EXECUTOR_QUEUE", "64"))
+# When > 0, bcrypt runs in a process pool of this size instead of the thread pool
+CPU_EXECUTOR_PROCESSES = int(os.getenv("CPU_EXECUTOR_PROCESSES", "0"))
+
+# Expired document reaper
+REAPER_ENABLED = os.getenv("REAPER_ENABLED", "true").lower() == "true"  # Run in-process on a background task
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "300"))  # Seconds between passes
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "500"))  # Documents per page
+REAPER_LEASE_TTL = float(os.getenv("REAPER_LEASE_TTL", "120"))  # Seconds before another instance may take over
+
+# Health probes - dependencies are checked in the background, endpoints serve cached results
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))  # Seconds between probes
+HEALTH_RESULT_TTL = float(os.getenv("HEALTH_RESULT_TTL", "60"))  # Older results count as stale (not ready)
+
+# Fast startup (serverless): skip migrations, S3 bucket validation and passcode cost calibration
+# in the startup hook; run `python -m app.deploy` at deploy time instead
+FAST_STARTUP = os.getenv("FAST_STARTUP", "false").lower() == "true"
+
+# Metrics - Prometheus text format at GET /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
 # S3 Configuration
 USE_S3 = os.getenv("USE_S3", "false").lower() == "true"
+# Storage backend: "local", "s3", "tiered" (local disk with write-back to S3) or "package.module:ClassName"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3" if USE_S3 else "local")
+# The tiered backend needs the S3 client, health probe and bucket validation as well
+USE_S3 = USE_S3 or STORAGE_BACKEND in ("s3", "tiered")
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME", "")
 S3_REGION = os.getenv("S3_REGION", "us-east-1")
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID", "")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", "")
 S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", None)  # For S3-compatible services like MinIO
+# Shared S3 client tuning
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "60"))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "3"))
+S3_KEEPALIVE_TIMEOUT = float(os.getenv("S3_KEEPALIVE_TIMEOUT", "60"))  # Idle seconds before a pooled connection is dropped
+# Multipart uploads - encrypted blobs larger than the threshold are uploaded in parallel parts
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+S3_MULTIPART_PART_SIZE = max(5 * 1024 * 1024, int(os.getenv("S3_MULTIPART_PART_SIZE", str(8 * 1024 * 1024))))  # S3 minimum is 5MB
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", "4"))
+S3_PART_MAX_ATTEMPTS = int(os.getenv("S3_PART_MAX_ATTEMPTS", "3"))
+# Direct mode: browsers encrypt and PUT/GET blobs with presigned URLs, bytes bypass the API
+S3_DIRECT_ENABLED = os.getenv("S3_DIRECT_ENABLED", "false").lower() == "true"
+S3_DIRECT_UPLOAD_TTL = int(os.getenv("S3_DIRECT_UPLOAD_TTL", "3600"))  # Seconds to upload and call /complete
+S3_PRESIGN_TTL = int(os.getenv("S3_PRESIGN_TTL", "300"))  # Lifetime of presigned download URLs
+
+# Tiered storage (STORAGE_BACKEND=tiered): uploads land on local disk and are copied to S3 in the background
+TIERED_UPLOAD_CONCURRENCY = int(os.getenv("TIERED_UPLOAD_CONCURRENCY", "4"))  # Blobs uploaded to S3 at once
+TIERED_LOCAL_RETENTION = float(os.getenv("TIERED_LOCAL_RETENTION", "3600"))  # Seconds local copies are kept after upload
+TIERED_SHUTDOWN_DRAIN = float(os.getenv("TIERED_SHUTDOWN_DRAIN", "10"))  # Seconds to keep uploading on shutdown
+# Seconds a written blob may go without a document row (upload still committing) before it counts as deleted
+TIERED_ORPHAN_GRACE = float(os.getenv("TIERED_ORPHAN_GRACE", "600"))
@@ -1,24 +1,75 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
-from app.core.config import DATABASE_URL
+from app.core.config import (
+    DATABASE_URL, DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT
+)
+from app.core.metrics import metrics, STAGE_SECONDS
+
+database_url = make_url(DATABASE_URL)
+is_sqlite = database_url.get_backend_name() == "sqlite"
+
+
+def engine_options() -> dict:
+    """Per-backend engine settings"""
+    options = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING}
+    if is_sqlite:
+        # Waiting on the SQLite lock inside the driver as well as in the pragma
+        options["connect_args"] = {"timeout": SQLITE_BUSY_TIMEOUT / 1000}
+        if database_url.database in (None, "", ":memory:"):
+            # In-memory databases live in a single shared connection (StaticPool)
+            return options
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE
+    )
+    return options
+
+
+def sqlite_pragmas() -> dict:
+    pragmas = {"busy_timeout": SQLITE_BUSY_TIMEOUT, "synchronous": SQLITE_SYNCHRONOUS}
+    if SQLITE_JOURNAL_MODE:
+        pragmas["journal_mode"] = SQLITE_JOURNAL_MODE
+    return pragmas
+
 
 # Create async engine
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,
-    future=True
-)
+engine = create_async_engine(DATABASE_URL, **engine_options())
+
+if is_sqlite:
+    @event.listens_for(engine.sync_engine, "connect")
+    def init_sqlite_connection(dbapi_connection, connection_record):
+        """
+        Connection-init hook: WAL lets readers run alongside the single writer,
+        and busy_timeout makes concurrent writers wait instead of failing with
+        "database is locked".
+        """
+        cursor = dbapi_connection.cursor()
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+if metrics.enabled:
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        context.metrics_started = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def record_query_time(conn, cursor, statement, parameters, context, executemany):
+        STAGE_SECONDS.observe(time.perf_counter() - context.metrics_started, stage="db_query")
 
-# For SQLAlchemy 1.4, we create sessions directly from the engine
-# This is compatible with both 1.4 and 2.0
+# Session factory shared by requests and background jobs
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 # Base class for models
 Base = declarative_base()
 
 # Dependency to get database session
 async def get_db():
-    async with AsyncSession(engine, expire_on_commit=False) as session:
-        try:
-            yield session
-        finally:
-            await session.close()
+    async with SessionLocal() as session:
+        yield session
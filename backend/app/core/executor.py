@@ -0,0 +1,106 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from app.core.config import CPU_EXECUTOR_WORKERS, CPU_EXECUTOR_QUEUE, CPU_EXECUTOR_PROCESSES
+
+
+class ExecutorSaturatedError(Exception):
+    """Raised when the CPU executor queue is full; mapped to 503 by the app"""
+
+
+def _timed_call(fn: Callable, args: tuple):
+    # Runs inside the worker; monotonic clock is shared across processes on one host
+    started = time.monotonic()
+    result = fn(*args)
+    return result, started, time.monotonic()
+
+
+class CPUExecutor:
+    """
+    Bounded worker pool for CPU-heavy work (bcrypt, encryption) so it never
+    blocks the event loop. Work is rejected with ExecutorSaturatedError once
+    `max_workers + max_queue` calls are in flight instead of queueing forever.
+
+    Requests are rejected once, up front (admit() or their first run()). The
+    chunks of a stream already under way run with `wait=True`: they queue for
+    a worker instead, so a response that has started is never cut off.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, process_workers: int = 0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.process_workers = process_workers
+        self.limit = max_workers + max_queue
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait_seconds = 0.0
+        self.exec_seconds = 0.0
+        self.max_queue_wait_seconds = 0.0
+
+    def _pool(self, process: bool) -> Executor:
+        if process and self.process_workers > 0:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.process_workers)
+            return self._processes
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="cpu")
+        return self._threads
+
+    def admit(self):
+        """Raise ExecutorSaturatedError if the pool is saturated; call before starting a stream"""
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            raise ExecutorSaturatedError("Server is busy, please retry shortly")
+
+    async def run(self, fn: Callable, *args: Any, process: bool = False, wait: bool = False) -> Any:
+        """
+        Run `fn(*args)` on the pool and return its result.
+        With `process=True` the call goes to the process pool when one is
+        configured, so `fn` and `args` must be picklable. With `wait=True` the
+        call is queued even when the pool is saturated (for admitted streams).
+        """
+        if not wait:
+            self.admit()
+
+        self.in_flight += 1
+        submitted = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, finished = await loop.run_in_executor(self._pool(process), _timed_call, fn, args)
+        finally:
+            self.in_flight -= 1
+
+        wait = max(0.0, started - submitted)
+        self.completed += 1
+        self.queue_wait_seconds += wait
+        self.exec_seconds += finished - started
+        self.max_queue_wait_seconds = max(self.max_queue_wait_seconds, wait)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and wait-vs-execution timing counters"""
+        return {
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.max_workers),
+            "limit": self.limit,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_wait_seconds_total": round(self.queue_wait_seconds, 6),
+            "exec_seconds_total": round(self.exec_seconds, 6),
+            "max_queue_wait_seconds": round(self.max_queue_wait_seconds, 6),
+        }
+
+    def shutdown(self):
+        for pool in (self._threads, self._processes):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._threads = None
+        self._processes = None
+
+
+# Singleton instance
+cpu_executor = CPUExecutor(CPU_EXECUTOR_WORKERS, CPU_EXECUTOR_QUEUE, CPU_EXECUTOR_PROCESSES)
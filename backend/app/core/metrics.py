@@ -0,0 +1,298 @@
+"""
+In-process metrics exposed in the Prometheus text format at GET /metrics.
+
+Counters, gauges and histograms are plain dicts keyed by label values and are
+only updated from the event loop, so recording a sample is a dict lookup and
+a few additions. Code under measurement uses the context managers:
+
+    with stage("encrypt"):
+        ...
+    with in_flight("download"):
+        ...
+
+Set METRICS_ENABLED=false to turn recording (and the endpoint) off.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Tuple
+from app.core.config import METRICS_ENABLED
+
+# Seconds; covers sub-millisecond cipher calls up to slow multi-GB transfers
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple([labels.get(name, "") for name in self.labelnames])
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels: str):
+        """Mirror a total that is maintained elsewhere (see MetricsRegistry.add_collector)"""
+        self._values[self._key(labels)] = value
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        # Non-cumulative counts; rendering accumulates them
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def samples(self) -> Iterable[str]:
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total[0])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class MetricsRegistry:
+    """Metric definitions plus callbacks that refresh gauges at scrape time"""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric; a name registered twice would be rendered twice, which is invalid exposition"""
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Call `collector` before every scrape, e.g. to copy stats into gauges"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Singleton registry and the application's metrics
+metrics = MetricsRegistry(METRICS_ENABLED)
+
+REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response body is sent",
+    ("method", "route", "status")
+)
+REQUESTS_IN_FLIGHT = metrics.gauge("http_requests_in_flight", "HTTP requests being processed")
+STAGE_SECONDS = metrics.histogram(
+    "stage_duration_seconds",
+    "Time per call of a processing stage (read, encrypt, decrypt, storage_put, storage_get, passcode, db_query)",
+    ("stage",)
+)
+BYTES = metrics.counter(
+    "transfer_bytes_total",
+    "Bytes moved: upload_read (plaintext in), storage_written, storage_read (ciphertext), download_sent (plaintext out)",
+    ("direction",)
+)
+TRANSFERS_IN_FLIGHT = metrics.gauge("transfers_in_flight", "Uploads and downloads in progress", ("kind",))
+S3_REQUEST_SECONDS = metrics.histogram("s3_request_duration_seconds", "S3 API call latency including retries", ("operation",))
+S3_ERRORS = metrics.counter("s3_errors_total", "Failed S3 API calls by error code", ("operation", "code"))
+
+
+class stage:
+    """Time the enclosed block as one call of processing stage `name`"""
+
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if metrics.enabled:
+            STAGE_SECONDS.observe(time.perf_counter() - self.started, stage=self.name)
+
+
+@contextmanager
+def in_flight(kind: str):
+    """Count the enclosed block as an upload/download in progress"""
+    if not metrics.enabled:
+        yield
+        return
+    TRANSFERS_IN_FLIGHT.inc(kind=kind)
+    try:
+        yield
+    finally:
+        TRANSFERS_IN_FLIGHT.dec(kind=kind)
+
+
+def count_bytes(direction: str, amount: int):
+    if metrics.enabled:
+        BYTES.inc(amount, direction=direction)
+
+
+async def metered_stream(chunks: AsyncIterator[bytes], stage_name: str, direction: str) -> AsyncIterator[bytes]:
+    """Pass `chunks` through, timing each wait as `stage_name` and counting its bytes"""
+    iterator = chunks.__aiter__()
+    while True:
+        with stage(stage_name):
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        count_bytes(direction, len(chunk))
+        yield chunk
+
+
+def instrument_s3_client(client):
+    """Record latency and error codes of every call made through an (aio)botocore S3 client"""
+    if not metrics.enabled:
+        return
+
+    def before_call(model, context, **kwargs):
+        context["metrics_started"] = time.perf_counter()
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        started = context.pop("metrics_started", None)
+        if started is not None:
+            S3_REQUEST_SECONDS.observe(time.perf_counter() - started, operation=model.name)
+        if http_response.status_code >= 300:
+            code = parsed.get("Error", {}).get("Code") or str(http_response.status_code)
+            S3_ERRORS.inc(operation=model.name, code=code)
+
+    def after_call_error(event_name, context, exception, **kwargs):
+        # Connection errors and timeouts that never produced an HTTP response
+        context.pop("metrics_started", None)
+        S3_ERRORS.inc(operation=event_name.rsplit(".", 1)[-1], code=type(exception).__name__)
+
+    client.meta.events.register("before-call.s3", before_call)
+    client.meta.events.register("after-call.s3", after_call)
+    client.meta.events.register("after-call-error.s3", after_call_error)
+
+
+def route_template(scope) -> str:
+    """
+    Matched route template such as /api/download/{doc_id}. The route may only
+    know its path relative to the router prefix, which is taken from the request path.
+    """
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if template is None:
+        return "unmatched"
+    segments = scope["path"].split("/")
+    prefix_length = max(1, len(segments) - len(template.split("/")) + 1)
+    return "/".join(segments[:prefix_length]) + template
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per route template (not raw
+    path, to keep label cardinality bounded) and the number of requests in flight.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=route_template(scope),
+                status=status
+            )
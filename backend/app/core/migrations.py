@@ -0,0 +1,188 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once, in its own transaction, and is recorded in the
+`schema_migrations` table. Migrations define the tables they touch themselves
+instead of using the models, so they keep working as the models change. They
+are written to be safe on databases created by the old `create_all` startup.
+
+    python -m app.core.migrations            # Apply pending migrations
+    python -m app.core.migrations --status   # List applied and pending migrations
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from typing import Callable, List, Tuple
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from app.core.database import engine
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False)
+)
+
+
+def _create_index(conn: Connection, index: Index):
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(index.table.name)}
+    if index.name not in existing:
+        index.create(conn)
+
+
+def create_documents(conn: Connection):
+    Table(
+        "documents", MetaData(),
+        Column("id", String, primary_key=True),
+        Column("original_filename", String, nullable=False),
+        Column("encrypted_filename", String, nullable=False, unique=True),
+        Column("passcode_hash", String, nullable=False),
+        Column("created_at", DateTime(timezone=True), server_default=func.now()),
+        Column("expires_at", DateTime(timezone=True), nullable=False),
+        Column("file_size", Integer, nullable=False),
+        Column("mime_type", String, nullable=True)
+    ).create(conn, checkfirst=True)
+
+
+def create_leases(conn: Connection):
+    Table(
+        "leases", MetaData(),
+        Column("name", String, primary_key=True),
+        Column("holder", String, nullable=False),
+        Column("expires_at", DateTime(timezone=True), nullable=False)
+    ).create(conn, checkfirst=True)
+
+
+def index_document_timestamps(conn: Connection):
+    documents = Table("documents", MetaData(), autoload_with=conn)
+    # Reaper scans by expiry; listings and stats by creation time
+    _create_index(conn, Index("ix_documents_expires_at", documents.c.expires_at))
+    _create_index(conn, Index("ix_documents_created_at", documents.c.created_at))
+
+
+def _documents_v4(metadata: MetaData, name: str = "documents") -> Table:
+    return Table(
+        name, metadata,
+        Column("id", String, primary_key=True),
+        Column("original_filename", String, nullable=False),
+        Column("encrypted_filename", String, nullable=False),
+        Column("passcode_hash", String, nullable=False),
+        Column("created_at", DateTime(timezone=True), server_default=func.now()),
+        Column("expires_at", DateTime(timezone=True), nullable=False),
+        Column("file_size", Integer, nullable=False),
+        Column("mime_type", String, nullable=True),
+        Column("blob_id", String, ForeignKey("blobs.id"), nullable=True)
+    )
+
+
+def add_blobs(conn: Connection):
+    """Reference-counted blobs; documents may now share an encrypted file"""
+    metadata = MetaData()
+    Table(
+        "blobs", metadata,
+        Column("id", String, primary_key=True),
+        Column("encrypted_filename", String, nullable=False, unique=True),
+        Column("ref_count", Integer, nullable=False),
+        Column("file_size", Integer, nullable=False),
+        Column("created_at", DateTime(timezone=True), server_default=func.now())
+    ).create(conn, checkfirst=True)
+
+    inspector = inspect(conn)
+    unique_filename = [
+        constraint for constraint in inspector.get_unique_constraints("documents")
+        if constraint["column_names"] == ["encrypted_filename"]
+    ]
+    if conn.dialect.name == "sqlite":
+        if unique_filename or "blob_id" not in {c["name"] for c in inspector.get_columns("documents")}:
+            # SQLite cannot drop constraints, so copy into a table without it
+            rebuilt = _documents_v4(metadata, "documents_v4")
+            rebuilt.create(conn)
+            columns = ", ".join(c.name for c in rebuilt.columns if c.name != "blob_id")
+            conn.execute(text(f"INSERT INTO documents_v4 ({columns}) SELECT {columns} FROM documents"))
+            conn.execute(text("DROP TABLE documents"))
+            conn.execute(text("ALTER TABLE documents_v4 RENAME TO documents"))
+    else:
+        for constraint in unique_filename:
+            conn.execute(text(f'ALTER TABLE documents DROP CONSTRAINT "{constraint["name"]}"'))
+        if "blob_id" not in {c["name"] for c in inspector.get_columns("documents")}:
+            conn.execute(text("ALTER TABLE documents ADD COLUMN blob_id VARCHAR REFERENCES blobs (id)"))
+
+    documents = Table("documents", MetaData(), autoload_with=conn)
+    for column in ("expires_at", "created_at", "encrypted_filename", "blob_id"):
+        _create_index(conn, Index(f"ix_documents_{column}", documents.c[column]))
+
+
+def add_encryption_header(conn: Connection):
+    """Header (with wrapped data key) of blobs encrypted by the browser in direct S3 mode"""
+    if "encryption_header" not in {c["name"] for c in inspect(conn).get_columns("documents")}:
+        conn.execute(text("ALTER TABLE documents ADD COLUMN encryption_header VARCHAR"))
+
+
+def add_share_id(conn: Connection):
+    """Groups the documents uploaded together through /api/shares"""
+    if "share_id" not in {c["name"] for c in inspect(conn).get_columns("documents")}:
+        conn.execute(text("ALTER TABLE documents ADD COLUMN share_id VARCHAR"))
+    documents = Table("documents", MetaData(), autoload_with=conn)
+    _create_index(conn, Index("ix_documents_share_id", documents.c.share_id))
+
+
+# (version, name, upgrade) in application order; never renumber or edit applied entries
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "create documents", create_documents),
+    (2, "create leases", create_leases),
+    (3, "index documents expires_at and created_at", index_document_timestamps),
+    (4, "add reference-counted blobs for dedup", add_blobs),
+    (5, "add documents encryption_header for direct uploads", add_encryption_header),
+    (6, "add documents share_id for batch shares", add_share_id),
+]
+
+
+def _applied_versions(conn: Connection) -> set:
+    schema_migrations.create(conn, checkfirst=True)
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+async def applied_versions() -> set:
+    async with engine.begin() as conn:
+        return await conn.run_sync(_applied_versions)
+
+
+async def upgrade() -> List[int]:
+    """Apply pending migrations and return the versions applied"""
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version in await applied_versions():
+            continue
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(migrate)
+                await conn.execute(schema_migrations.insert().values(
+                    version=version, name=name, applied_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Another instance applied it concurrently
+            continue
+        print(f"✓ Applied migration {version}: {name}")
+        applied.append(version)
+    return applied
+
+
+async def main(args):
+    try:
+        if args.status:
+            applied = await applied_versions()
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:4d}  {'applied' if version in applied else 'pending':8s}  {name}")
+        else:
+            applied = await upgrade()
+            print(f"{len(applied)} migration(s) applied")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    parser.add_argument("--status", action="store_true", help="List migrations without applying them")
+    asyncio.run(main(parser.parse_args()))
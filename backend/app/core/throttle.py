@@ -0,0 +1,217 @@
+"""
+Brute-force throttling for passcode checks.
+
+Every passcode attempt takes a token from a bucket per client IP and per
+document (or share) in check(), before the passcode is verified, so a burst of
+concurrent guesses is cut off before it reaches the password hash. Failed
+passcodes are also counted in fixed windows of THROTTLE_WINDOW seconds; a key
+that reaches its failure limit is locked out for THROTTLE_LOCKOUT seconds,
+doubling with every further lockout up to THROTTLE_MAX_LOCKOUT. Routes call
+check() first thing, so a rejected request gets 429 after a few dict
+operations, before any database query or passcode hash runs.
+
+The default backend is an in-process dict of compact tuples bounded by
+THROTTLE_MAX_ENTRIES. Instances behind a load balancer can share state through
+a backend implementing ThrottleBackend (e.g. on Redis), named in
+THROTTLE_BACKEND as "package.module:ClassName"; it is constructed with `max_entries`.
+"""
+import importlib
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from fastapi import HTTPException, Request
+from app.core.admission import client_address
+from app.core.config import (
+    THROTTLE_ENABLED, THROTTLE_BACKEND, THROTTLE_MAX_ENTRIES, THROTTLE_WINDOW,
+    THROTTLE_CLIENT_FAILURES, THROTTLE_DOCUMENT_FAILURES, THROTTLE_LOCKOUT, THROTTLE_MAX_LOCKOUT,
+    THROTTLE_CLIENT_ATTEMPT_RATE, THROTTLE_CLIENT_ATTEMPT_BURST,
+    THROTTLE_DOCUMENT_ATTEMPT_RATE, THROTTLE_DOCUMENT_ATTEMPT_BURST
+)
+
+
+class ThrottleBackend:
+    """
+    Attempt buckets and failure counters per key. Implementations must make
+    take_token and record_failure atomic per key, so concurrent attempts on
+    several instances are all counted.
+    """
+
+    async def take_token(self, key: str, rate: float, burst: int) -> float:
+        """
+        Take one token from the bucket for `key`, which holds up to `burst`
+        tokens and refills at `rate` per second. Returns 0 if a token was
+        taken, else the seconds until one is available.
+        """
+        raise NotImplementedError
+
+    async def locked_until(self, key: str) -> float:
+        """Wall-clock time until which `key` is locked out; 0 if it is not"""
+        raise NotImplementedError
+
+    async def record_failure(self, key: str, limit: int, window: float, lockout: float, max_lockout: float) -> float:
+        """
+        Count one failure for `key`. On reaching `limit` failures within the
+        window, lock the key out and return the lockout end time; else 0.
+        """
+        raise NotImplementedError
+
+    async def reset(self, key: str):
+        raise NotImplementedError
+
+    def size(self) -> Optional[int]:
+        """Number of keys tracked, if cheaply known"""
+        return None
+
+
+class MemoryThrottleBackend(ThrottleBackend):
+    """In-process counters: key -> (window start, failures, lockouts, locked until, expires)"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, int, int, float, float]]" = OrderedDict()
+        # key -> (tokens, last refill); an evicted bucket comes back full
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.evictions = 0
+
+    def _get(self, key: str, now: float) -> Optional[Tuple[float, int, int, float, float]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[4] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    async def take_token(self, key: str, rate: float, burst: int) -> float:
+        now = time.time()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+        self._buckets[key] = (tokens - 1, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_entries:
+            self._buckets.popitem(last=False)
+            self.evictions += 1
+        return 0
+
+    async def locked_until(self, key: str) -> float:
+        entry = self._get(key, time.time())
+        return entry[3] if entry is not None else 0
+
+    async def record_failure(self, key: str, limit: int, window: float, lockout: float, max_lockout: float) -> float:
+        now = time.time()
+        window_start, failures, lockouts, locked_until, _ = self._get(key, now) or (now, 0, 0, 0, 0)
+        if now - window_start >= window:
+            window_start, failures = now, 0
+        failures += 1
+        if failures >= limit:
+            # Backoff doubles per lockout the key has had since its counters last expired
+            locked_until = now + min(max_lockout, lockout * 2 ** lockouts)
+            lockouts += 1
+            window_start, failures = now, 0
+        # Lockout history is kept for max_lockout after the last lockout, so repeat offenders escalate
+        expires = max(window_start + window, locked_until + max_lockout if lockouts else 0)
+        self._entries[key] = (window_start, failures, lockouts, locked_until, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            # Oldest failure first; locked-out keys are the most recently touched
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return locked_until if locked_until > now else 0
+
+    async def reset(self, key: str):
+        self._entries.pop(key, None)
+
+    def size(self) -> Optional[int]:
+        return len(self._entries) + len(self._buckets)
+
+
+def _load_backend(path: str, max_entries: int) -> ThrottleBackend:
+    if path == "memory":
+        return MemoryThrottleBackend(max_entries)
+    module_name, _, class_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)(max_entries)
+
+
+def request_client(request: Request) -> str:
+    """Dependency: the client address used for throttling"""
+    return client_address(request.scope)
+
+
+class PasscodeThrottle:
+    """Rate-limits passcode attempts and rejects locked-out clients and documents"""
+
+    def __init__(self, backend: Optional[ThrottleBackend]):
+        self.backend = backend  # None disables throttling
+        self.throttled = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.lockouts = 0
+
+    async def check(self, client: str, subject: str):
+        """
+        Count a passcode attempt by `client` against `subject` (a document or
+        share ID). Raise 429 with Retry-After if either is locked out or out of
+        attempt tokens; call this before verifying the passcode.
+        """
+        if self.backend is None:
+            return
+        now = time.time()
+        locked_until = max(
+            await self.backend.locked_until(f"client:{client}"),
+            await self.backend.locked_until(f"subject:{subject}")
+        )
+        if locked_until > now:
+            self.throttled += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many failed passcode attempts, please retry later",
+                headers={"Retry-After": str(math.ceil(locked_until - now))}
+            )
+        wait = await self.backend.take_token(
+            f"attempts:client:{client}", THROTTLE_CLIENT_ATTEMPT_RATE, THROTTLE_CLIENT_ATTEMPT_BURST
+        ) or await self.backend.take_token(
+            f"attempts:subject:{subject}", THROTTLE_DOCUMENT_ATTEMPT_RATE, THROTTLE_DOCUMENT_ATTEMPT_BURST
+        )
+        if wait:
+            self.throttled += 1
+            self.rate_limited += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many passcode attempts, please retry shortly",
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+    async def failed(self, client: str, subject: str):
+        """Count a wrong passcode against both the client and the document, for lockouts"""
+        if self.backend is None:
+            return
+        self.failures += 1
+        for key, limit in ((f"client:{client}", THROTTLE_CLIENT_FAILURES), (f"subject:{subject}", THROTTLE_DOCUMENT_FAILURES)):
+            if await self.backend.record_failure(key, limit, THROTTLE_WINDOW, THROTTLE_LOCKOUT, THROTTLE_MAX_LOCKOUT):
+                self.lockouts += 1
+
+    async def succeeded(self, client: str):
+        """
+        Clear the client's failures after a correct passcode. The document's
+        failures stand, so a guessing campaign against it is not wiped out.
+        """
+        if self.backend is not None:
+            await self.backend.reset(f"client:{client}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.backend is not None,
+            "throttled": self.throttled,
+            "rate_limited": self.rate_limited,
+            "failures": self.failures,
+            "lockouts": self.lockouts,
+            "keys": self.backend.size() if self.backend is not None else 0
+        }
+
+
+# Singleton instance
+passcode_throttle = PasscodeThrottle(
+    _load_backend(THROTTLE_BACKEND, THROTTLE_MAX_ENTRIES) if THROTTLE_ENABLED else None
+)
@@ -0,0 +1,61 @@
+"""
+Deploy-time setup: schema migrations, S3 bucket validation and passcode cost
+calibration.
+
+The startup hook runs this on every instance unless FAST_STARTUP is set. For
+serverless deployments, run it once per release instead and pin the printed
+PASSCODE_HASH_COST, so cold starts do none of this work:
+
+    python -m app.deploy
+"""
+import asyncio
+import sys
+from app.core.config import USE_S3, PASSCODE_HASH_COST
+from app.services.passcodes import passcode_hasher
+
+
+async def prepare(strict: bool = False) -> int:
+    """
+    Migrate the schema, validate the S3 bucket and calibrate the passcode cost.
+    An invalid bucket is only a warning unless `strict`. Returns the passcode cost.
+    """
+    from app.core.migrations import upgrade
+
+    # Apply pending schema migrations (python -m app.core.migrations)
+    await upgrade()
+
+    # Validate S3 bucket if S3 is enabled
+    if USE_S3:
+        try:
+            from app.services.s3_storage import get_s3_storage_service
+            s3_storage = await get_s3_storage_service()
+            await s3_storage.validate_bucket()
+            print(f"✓ S3 bucket validated successfully: {s3_storage.bucket_name}")
+        except Exception as e:
+            if strict:
+                raise
+            print(f"⚠ Warning: S3 validation failed: {str(e)}")
+            print("⚠ Application will continue but S3 operations may fail")
+
+    # Time the passcode hash on this hardware to pick its cost
+    return await passcode_hasher.calibrate()
+
+
+async def main() -> int:
+    from app.core.database import engine
+    try:
+        cost = await prepare(strict=True)
+        if PASSCODE_HASH_COST is None:
+            print(f"Set PASSCODE_HASH_COST={cost} to skip calibration on cold starts (measured on this machine)")
+        return 0
+    except Exception as e:
+        print(f"✗ Deploy checks failed: {str(e)}")
+        return 1
+    finally:
+        from app.services.storage import close_storage_service
+        await close_storage_service()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
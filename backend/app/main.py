@@ -1,11 +1,22 @@
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import documents, health
-from app.core.database import engine, Base
+from fastapi.responses import JSONResponse
+from app.routers import documents, direct, shares, health, metrics
+from app.core.executor import cpu_executor, ExecutorSaturatedError
+from app.core.metrics import MetricsMiddleware
+from app.core.admission import UploadAdmissionMiddleware
+from app.core.config import REAPER_ENABLED, FAST_STARTUP
+from app.services.health import health_monitor
+from app.services.reaper import reaper
+from app.services.passcodes import passcode_hasher
 
 app = FastAPI(title="Secure Document Sharing")
 
+# Upload size limits and concurrency caps, applied before the body is parsed
+# (added first so CORS headers are still set on its 413/429/503 responses)
+app.add_middleware(UploadAdmissionMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -15,24 +26,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize database tables and validate S3 on startup
+# Request latency histograms and in-flight gauge (GET /metrics)
+app.add_middleware(MetricsMiddleware)
+
+# Backpressure: reject with 503 when the CPU executor queue is full
+@app.exception_handler(ExecutorSaturatedError)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturatedError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"}
+    )
+
+# Migrate the database schema and validate S3 on startup
+# (with FAST_STARTUP, `python -m app.deploy` does both at deploy time instead)
 @app.on_event("startup")
 async def init_db():
-    # Initialize database
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    if not FAST_STARTUP:
+        from app.deploy import prepare
+        await prepare()
     
-    # Validate S3 bucket if S3 is enabled
-    from app.core.config import USE_S3
-    if USE_S3:
-        try:
-            from app.services.s3_storage import get_s3_storage_service
-            s3_storage = await get_s3_storage_service()
-            await s3_storage.validate_bucket()
-            print(f"✓ S3 bucket validated successfully: {s3_storage.bucket_name}")
-        except Exception as e:
-            print(f"⚠ Warning: S3 validation failed: {str(e)}")
-            print("⚠ Application will continue but S3 operations may fail")
+    # Probe database/S3 health in the background; health endpoints serve the cached results
+    health_monitor.start()
+    
+    # Remove expired documents and their blobs in the background
+    if REAPER_ENABLED:
+        reaper.start()
+
+# Release long-lived resources on shutdown
+@app.on_event("shutdown")
+async def shutdown():
+    await health_monitor.stop()
+    await reaper.stop()
+    await passcode_hasher.stop()
+    # Drains the tiered backend's pending S3 uploads before the clients close
+    from app.services.storage import close_storage_service
+    await close_storage_service()
+    cpu_executor.shutdown()
 
 app.include_router(documents.router, prefix="/api")
-app.include_router(health.router, prefix="/api")
\ No newline at end of file
+app.include_router(direct.router, prefix="/api")
+app.include_router(shares.router, prefix="/api")
+app.include_router(health.router, prefix="/api")
+app.include_router(metrics.router)
\ No newline at end of file
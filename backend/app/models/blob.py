@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, DateTime, Integer
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    # Content-addressed encrypted blob shared by every document with the same content.
+    # The ID is "<key_id>:<HMAC-SHA256 of the plaintext>", so plaintext hashes never leave the server.
+    id = Column(String, primary_key=True)
+    encrypted_filename = Column(String, nullable=False, unique=True)
+    ref_count = Column(Integer, nullable=False)  # Documents pointing at this blob
+    file_size = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
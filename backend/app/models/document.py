@@ -1,6 +1,7 @@
-from sqlalchemy import Column, String, DateTime, Text, Integer
+from sqlalchemy import Column, String, DateTime, Text, Integer, ForeignKey
 from sqlalchemy.sql import func
 from app.core.database import Base
+from app.models.blob import Blob  # Registers the table referenced by Document.blob_id
 import uuid
 
 class Document(Base):
@@ -8,12 +9,18 @@ class Document(Base):
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     original_filename = Column(String, nullable=False)
-    encrypted_filename = Column(String, nullable=False, unique=True)
+    encrypted_filename = Column(String, nullable=False, index=True)  # Shared by documents with the same blob
     passcode_hash = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)  # Indexed for the expiry reaper
     file_size = Column(Integer, nullable=False)
     mime_type = Column(String, nullable=True)
+    # Set when stored through content-addressed dedup (DEDUP_ENABLED)
+    blob_id = Column(String, ForeignKey("blobs.id"), nullable=True, index=True)
+    # Base64 blob header (with the wrapped data key) of blobs encrypted by the browser (S3_DIRECT_ENABLED)
+    encryption_header = Column(String, nullable=True)
+    # Set on every document of a batch share (POST /api/shares)
+    share_id = Column(String, nullable=True, index=True)
     
     # For multi-user support and load balancer compatibility
     # Each document is isolated by its unique ID
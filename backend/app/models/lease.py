@@ -0,0 +1,11 @@
+from sqlalchemy import Column, String, DateTime
+from app.core.database import Base
+
+class Lease(Base):
+    __tablename__ = "leases"
+
+    # Named lock shared by all instances through the database,
+    # e.g. so that only one instance reaps expired documents at a time
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
@@ -0,0 +1,214 @@
+from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from jose import jwt, JWTError
+import base64
+import time
+import uuid
+
+from app.core.database import get_db
+from app.core.config import USE_S3, S3_DIRECT_ENABLED, S3_DIRECT_UPLOAD_TTL, S3_PRESIGN_TTL, MAX_FILE_SIZE
+from app.core.config import S3_MULTIPART_THRESHOLD, S3_MULTIPART_PART_SIZE
+from app.models.document import Document
+from app.services.passcodes import passcode_hasher
+from app.services.document_cache import document_cache, CachedDocument
+from app.services.encryption import encryption_service, StreamHeader
+from app.services.tokens import download_tokens, TOKEN_SECRET, TOKEN_ALGORITHM
+
+router = APIRouter()
+
+TICKET_SCOPE = "direct-upload"
+
+
+async def get_s3_storage():
+    """S3 presigns direct transfers for the s3 and tiered backends; imported on first use"""
+    from app.services.s3_storage import get_s3_storage_service
+    return await get_s3_storage_service()
+
+
+class DirectUploadRequest(BaseModel):
+    filename: str
+    mime_type: Optional[str] = None
+    size: int
+    passcode: str
+
+
+class UploadedPart(BaseModel):
+    part_number: int
+    etag: str
+
+
+class DirectUploadComplete(BaseModel):
+    ticket: str
+    parts: List[UploadedPart] = []
+
+
+def require_direct_mode():
+    if not (USE_S3 and S3_DIRECT_ENABLED):
+        raise HTTPException(status_code=404, detail="Direct S3 transfers are disabled")
+
+
+@router.post("/direct/uploads", dependencies=[Depends(require_direct_mode)])
+async def start_direct_upload(request: DirectUploadRequest):
+    """
+    Start a browser-encrypted upload straight to S3.
+    Returns presigned PUT (or multipart part) URLs, the blob header and data key
+    to encrypt with, and a signed ticket for /complete. Nothing is stored yet.
+    """
+    if request.size < 0 or request.size > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB"
+        )
+
+    storage = await get_s3_storage()
+    doc_id = str(uuid.uuid4())
+    encrypted_filename = storage.generate_unique_filename(request.filename)
+    passcode_hash = await passcode_hasher.hash(request.passcode)
+    header, data_key = encryption_service.client_header()
+    encrypted_size = header.encrypted_size(request.size)
+
+    claims = {
+        "sub": doc_id,
+        "scope": TICKET_SCOPE,
+        "exp": int(time.time()) + S3_DIRECT_UPLOAD_TTL,
+        "key": encrypted_filename,
+        "name": request.filename,
+        "mime": request.mime_type,
+        "hash": passcode_hash,
+        "header": base64.b64encode(header.pack()).decode()
+    }
+
+    try:
+        if encrypted_size < S3_MULTIPART_THRESHOLD:
+            url, headers = await storage.presign_put(encrypted_filename, S3_DIRECT_UPLOAD_TTL)
+            upload = {"method": "PUT", "url": url, "headers": headers}
+        else:
+            part_count = -(-encrypted_size // S3_MULTIPART_PART_SIZE)
+            upload_id, urls = await storage.presign_multipart(encrypted_filename, part_count, S3_DIRECT_UPLOAD_TTL)
+            claims["upload_id"] = upload_id
+            upload = {"method": "MULTIPART", "part_size": S3_MULTIPART_PART_SIZE, "part_urls": urls}
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Failed to prepare direct upload: {str(e)}")
+
+    return {
+        "doc_id": doc_id,
+        "ticket": jwt.encode(claims, TOKEN_SECRET, algorithm=TOKEN_ALGORITHM),
+        "header": claims["header"],
+        "data_key": base64.b64encode(data_key).decode(),
+        "chunk_size": header.chunk_size,
+        "encrypted_size": encrypted_size,
+        "upload": upload
+    }
+
+
+@router.post("/direct/uploads/{doc_id}/complete", dependencies=[Depends(require_direct_mode)])
+async def complete_direct_upload(
+    doc_id: str,
+    request: DirectUploadComplete,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Completion callback for a direct upload: assembles multipart uploads,
+    checks the stored blob against the issued header and records the Document.
+    """
+    try:
+        claims = jwt.decode(request.ticket, TOKEN_SECRET, algorithms=[TOKEN_ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired upload ticket")
+    if claims.get("sub") != doc_id or claims.get("scope") != TICKET_SCOPE:
+        raise HTTPException(status_code=401, detail="Invalid or expired upload ticket")
+
+    # Completion callbacks may be retried; the first one recorded the document
+    if await document_cache.get(db, doc_id):
+        return {"link": f"/view/{doc_id}", "doc_id": doc_id}
+
+    storage = await get_s3_storage()
+    encrypted_filename = claims["key"]
+    header_bytes = base64.b64decode(claims["header"])
+    header = StreamHeader.unpack(header_bytes)
+
+    try:
+        if claims.get("upload_id"):
+            if not request.parts:
+                raise ValueError("Multipart upload requires the uploaded parts")
+            await storage.complete_multipart(
+                encrypted_filename,
+                claims["upload_id"],
+                {part.part_number: part.etag for part in request.parts}
+            )
+        encrypted_size = await storage.stat(encrypted_filename)
+        # The blob must carry the header (and wrapped key) issued for this upload
+        if (await storage.read_blob_prefix(encrypted_filename))[:header.size] != header_bytes:
+            raise ValueError("Uploaded blob does not match the issued encryption header")
+        file_size = header.plaintext_size(encrypted_size)
+        if file_size > MAX_FILE_SIZE:
+            raise ValueError(f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB")
+    except FileNotFoundError:
+        raise HTTPException(status_code=400, detail="Upload not found in storage")
+    except ValueError as e:
+        await storage.delete_file(encrypted_filename)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    document = Document(
+        id=doc_id,
+        original_filename=claims["name"],
+        encrypted_filename=encrypted_filename,
+        passcode_hash=claims["hash"],
+        expires_at=datetime.utcnow() + timedelta(hours=24),
+        file_size=file_size,
+        mime_type=claims.get("mime"),
+        encryption_header=claims["header"]
+    )
+    db.add(document)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent retry recorded it first; drop our negative lookup
+        await db.rollback()
+        await document_cache.invalidate(doc_id)
+        return {"link": f"/view/{doc_id}", "doc_id": doc_id}
+    await db.refresh(document)
+    await document_cache.put(doc_id, CachedDocument.from_row(document))
+
+    return {"link": f"/view/{doc_id}", "doc_id": doc_id}
+
+
+@router.get("/direct/downloads/{doc_id}", dependencies=[Depends(require_direct_mode)])
+async def direct_download(
+    doc_id: str,
+    token: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Presigned GET URL and data key for a browser-encrypted document, authorized
+    by the download token from /access. The browser decrypts the blob itself.
+    Documents encrypted by the server answer 409; use /download for those.
+    """
+    doc = await document_cache.get(db, doc_id)
+
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    if datetime.utcnow() > doc.expires_at:
+        raise HTTPException(status_code=410, detail="Document has expired")
+
+    if not download_tokens.verify(token, doc_id):
+        raise HTTPException(status_code=401, detail="Invalid or expired download token")
+
+    if not doc.encryption_header:
+        raise HTTPException(status_code=409, detail="Document is not available for direct download")
+
+    header = StreamHeader.unpack(base64.b64decode(doc.encryption_header))
+    storage = await get_s3_storage()
+
+    return {
+        "url": await storage.presign_get(doc.encrypted_filename, S3_PRESIGN_TTL),
+        "data_key": base64.b64encode(encryption_service.unwrap_data_key(header)).decode(),
+        "filename": doc.original_filename,
+        "mime_type": doc.mime_type,
+        "file_size": doc.file_size
+    }
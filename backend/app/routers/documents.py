@@ -1,23 +1,29 @@
-from fastapi import APIRouter, UploadFile, Form, HTTPException, Depends, Response
+from fastapi import APIRouter, UploadFile, Form, HTTPException, Depends, Header, Response
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import AsyncIterator, Optional, Tuple
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
-import bcrypt
+from sqlalchemy import delete
 import uuid
-import io
 
-from app.core.database import get_db, engine, Base
+from app.core.database import get_db
 from app.models.document import Document
 from app.services.storage import get_storage_service
-from app.core.config import USE_S3
+from app.core.executor import cpu_executor, ExecutorSaturatedError
+from app.services.tokens import download_tokens
+from app.services.document_cache import document_cache, CachedDocument
+from app.services.dedup import blob_registry
+from app.services.passcodes import passcode_hasher
+from app.core.metrics import in_flight, count_bytes
+from app.core.throttle import passcode_throttle, request_client
 
 router = APIRouter()
 
 class AccessRequest(BaseModel):
     passcode: str
 
+
 @router.post("/upload")
 async def upload(
     file: UploadFile, 
@@ -28,6 +34,7 @@ async def upload(
     Upload a document with encryption and unique filename handling.
     Supports multiple users and is load balancer compatible.
     """
+    stored_filename = None  # Blob written by this request, removed again on failure
     try:
         # Get storage service (S3 or local)
         storage = await get_storage_service()
@@ -35,14 +42,31 @@ async def upload(
         # Generate unique document ID
         doc_id = str(uuid.uuid4())
         
-        # Generate unique encrypted filename to handle duplicates
-        encrypted_filename = storage.generate_unique_filename(file.filename)
+        # Hash the passcode first so a saturated executor rejects before any bytes are stored;
+        # the encryption of an admitted upload then waits for workers instead of failing
+        passcode_hash = await passcode_hasher.hash(passcode)
         
-        # Save and encrypt the file
-        file_size = await storage.save_encrypted_file(file, encrypted_filename)
+        # Dedup: identical content already stored gets another reference instead of a new blob
+        blob_id = await blob_registry.content_id(file) if blob_registry.enabled else None
+        blob = await blob_registry.acquire(db, blob_id) if blob_id else None
         
-        # Hash the passcode
-        passcode_hash = bcrypt.hashpw(passcode.encode(), bcrypt.gensalt()).decode()
+        if blob is not None:
+            encrypted_filename, file_size = blob.encrypted_filename, blob.file_size
+        else:
+            # Generate unique encrypted filename to handle duplicates
+            encrypted_filename = storage.generate_unique_filename(file.filename)
+            
+            # Save and encrypt the file
+            with in_flight("upload"):
+                file_size = await storage.save_encrypted_file(file, encrypted_filename)
+            stored_filename = encrypted_filename
+            
+            if blob_id:
+                encrypted_filename, kept = await blob_registry.register(db, blob_id, encrypted_filename, file_size)
+                if not kept:
+                    # A concurrent upload stored the same content first
+                    await storage.delete_files([stored_filename])
+                    stored_filename = None
         
         # Calculate expiration time
         expires_at = datetime.utcnow() + timedelta(hours=24)
@@ -55,19 +79,23 @@ async def upload(
             passcode_hash=passcode_hash,
             expires_at=expires_at,
             file_size=file_size,
-            mime_type=file.content_type
+            mime_type=file.content_type,
+            blob_id=blob_id
         )
         
         db.add(document)
         await db.commit()
         await db.refresh(document)
         
+        # Share links are usually opened right away, so warm the metadata cache
+        await document_cache.put(doc_id, CachedDocument.from_row(document))
+        
         return {"link": f"/view/{doc_id}", "doc_id": doc_id}
     
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    except HTTPException:
-        # Re-raise HTTP exceptions as-is
+    except (HTTPException, ExecutorSaturatedError):
+        # Re-raise HTTP and backpressure exceptions as-is
         raise
     except Exception as e:
         # Log the full error for debugging
@@ -77,12 +105,9 @@ async def upload(
         print(f"Traceback: {error_trace}")
         
         # Clean up file if database operation fails
-        if 'encrypted_filename' in locals() and 'storage' in locals():
+        if stored_filename:
             try:
-                if USE_S3:
-                    await storage.delete_file(encrypted_filename)
-                else:
-                    storage.delete_file(encrypted_filename)
+                await storage.delete_file(stored_filename)
             except:
                 pass  # Ignore cleanup errors
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
@@ -91,15 +116,18 @@ async def upload(
 async def access(
     doc_id: str, 
     request: AccessRequest,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    client: str = Depends(request_client)
 ):
     """
     Verify passcode and grant access to document.
     Works with load balancers as it's stateless (uses database).
     """
-    # Query database (works across multiple instances)
-    result = await db.execute(select(Document).where(Document.id == doc_id))
-    doc = result.scalar_one_or_none()
+    # Locked out after repeated wrong passcodes: reject before the database or bcrypt
+    await passcode_throttle.check(client, doc_id)
+    
+    # Read-through metadata cache in front of the database (works across multiple instances)
+    doc = await document_cache.get(db, doc_id)
     
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
@@ -109,29 +137,98 @@ async def access(
         raise HTTPException(status_code=410, detail="Document has expired")
     
     # Verify passcode
-    if not bcrypt.checkpw(request.passcode.encode(), doc.passcode_hash.encode()):
+    if not await passcode_hasher.verify(request.passcode, doc.passcode_hash, doc.id):
+        await passcode_throttle.failed(client, doc_id)
         raise HTTPException(status_code=403, detail="Invalid passcode")
+    await passcode_throttle.succeeded(client)
+    
+    # Short-lived token so downloads (and range requests) skip bcrypt
+    token, token_expires = download_tokens.issue(doc.id, doc.expires_at)
     
     return {
         "message": "Access granted",
         "filename": doc.original_filename,
         "mime_type": doc.mime_type,
-        "file_size": doc.file_size
+        "file_size": doc.file_size,
+        "token": token,
+        "token_expires_at": token_expires
     }
 
+def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` Range header into an inclusive (start, end) pair.
+    Returns None when the whole file should be served (no, malformed or
+    multi-range header) and raises 416 for unsatisfiable ranges.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_str, _, end_str = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, file_size - int(end_str))
+            end = file_size - 1
+    except ValueError:
+        return None
+    if start > end and start_str and end_str:
+        return None
+    if start >= file_size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+    return start, min(end, file_size - 1)
+
+async def prime_stream(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Pull the first chunk of a storage stream eagerly so that storage errors
+    (missing blob, S3 failures) surface before the response headers are sent.
+    The returned body counts as an in-flight download while it is streamed.
+    A saturated CPU executor is rejected here with 503; once admitted, the
+    stream's decrypt calls wait for a worker instead of failing mid-body.
+    """
+    cpu_executor.admit()
+    try:
+        first_chunk = await stream.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    
+    async def body():
+        with in_flight("download"):
+            if first_chunk:
+                count_bytes("download_sent", len(first_chunk))
+                yield first_chunk
+            async for chunk in stream:
+                count_bytes("download_sent", len(chunk))
+                yield chunk
+    
+    return body()
+
 @router.get("/download/{doc_id}")
 async def download(
     doc_id: str,
-    passcode: str,
-    db: AsyncSession = Depends(get_db)
+    token: Optional[str] = None,
+    passcode: Optional[str] = None,
+    range: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+    client: str = Depends(request_client)
 ):
     """
-    Download decrypted document after passcode verification.
+    Download decrypted document.
+    Authorized by the signed token from /access (no bcrypt), or by passcode.
+    Decrypts while streaming and supports single HTTP byte ranges.
     Supports multiple users and load balancers.
     """
-    # Query database
-    result = await db.execute(select(Document).where(Document.id == doc_id))
-    doc = result.scalar_one_or_none()
+    # Passcode downloads are throttled like /access; token downloads never run bcrypt
+    if token is None:
+        await passcode_throttle.check(client, doc_id)
+    
+    # Metadata cache, falling back to the database
+    doc = await document_cache.get(db, doc_id)
     
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
@@ -140,31 +237,52 @@ async def download(
     if datetime.utcnow() > doc.expires_at:
         raise HTTPException(status_code=410, detail="Document has expired")
     
-    # Verify passcode
-    if not bcrypt.checkpw(passcode.encode(), doc.passcode_hash.encode()):
+    # Verify download token, falling back to the passcode
+    if token is not None:
+        if not download_tokens.verify(token, doc_id):
+            raise HTTPException(status_code=401, detail="Invalid or expired download token")
+    elif passcode is None:
+        raise HTTPException(status_code=401, detail="Download token or passcode required")
+    elif not await passcode_hasher.verify(passcode, doc.passcode_hash, doc.id):
+        await passcode_throttle.failed(client, doc_id)
         raise HTTPException(status_code=403, detail="Invalid passcode")
     
+    byte_range = parse_range_header(range, doc.file_size)
+    start, end = byte_range or (0, doc.file_size - 1)
+    
+    headers = {
+        "Content-Disposition": f'attachment; filename="{doc.original_filename}"',
+        "Content-Length": str(max(0, end - start + 1)),
+        "Accept-Ranges": "bytes"
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{doc.file_size}"
+    
     try:
         # Get storage service
         storage = await get_storage_service()
         
-        # Get and decrypt file
-        decrypted_content = await storage.get_decrypted_file(doc.encrypted_filename)
-        
-        # Create file-like object for streaming
-        file_stream = io.BytesIO(decrypted_content)
+        # Decrypt only the requested segments, chunk by chunk
+        try:
+            file_stream = await prime_stream(storage.get_decrypted_file(doc.encrypted_filename, start, end))
+        except FileNotFoundError:
+            # A cached row can point at a blob that key rotation has replaced; re-read it once
+            await document_cache.invalidate(doc_id)
+            doc = await document_cache.get(db, doc_id)
+            if not doc:
+                raise
+            file_stream = await prime_stream(storage.get_decrypted_file(doc.encrypted_filename, start, end))
         
-        # Return file as streaming response
         return StreamingResponse(
-            io.BytesIO(decrypted_content),
+            file_stream,
+            status_code=206 if byte_range else 200,
             media_type=doc.mime_type or "application/octet-stream",
-            headers={
-                "Content-Disposition": f'attachment; filename="{doc.original_filename}"',
-                "Content-Length": str(doc.file_size)
-            }
+            headers=headers
         )
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found in storage")
+    except ExecutorSaturatedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve file: {str(e)}")
 
@@ -172,31 +290,43 @@ async def download(
 async def delete_document(
     doc_id: str,
     passcode: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    client: str = Depends(request_client)
 ):
     """
     Delete a document after passcode verification.
     Useful for cleanup operations.
     """
-    result = await db.execute(select(Document).where(Document.id == doc_id))
-    doc = result.scalar_one_or_none()
+    await passcode_throttle.check(client, doc_id)
+    
+    doc = await document_cache.get(db, doc_id)
     
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
     # Verify passcode
-    if not bcrypt.checkpw(passcode.encode(), doc.passcode_hash.encode()):
+    if not await passcode_hasher.verify(passcode, doc.passcode_hash):
+        await passcode_throttle.failed(client, doc_id)
         raise HTTPException(status_code=403, detail="Invalid passcode")
     
-    # Get storage service and delete file
     storage = await get_storage_service()
-    if USE_S3:
-        await storage.delete_file(doc.encrypted_filename)
+    if doc.blob_id:
+        # Deduplicated: drop this document's reference; the blob goes with the last one
+        result = await db.execute(delete(Document).where(Document.id == doc_id))
+        orphaned = await blob_registry.release(db, [doc.blob_id]) if result.rowcount else []
+        await db.commit()
+        if await storage.delete_files(orphaned):
+            print(f"Failed to delete unreferenced blob(s): {orphaned}")
     else:
-        storage.delete_file(doc.encrypted_filename)
+        # Delete file from storage
+        await storage.delete_file(doc.encrypted_filename)
+        
+        # Delete database record
+        await db.execute(delete(Document).where(Document.id == doc_id))
+        await db.commit()
+    await document_cache.invalidate(doc_id)
     
-    # Delete database record
-    await db.execute(delete(Document).where(Document.id == doc_id))
-    await db.commit()
+    # Outstanding download tokens must stop working immediately
+    download_tokens.revoke(doc_id)
     
     return {"message": "Document deleted successfully"}
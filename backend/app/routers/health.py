@@ -1,25 +1,60 @@
-from fastapi import APIRouter, HTTPException
-from app.core.config import USE_S3
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.core.config import USE_S3, S3_BUCKET_NAME, STORAGE_BACKEND
+from app.core.executor import cpu_executor
+from app.core.admission import upload_admission, batch_admission
+from app.core.throttle import passcode_throttle
+from app.services.health import health_monitor
+from app.services.reaper import reaper
+from app.services.passcodes import passcode_hasher
+from app.services.document_cache import document_cache
+from app.services.blob_cache import blob_cache
+from app.services.storage import storage_stats
 
 router = APIRouter()
 
 @router.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """
+    Health check endpoint.
+    Reports the last background probe results; never calls the database or S3.
+    """
+    checks = health_monitor.snapshot()
     status = {
         "status": "healthy",
-        "storage": "S3" if USE_S3 else "Local"
+        "storage": {"local": "Local", "s3": "S3", "tiered": "Tiered"}.get(STORAGE_BACKEND, STORAGE_BACKEND),
+        "checks": checks,
+        "cpu_executor": cpu_executor.stats(),
+        "upload_admission": upload_admission.stats(),
+        "batch_admission": batch_admission.stats(),
+        "passcode_throttle": passcode_throttle.stats(),
+        "reaper": reaper.stats(),
+        "passcode_hashing": passcode_hasher.stats(),
+        "document_cache": document_cache.stats(),
+        "blob_cache": blob_cache.stats(),
+        "storage_backend": storage_stats()
     }
-    
+
     if USE_S3:
-        try:
-            from app.services.s3_storage import get_s3_storage_service
-            s3_storage = await get_s3_storage_service()
-            await s3_storage.validate_bucket()
-            status["s3_bucket"] = s3_storage.bucket_name
-            status["s3_status"] = "connected"
-        except Exception as e:
-            status["s3_status"] = "error"
-            status["s3_error"] = str(e)
-    
+        s3_check = checks["s3"]
+        status["s3_bucket"] = S3_BUCKET_NAME
+        status["s3_status"] = "connected" if s3_check["status"] == "ok" else s3_check["status"]
+        if "error" in s3_check:
+            status["s3_error"] = s3_check["error"]
+
     return status
+
+@router.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and serving requests (no I/O)"""
+    return {"status": "alive"}
+
+@router.get("/health/ready")
+async def readiness():
+    """Readiness probe: 200 if the last background probes succeeded, 503 otherwise"""
+    checks = health_monitor.snapshot()
+    ready = health_monitor.is_ready(checks)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "checks": checks}
+    )
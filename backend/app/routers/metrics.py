@@ -0,0 +1,81 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from app.core.admission import upload_admission, batch_admission
+from app.core.throttle import passcode_throttle
+from app.core.executor import cpu_executor
+from app.core.metrics import metrics
+from app.services.document_cache import document_cache
+from app.services.blob_cache import blob_cache
+from app.services.storage import storage_stats
+
+router = APIRouter()
+
+EXECUTOR_IN_FLIGHT = metrics.gauge("cpu_executor_in_flight", "Calls running or queued on the CPU executor")
+EXECUTOR_QUEUED = metrics.gauge("cpu_executor_queued", "Calls waiting for a CPU executor worker")
+EXECUTOR_REJECTED = metrics.counter("cpu_executor_rejected_total", "Calls rejected because the CPU executor was saturated")
+UPLOADS_IN_FLIGHT = metrics.gauge("upload_admission_in_flight", "Uploads admitted and in progress")
+UPLOAD_BYTES_IN_FLIGHT = metrics.gauge("upload_admission_bytes_in_flight", "Declared request bytes of uploads in progress")
+UPLOADS_REJECTED = metrics.counter("upload_admission_rejected_total", "Uploads rejected before processing", ("reason",))
+BATCHES_IN_FLIGHT = metrics.gauge("batch_admission_in_flight", "Batch share uploads admitted and in progress")
+BATCH_BYTES_IN_FLIGHT = metrics.gauge("batch_admission_bytes_in_flight", "Declared request bytes of batch uploads in progress")
+BATCHES_REJECTED = metrics.counter("batch_admission_rejected_total", "Batch share uploads rejected before processing", ("reason",))
+THROTTLED = metrics.counter("passcode_throttled_total", "Passcode attempts rejected with 429 before verification")
+PASSCODE_FAILURES = metrics.counter("passcode_failures_total", "Wrong passcodes counted by the throttle")
+THROTTLE_LOCKOUTS = metrics.counter("passcode_lockouts_total", "Client or document lockouts started after repeated failures")
+CACHE_LOOKUPS = metrics.counter("document_cache_lookups_total", "Document metadata cache lookups by result", ("result",))
+BLOB_CACHE_LOOKUPS = metrics.counter(
+    "blob_cache_lookups_total", "Encrypted blob cache lookups: hits, coalesced (joined a fetch in progress), misses", ("result",)
+)
+BLOB_CACHE_EVICTIONS = metrics.counter("blob_cache_evictions_total", "Blobs evicted from the blob cache to stay within its budget")
+BLOB_CACHE_BYTES = metrics.gauge("blob_cache_bytes", "Encrypted bytes held in the blob cache")
+BLOB_CACHE_SERVED = metrics.counter("blob_cache_served_bytes_total", "Encrypted bytes served from the blob cache instead of S3")
+TIERED_PENDING = metrics.gauge("tiered_storage_pending_uploads", "Blobs stored locally and waiting for their S3 upload")
+TIERED_UPLOAD_FAILURES = metrics.counter("tiered_storage_upload_failures_total", "Failed S3 write-back attempts (retried)")
+TIERED_READS = metrics.counter("tiered_storage_reads_total", "Tiered storage reads by tier served from", ("tier",))
+
+
+def collect_component_stats():
+    executor = cpu_executor.stats()
+    EXECUTOR_IN_FLIGHT.set(executor["in_flight"])
+    EXECUTOR_QUEUED.set(executor["queued"])
+    EXECUTOR_REJECTED.set(executor["rejected"])
+    admission = upload_admission.stats()
+    UPLOADS_IN_FLIGHT.set(admission["in_flight"])
+    UPLOAD_BYTES_IN_FLIGHT.set(admission["bytes_in_flight"])
+    for reason, count in admission["rejected"].items():
+        UPLOADS_REJECTED.set(count, reason=reason)
+    batches = batch_admission.stats()
+    BATCHES_IN_FLIGHT.set(batches["in_flight"])
+    BATCH_BYTES_IN_FLIGHT.set(batches["bytes_in_flight"])
+    for reason, count in batches["rejected"].items():
+        BATCHES_REJECTED.set(count, reason=reason)
+    throttle = passcode_throttle.stats()
+    THROTTLED.set(throttle["throttled"])
+    PASSCODE_FAILURES.set(throttle["failures"])
+    THROTTLE_LOCKOUTS.set(throttle["lockouts"])
+    cache = document_cache.stats()
+    for result in ("hits", "negative_hits", "misses"):
+        CACHE_LOOKUPS.set(cache[result], result=result)
+    blobs = blob_cache.stats()
+    for result in ("hits", "coalesced", "misses"):
+        BLOB_CACHE_LOOKUPS.set(blobs[result], result=result)
+    BLOB_CACHE_EVICTIONS.set(blobs["evictions"])
+    BLOB_CACHE_BYTES.set(blobs["bytes"])
+    BLOB_CACHE_SERVED.set(blobs["bytes_served"])
+    storage = storage_stats()
+    if storage["backend"] == "tiered" and "pending_uploads" in storage:
+        TIERED_PENDING.set(storage["pending_uploads"])
+        TIERED_UPLOAD_FAILURES.set(storage["upload_failures"])
+        TIERED_READS.set(storage["local_reads"], tier="local")
+        TIERED_READS.set(storage["remote_reads"], tier="s3")
+
+
+metrics.add_collector(collect_component_stats)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Metrics in the Prometheus text exposition format"""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,363 @@
+"""
+Batch shares: many files under one passcode and one share ID.
+
+Every file of a share is stored as its own document tagged with the share ID,
+so each one still works with /access and /download. The passcode is hashed
+once, files are encrypted and stored BATCH_UPLOAD_CONCURRENCY at a time, and
+all rows are inserted in a single transaction. The share downloads as a ZIP
+that is assembled from the decrypted chunks while it is sent.
+"""
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+from collections import Counter
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, insert, select
+import asyncio
+import posixpath
+import uuid
+import zipfile
+
+from app.core.config import BATCH_MAX_FILES, BATCH_UPLOAD_CONCURRENCY
+from app.core.database import get_db
+from app.core.executor import ExecutorSaturatedError
+from app.core.metrics import in_flight
+from app.core.throttle import passcode_throttle, request_client
+from app.models.document import Document
+from app.routers.documents import prime_stream
+from app.services.dedup import blob_registry
+from app.services.document_cache import document_cache
+from app.services.passcodes import passcode_hasher
+from app.services.storage import get_storage_service
+from app.services.tokens import download_tokens
+
+router = APIRouter()
+
+# (encrypted_filename, file_size, blob_id) of a stored file
+StoredFile = Tuple[str, int, Optional[str]]
+
+
+class ShareAccessRequest(BaseModel):
+    passcode: str
+
+
+async def bounded_gather(items: List, operation: Callable[..., Awaitable]) -> List:
+    """
+    Run `operation(item)` for every item, BATCH_UPLOAD_CONCURRENCY at a time.
+    Waits for all of them before raising the first error, so nothing is still
+    writing to storage while the caller cleans up.
+    """
+    semaphore = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+
+    async def bounded(item):
+        async with semaphore:
+            return await operation(item)
+
+    results = await asyncio.gather(*(bounded(item) for item in items), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def store_files(db: AsyncSession, storage, files: List[UploadFile], stored: List[str]) -> List[StoredFile]:
+    """
+    Encrypt and store every file, appending each blob written to `stored` so
+    the caller can remove them if the share is not committed. With dedup,
+    content already stored (or repeated within the batch) is written once and
+    referenced, and the blob references join the caller's transaction.
+    """
+    async def save(file: UploadFile) -> Tuple[str, int]:
+        encrypted_filename = storage.generate_unique_filename(file.filename)
+        with in_flight("upload"):
+            file_size = await storage.save_encrypted_file(file, encrypted_filename)
+        stored.append(encrypted_filename)
+        return encrypted_filename, file_size
+
+    if not blob_registry.enabled:
+        return [(filename, size, None) for filename, size in await bounded_gather(files, save)]
+
+    blob_ids = await bounded_gather(files, blob_registry.content_id)
+    references = Counter(blob_ids)
+    file_by_blob = dict(zip(blob_ids, files))
+    saved: Dict[str, Tuple[str, int]] = {}
+
+    # A concurrent upload can register the same content between our acquire and flush; start over then
+    for _ in range(3):
+        blobs: Dict[str, Tuple[str, int]] = {}
+        for blob_id, count in references.items():
+            blob = await blob_registry.acquire(db, blob_id, count)
+            if blob is not None:
+                blobs[blob_id] = (blob.encrypted_filename, blob.file_size)
+        missing = [blob_id for blob_id in references if blob_id not in blobs and blob_id not in saved]
+        saved.update(zip(missing, await bounded_gather([file_by_blob[blob_id] for blob_id in missing], save)))
+        new = {
+            blob_id: (*saved[blob_id], references[blob_id])
+            for blob_id in references if blob_id not in blobs
+        }
+        if not new or await blob_registry.register_many(db, new):
+            blobs.update({blob_id: saved[blob_id] for blob_id in new})
+            break
+    else:
+        raise RuntimeError("Shared blobs are being deleted, retry the upload")
+
+    # Blobs we wrote but lost to a concurrent upload of the same content
+    unused = [filename for blob_id, (filename, _) in saved.items() if blobs[blob_id][0] != filename]
+    if unused:
+        await storage.delete_files(unused)
+        for filename in unused:
+            stored.remove(filename)
+    return [(*blobs[blob_id], blob_id) for blob_id in blob_ids]
+
+
+def manifest(share_id: str, docs) -> Dict:
+    return {
+        "share_id": share_id,
+        "expires_at": docs[0].expires_at,
+        "files": [
+            {
+                "doc_id": doc.id,
+                "filename": doc.original_filename,
+                "file_size": doc.file_size,
+                "mime_type": doc.mime_type,
+                "link": f"/view/{doc.id}"
+            }
+            for doc in docs
+        ]
+    }
+
+
+@router.post("/shares")
+async def create_share(
+    files: List[UploadFile] = File(...),
+    passcode: str = Form(...),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Upload several files under one passcode and share ID.
+    Returns the share manifest; every file also gets its own document link.
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"A share holds at most {BATCH_MAX_FILES} files")
+
+    stored: List[str] = []  # Blobs written by this request, removed again on failure
+    committed = False
+    storage = await get_storage_service()
+    try:
+        share_id = str(uuid.uuid4())
+
+        # One hash for the whole share, before any bytes are stored
+        passcode_hash = await passcode_hasher.hash(passcode)
+
+        stored_files = await store_files(db, storage, files, stored)
+
+        expires_at = datetime.utcnow() + timedelta(hours=24)
+        rows = [
+            {
+                "id": str(uuid.uuid4()),
+                "original_filename": file.filename,
+                "encrypted_filename": encrypted_filename,
+                "passcode_hash": passcode_hash,
+                "expires_at": expires_at,
+                "file_size": file_size,
+                "mime_type": file.content_type,
+                "blob_id": blob_id,
+                "share_id": share_id
+            }
+            for file, (encrypted_filename, file_size, blob_id) in zip(files, stored_files)
+        ]
+
+        # Bulk insert in the transaction that holds the blob references
+        await db.execute(insert(Document), rows)
+        await db.commit()
+        committed = True
+
+        return manifest(share_id, [Document(**row) for row in rows])
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (HTTPException, ExecutorSaturatedError):
+        raise
+    except Exception as e:
+        import traceback
+        print(f"Share upload error: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    finally:
+        if not committed and stored:
+            await db.rollback()
+            failed = await storage.delete_files(stored)
+            if failed:
+                print(f"Failed to delete blob(s) of an aborted share: {failed}")
+
+
+async def load_share(db: AsyncSession, share_id: str) -> List[Document]:
+    """Documents of a share ordered by filename; 404 if none are left, 410 once expired"""
+    docs = (await db.execute(
+        select(Document).where(Document.share_id == share_id).order_by(Document.original_filename, Document.id)
+    )).scalars().all()
+    if not docs:
+        raise HTTPException(status_code=404, detail="Share not found")
+    if datetime.utcnow() > docs[0].expires_at:
+        raise HTTPException(status_code=410, detail="Share has expired")
+    return docs
+
+
+@router.post("/shares/{share_id}/access")
+async def access_share(
+    share_id: str,
+    request: ShareAccessRequest,
+    db: AsyncSession = Depends(get_db),
+    client: str = Depends(request_client)
+):
+    """Verify the passcode once and return the manifest with a download token for the ZIP"""
+    await passcode_throttle.check(client, share_id)
+    docs = await load_share(db, share_id)
+
+    if not await passcode_hasher.verify(request.passcode, docs[0].passcode_hash):
+        await passcode_throttle.failed(client, share_id)
+        raise HTTPException(status_code=403, detail="Invalid passcode")
+    await passcode_throttle.succeeded(client)
+
+    token, token_expires = download_tokens.issue(share_id, docs[0].expires_at)
+    return {**manifest(share_id, docs), "token": token, "token_expires_at": token_expires}
+
+
+class ZipSink:
+    """Write-only file object for zipfile; whatever was written is taken with drain()"""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def archive_names(docs) -> List[str]:
+    """Flat, unique ZIP entry names; later duplicates become "name (2).ext" and so on"""
+    names, seen = [], set()
+    for doc in docs:
+        name = posixpath.basename(doc.original_filename.replace("\\", "/")) or "file"
+        stem, ext = posixpath.splitext(name)
+        candidate, n = name, 1
+        while candidate in seen:
+            n += 1
+            candidate = f"{stem} ({n}){ext}"
+        seen.add(candidate)
+        names.append(candidate)
+    return names
+
+
+async def zip_stream(storage, docs) -> AsyncIterator[bytes]:
+    """
+    ZIP of the decrypted documents. Entries use data descriptors, so the
+    archive is written front to back and only one decrypted chunk is held at
+    a time. They are deflated at level 0 (stored deflate blocks): readers such
+    as Java's ZipInputStream reject ZIP_STORED entries with data descriptors,
+    and level 0 keeps the event loop free of compression work.
+    """
+    sink = ZipSink()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=0)
+    for doc, name in zip(docs, archive_names(docs)):
+        # Opened by name so the entry takes the archive's compression level (a ZipInfo
+        # would get zlib's default); ZIP64 is decided up front as zipfile does for known sizes
+        zip64 = doc.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        with archive.open(name, mode="w", force_zip64=zip64) as entry:
+            async for chunk in storage.get_decrypted_file(doc.encrypted_filename):
+                entry.write(chunk)
+                yield sink.drain()
+        yield sink.drain()
+    archive.close()
+    yield sink.drain()
+
+
+@router.get("/shares/{share_id}/download")
+async def download_share(
+    share_id: str,
+    token: Optional[str] = None,
+    passcode: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    client: str = Depends(request_client)
+):
+    """
+    Download every file of a share as one ZIP, built while streaming.
+    Authorized by the token from /shares/{share_id}/access, or by passcode.
+    """
+    if token is None:
+        await passcode_throttle.check(client, share_id)
+    docs = await load_share(db, share_id)
+
+    if token is not None:
+        if not download_tokens.verify(token, share_id):
+            raise HTTPException(status_code=401, detail="Invalid or expired download token")
+    elif passcode is None:
+        raise HTTPException(status_code=401, detail="Download token or passcode required")
+    elif not await passcode_hasher.verify(passcode, docs[0].passcode_hash):
+        await passcode_throttle.failed(client, share_id)
+        raise HTTPException(status_code=403, detail="Invalid passcode")
+
+    try:
+        storage = await get_storage_service()
+        # Errors reading the first file still become proper error responses
+        body = await prime_stream(chunk async for chunk in zip_stream(storage, docs) if chunk)
+        return StreamingResponse(
+            body,
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="share-{share_id[:8]}.zip"'}
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found in storage")
+    except ExecutorSaturatedError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to retrieve files: {str(e)}")
+
+
+@router.delete("/shares/{share_id}")
+async def delete_share(
+    share_id: str,
+    passcode: str,
+    db: AsyncSession = Depends(get_db),
+    client: str = Depends(request_client)
+):
+    """Delete every document of a share after one passcode verification"""
+    await passcode_throttle.check(client, share_id)
+    docs = (await db.execute(select(Document).where(Document.share_id == share_id))).scalars().all()
+    if not docs:
+        raise HTTPException(status_code=404, detail="Share not found")
+
+    if not await passcode_hasher.verify(passcode, docs[0].passcode_hash):
+        await passcode_throttle.failed(client, share_id)
+        raise HTTPException(status_code=403, detail="Invalid passcode")
+
+    doc_ids = [doc.id for doc in docs]
+    blob_ids = [doc.blob_id for doc in docs if doc.blob_id]
+    filenames = [doc.encrypted_filename for doc in docs if not doc.blob_id]
+
+    await db.execute(delete(Document).where(Document.id.in_(doc_ids)))
+    # Deduplicated blobs go with their last reference
+    filenames += await blob_registry.release(db, blob_ids)
+    await db.commit()
+
+    storage = await get_storage_service()
+    failed = await storage.delete_files(filenames)
+    if failed:
+        print(f"Failed to delete blob(s) of share {share_id}: {failed}")
+
+    for doc_id in doc_ids:
+        await document_cache.invalidate(doc_id)
+        download_tokens.revoke(doc_id)
+    download_tokens.revoke(share_id)
+
+    return {"message": "Share deleted successfully", "deleted": len(doc_ids)}
@@ -0,0 +1,238 @@
+"""
+Local cache of encrypted S3 blobs for frequently downloaded documents (opt-in
+with BLOB_CACHE_ENABLED).
+
+Blobs up to BLOB_CACHE_MAX_OBJECT_SIZE are kept whole, as the ciphertext read
+from S3, in memory or under BLOB_CACHE_DIR, within a budget of BLOB_CACHE_SIZE
+bytes with LRU eviction. Decryption still happens per download, so plaintext
+is never cached. Concurrent misses for the same blob share one S3 fetch. Hits
+on the disk tier are read from the entry file range by range, so concurrent
+downloads do not each hold a copy of the blob.
+
+Blob names are unique and never rewritten, so entries only go stale when the
+blob is deleted; the S3 storage service invalidates them on every delete
+(document deletes, the expiry reaper, key rotation).
+"""
+import asyncio
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Iterable, Optional
+from app.core.config import BLOB_CACHE_ENABLED, BLOB_CACHE_SIZE, BLOB_CACHE_MAX_OBJECT_SIZE, BLOB_CACHE_DIR
+
+# Entry files are named by the SHA-256 of the blob name
+ENTRY_NAME = re.compile(r"[0-9a-f]{64}")
+
+
+async def _io(fn: Callable, *args: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+class CachedBlob:
+    """Ciphertext of a cached blob: shared bytes in memory, or an open entry file read on demand"""
+
+    def __init__(self, size: int, data: Optional[bytes] = None, file: Optional[BinaryIO] = None):
+        self.size = size
+        self._data = data
+        self._file = file
+
+    @staticmethod
+    def _read_at(f: BinaryIO, offset: int, length: int) -> bytes:
+        f.seek(offset)
+        return f.read(length)
+
+    async def read(self, offset: int, length: int) -> bytes:
+        if self._file is None:
+            return self._data[offset:offset + length]
+        return await _io(self._read_at, self._file, offset, length)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class BlobCache:
+    """Byte-budgeted LRU of encrypted blobs with single-flight fetches"""
+
+    def __init__(self, enabled: bool, max_bytes: int, max_object_size: int, directory: Optional[str] = None):
+        self.enabled = enabled and max_bytes > 0
+        self.max_bytes = max_bytes
+        self.max_object_size = min(max_object_size, max_bytes)
+        self.directory = Path(directory) if directory else None
+        # name -> size in LRU order; the bytes live in _data (memory) or in a file (disk)
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._data: Dict[str, bytes] = {}
+        self._fetches: Dict[str, asyncio.Future] = {}
+        self._prepared = False
+        self._invalidations = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.bytes_served = 0
+
+    def __contains__(self, name: str) -> bool:
+        """Cached or being fetched, so get() will not need a fetch of its own"""
+        return name in self._entries or name in self._fetches
+
+    def cacheable(self, encrypted_size: int) -> bool:
+        return self.enabled and encrypted_size <= self.max_object_size
+
+    def _path(self, name: str) -> Path:
+        return self.directory / hashlib.sha256(name.encode()).hexdigest()
+
+    def _prepare_directory(self):
+        # Entries from a previous run are not accounted for; remove them (and nothing else)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in self.directory.iterdir():
+            if ENTRY_NAME.fullmatch(path.stem) and path.suffix in ("", ".tmp") and path.is_file():
+                path.unlink()
+
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        temp_path = path.with_suffix(".tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _unlink(paths: Iterable[Path]):
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    async def _io(self, fn: Callable, *args: Any) -> Any:
+        return await _io(fn, *args)
+
+    async def _read(self, name: str) -> Optional[CachedBlob]:
+        if name not in self._entries:
+            return None
+        self._entries.move_to_end(name)
+        if self.directory is None:
+            return CachedBlob(self._entries[name], data=self._data[name])
+        try:
+            # An open file stays readable if the entry is evicted meanwhile
+            return CachedBlob(self._entries[name], file=await self._io(open, self._path(name), "rb"))
+        except FileNotFoundError:
+            await self._drop([name])
+            return None
+
+    async def _store(self, name: str, data: bytes):
+        if name in self._entries:
+            return
+        if self.directory is not None:
+            if not self._prepared:
+                await self._io(self._prepare_directory)
+                self._prepared = True
+            invalidations = self._invalidations
+            await self._io(self._write, self._path(name), data)
+            if self._invalidations != invalidations:
+                # Something was deleted while we wrote; it may have been this blob
+                await self._io(self._unlink, [self._path(name)])
+                return
+        else:
+            self._data[name] = data
+        self._entries[name] = len(data)
+        self.bytes += len(data)
+        evicted = []
+        while self.bytes > self.max_bytes:
+            old_name, size = self._entries.popitem(last=False)
+            self._data.pop(old_name, None)
+            self.bytes -= size
+            self.evictions += 1
+            evicted.append(old_name)
+        if evicted and self.directory is not None:
+            await self._io(self._unlink, [self._path(old_name) for old_name in evicted])
+
+    async def _drop(self, names: Iterable[str]):
+        removed = []
+        for name in names:
+            size = self._entries.pop(name, None)
+            if size is not None:
+                self._data.pop(name, None)
+                self.bytes -= size
+                removed.append(name)
+        if removed and self.directory is not None:
+            await self._io(self._unlink, [self._path(name) for name in removed])
+
+    async def get(self, name: str, fetch: Callable[[], Awaitable[bytes]]) -> CachedBlob:
+        """
+        The cached ciphertext of blob `name`, calling `fetch` on a miss. While
+        a fetch is running, other callers for the same blob wait for its result.
+        The caller closes the returned blob.
+        """
+        blob = await self._read(name)
+        if blob is not None:
+            self.hits += 1
+            self.bytes_served += blob.size
+            return blob
+
+        pending = self._fetches.get(name)
+        if pending is not None:
+            try:
+                data = await asyncio.shield(pending)
+                self.coalesced += 1
+                self.bytes_served += len(data)
+                return CachedBlob(len(data), data=data)
+            except asyncio.CancelledError:
+                # The fetching request went away; fetch for ourselves unless we were cancelled
+                if not pending.cancelled():
+                    raise
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._fetches[name] = future
+        try:
+            data = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters get the error; nobody else has to retrieve it
+            future.exception()
+            raise
+        finally:
+            # Gone if the blob was invalidated while it was being fetched; then it is not stored
+            current = self._fetches.get(name) is future
+            if current:
+                del self._fetches[name]
+        future.set_result(data)
+        if current and len(data) <= self.max_object_size:
+            await self._store(name, data)
+        return CachedBlob(len(data), data=data)
+
+    async def invalidate(self, names: Iterable[str]):
+        """Forget deleted blobs, including ones being fetched right now"""
+        if not self.enabled:
+            return
+        names = list(names)
+        self._invalidations += 1
+        for name in names:
+            self._fetches.pop(name, None)
+        await self._drop(names)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "enabled": self.enabled,
+            "tier": "disk" if self.directory is not None else "memory",
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "bytes_served": self.bytes_served
+        }
+
+
+# Singleton instance
+blob_cache = BlobCache(BLOB_CACHE_ENABLED, BLOB_CACHE_SIZE, BLOB_CACHE_MAX_OBJECT_SIZE, BLOB_CACHE_DIR)
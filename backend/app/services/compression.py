@@ -0,0 +1,156 @@
+"""
+Optional compression stage applied to plaintext before encryption.
+
+The codec is recorded in the low bits of the blob header flags, so blobs with
+different codecs (or none) coexist and downloads pick the right decompressor.
+zstd needs the optional `zstandard` package; zlib is always available.
+"""
+import fnmatch
+import zlib
+from typing import Iterator, List, Optional
+from app.core.config import COMPRESSION_CODEC, COMPRESSION_LEVEL, COMPRESSION_SKIP_MIME_TYPES
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency, only needed for zstd
+    zstandard = None
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_MASK = 0x03  # Header flag bits holding the codec
+CODECS = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+DEFAULT_LEVELS = {CODEC_ZLIB: 6, CODEC_ZSTD: 3}
+# Compressed input that always holds a whole zstd block (at most 128KB plus its header)
+ZSTD_BLOCK_RESERVE = 128 * 1024 + 64
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise ValueError("zstd compression requires the 'zstandard' package")
+
+
+class Compressor:
+    """Streaming compressor with a uniform compress/flush interface"""
+
+    def __init__(self, codec: int, level: Optional[int] = None):
+        level = DEFAULT_LEVELS[codec] if level is None else level
+        if codec == CODEC_ZLIB:
+            self._obj = zlib.compressobj(level)
+        elif codec == CODEC_ZSTD:
+            _require_zstd()
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError(f"Unknown compression codec: {codec}")
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+
+class _PendingInput:
+    """File-like source for zstandard's stream_reader over the input handed over so far"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def read(self, size: int) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class Decompressor:
+    """
+    Streaming decompressor matching Compressor.
+    Use either decompress/flush or decompress_bounded on one instance, not both.
+    """
+
+    def __init__(self, codec: int):
+        self.codec = codec
+        self._input: Optional[_PendingInput] = None
+        self._reader = None
+        if codec == CODEC_ZLIB:
+            self._obj = zlib.decompressobj()
+        elif codec == CODEC_ZSTD:
+            _require_zstd()
+            self._obj = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            raise ValueError(f"Unknown compression codec: {codec}")
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._obj.decompress(data)
+
+    def decompress_bounded(self, data: bytes, max_length: int, final: bool = False) -> Iterator[bytes]:
+        """
+        Decompress `data` lazily in pieces of at most `max_length` bytes, so a
+        small, highly compressible input never expands into one huge buffer.
+        `final` marks the last input; output still held back is returned then.
+        """
+        if self.codec == CODEC_ZLIB:
+            piece = b""
+            # An empty tail with a full piece may still leave output pending in zlib
+            while data or len(piece) == max_length:
+                piece = self._obj.decompress(data, max_length)
+                data = self._obj.unconsumed_tail
+                if piece:
+                    yield piece
+                elif not data:
+                    break
+            if final:
+                tail = self._obj.flush()
+                if tail:
+                    yield tail
+            return
+        if self._reader is None:
+            self._input = _PendingInput()
+            self._reader = zstandard.ZstdDecompressor().stream_reader(self._input)
+        self._input.buffer += data
+        # The reader takes a source with nothing left as the end of the stream. With a
+        # whole block still pending, read1 always returns output before that happens;
+        # the last block waits for the next call
+        while len(self._input.buffer) > ZSTD_BLOCK_RESERVE:
+            piece = self._reader.read1(max_length)
+            if not piece:
+                break
+            yield piece
+        if final:
+            while True:
+                piece = self._reader.read(max_length)
+                if not piece:
+                    break
+                yield piece
+
+    def flush(self) -> bytes:
+        # zstd decompression objects have nothing left to flush
+        return self._obj.flush() if hasattr(self._obj, "flush") else b""
+
+
+class CompressionPolicy:
+    """Chooses the codec for an upload from its MIME type"""
+
+    def __init__(self, codec: str, level: Optional[int], skip_mime_types: List[str]):
+        if codec not in CODECS:
+            raise ValueError(f"COMPRESSION_CODEC must be one of {', '.join(CODECS)}")
+        self.codec = CODECS[codec]
+        if self.codec == CODEC_ZSTD:
+            _require_zstd()
+        self.level = level
+        # Already-compressed formats (JPEG, ZIP, MP4, ...) gain nothing but cost CPU
+        self.skip_mime_types = [pattern.strip().lower() for pattern in skip_mime_types if pattern.strip()]
+
+    def skips(self, mime_type: Optional[str]) -> bool:
+        """True if uploads of `mime_type` are stored uncompressed"""
+        mime_type = (mime_type or "").split(";")[0].strip().lower()
+        return any(fnmatch.fnmatchcase(mime_type, pattern) for pattern in self.skip_mime_types)
+
+    def codec_for(self, mime_type: Optional[str]) -> int:
+        if self.codec == CODEC_NONE or self.skips(mime_type):
+            return CODEC_NONE
+        return self.codec
+
+
+# Singleton instance
+compression_policy = CompressionPolicy(COMPRESSION_CODEC, COMPRESSION_LEVEL, COMPRESSION_SKIP_MIME_TYPES)
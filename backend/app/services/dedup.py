@@ -0,0 +1,146 @@
+"""
+Content-addressed deduplication of encrypted blobs (opt-in with DEDUP_ENABLED).
+
+Uploads are identified by an HMAC-SHA256 of their plaintext, keyed from the
+primary encryption key, so identical files map to one encrypted blob without
+exposing plaintext hashes. The `blobs` table counts the documents that point
+at each blob; the blob is deleted from storage with its last reference.
+
+Reference counts only change inside the caller's database transaction, so they
+commit or roll back together with the document rows they account for.
+"""
+import hashlib
+import hmac
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.backends import default_backend
+from fastapi import UploadFile
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import DEDUP_ENABLED, UPLOAD_READ_SIZE, MAX_FILE_SIZE
+from app.core.executor import cpu_executor
+from app.core.metrics import stage
+from app.models.blob import Blob
+from app.services.keyring import Keyring, keyring
+
+
+class BlobRegistry:
+    """Reference-counted, content-addressed blobs"""
+
+    def __init__(self, keys: Keyring, enabled: bool):
+        self.keyring = keys
+        self.enabled = enabled
+        self._hash_keys = {}
+
+    def _hash_key(self, key_id: int) -> bytes:
+        if key_id not in self._hash_keys:
+            hkdf = HKDF(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=None,
+                info=b"secure-doc-share content hash v1",
+                backend=default_backend()
+            )
+            self._hash_keys[key_id] = hkdf.derive(self.keyring.get(key_id))
+        return self._hash_keys[key_id]
+
+    async def content_id(self, file: UploadFile, max_size: int = MAX_FILE_SIZE) -> str:
+        """
+        Keyed hash of an upload, read in UPLOAD_READ_SIZE pieces. The file is
+        rewound afterwards so it can be encrypted. Raises ValueError above `max_size`.
+        """
+        key_id = self.keyring.primary_id
+        digest = hmac.new(self._hash_key(key_id), digestmod=hashlib.sha256)
+        size = 0
+        while True:
+            with stage("read"):
+                data = await file.read(UPLOAD_READ_SIZE)
+            if not data:
+                break
+            size += len(data)
+            if size > max_size:
+                raise ValueError(f"File size exceeds maximum allowed size of {max_size / (1024*1024)}MB")
+            await cpu_executor.run(digest.update, data, wait=True)
+        await file.seek(0)
+        # Scoped to the key, so blobs are never shared across key rotations
+        return f"{key_id}:{digest.hexdigest()}"
+
+    async def acquire(self, db: AsyncSession, blob_id: str, references: int = 1) -> Optional[Blob]:
+        """Take `references` references on an existing blob; None if there is no live blob with this ID"""
+        blob = (await db.execute(select(Blob).where(Blob.id == blob_id))).scalar_one_or_none()
+        if blob is None:
+            return None
+        result = await db.execute(
+            update(Blob)
+            .where(Blob.id == blob_id, Blob.ref_count > 0)
+            .values(ref_count=Blob.ref_count + references)
+            .execution_options(synchronize_session=False)
+        )
+        if not result.rowcount:
+            return None
+        # Re-read under the row lock so a concurrent key rotation cannot hand us a stale filename
+        await db.refresh(blob)
+        return blob
+
+    async def register(self, db: AsyncSession, blob_id: str, encrypted_filename: str, file_size: int) -> Tuple[str, bool]:
+        """
+        Record a newly stored blob with one reference. If a concurrent upload
+        registered the same content first, take a reference on that blob instead.
+        Returns the blob's filename and whether ours was kept.
+        """
+        db.add(Blob(id=blob_id, encrypted_filename=encrypted_filename, ref_count=1, file_size=file_size))
+        try:
+            await db.flush()
+            return encrypted_filename, True
+        except IntegrityError:
+            await db.rollback()
+        existing = await self.acquire(db, blob_id)
+        if existing is None:
+            raise RuntimeError(f"Blob {blob_id} is being deleted, retry the upload")
+        return existing.encrypted_filename, False
+
+    async def register_many(self, db: AsyncSession, blobs: Dict[str, Tuple[str, int, int]]) -> bool:
+        """
+        Record newly stored blobs, {blob_id: (encrypted_filename, file_size, references)},
+        in one flush. Returns False, with the transaction rolled back, if a concurrent
+        upload registered one of them first; the caller then starts over with acquire().
+        """
+        db.add_all([
+            Blob(id=blob_id, encrypted_filename=filename, ref_count=references, file_size=file_size)
+            for blob_id, (filename, file_size, references) in blobs.items()
+        ])
+        try:
+            await db.flush()
+            return True
+        except IntegrityError:
+            await db.rollback()
+            return False
+
+    async def release(self, db: AsyncSession, blob_ids: Iterable[str]) -> List[str]:
+        """
+        Drop one reference per entry of `blob_ids` (repeats allowed) and delete
+        blob rows that reach zero. Returns the filenames the caller must delete
+        from storage after committing.
+        """
+        orphaned = []
+        for blob_id, count in Counter(blob_ids).items():
+            await db.execute(
+                update(Blob)
+                .where(Blob.id == blob_id)
+                .values(ref_count=Blob.ref_count - count)
+                .execution_options(synchronize_session=False)
+            )
+            row = (await db.execute(
+                select(Blob.encrypted_filename, Blob.ref_count).where(Blob.id == blob_id)
+            )).one_or_none()
+            if row is not None and row.ref_count <= 0:
+                await db.execute(delete(Blob).where(Blob.id == blob_id))
+                orphaned.append(row.encrypted_filename)
+        return orphaned
+
+
+# Singleton instance
+blob_registry = BlobRegistry(keyring, DEDUP_ENABLED)
@@ -0,0 +1,184 @@
+"""
+Read-through cache for Document lookups by ID.
+
+Rows are immutable until they expire or are deleted, so `access`, `download`
+and `delete_document` read them through this cache instead of querying the
+database on every request. Entries never outlive the document's `expires_at`,
+unknown IDs are cached as misses for a short time, and deletes invalidate.
+
+The default backend is an in-process LRU. A shared backend (e.g. Redis) can be
+plugged in by implementing CacheBackend and naming it in DOCUMENT_CACHE_BACKEND
+as "package.module:ClassName"; it is constructed with `max_entries`.
+"""
+import importlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple, Union
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import (
+    DOCUMENT_CACHE_ENABLED, DOCUMENT_CACHE_BACKEND, DOCUMENT_CACHE_SIZE,
+    DOCUMENT_CACHE_TTL, DOCUMENT_CACHE_NEGATIVE_TTL
+)
+from app.models.document import Document
+
+# Stored for IDs that are not in the database (negative caching)
+MISSING = "__missing__"
+
+
+@dataclass(frozen=True)
+class CachedDocument:
+    """Detached, picklable snapshot of a Document row"""
+    id: str
+    original_filename: str
+    encrypted_filename: str
+    passcode_hash: str
+    created_at: Optional[datetime]
+    expires_at: datetime
+    file_size: int
+    mime_type: Optional[str]
+    blob_id: Optional[str] = None
+    encryption_header: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, doc: Document) -> "CachedDocument":
+        return cls(
+            id=doc.id,
+            original_filename=doc.original_filename,
+            encrypted_filename=doc.encrypted_filename,
+            passcode_hash=doc.passcode_hash,
+            created_at=doc.created_at,
+            expires_at=doc.expires_at,
+            file_size=doc.file_size,
+            mime_type=doc.mime_type,
+            blob_id=doc.blob_id,
+            encryption_header=doc.encryption_header
+        )
+
+
+CacheValue = Union[CachedDocument, str]
+
+
+class CacheBackend:
+    """Storage interface for the document cache; values are CachedDocument or MISSING"""
+
+    async def get(self, key: str) -> Optional[CacheValue]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: CacheValue, ttl: float):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    def size(self) -> Optional[int]:
+        """Number of entries, if cheaply known"""
+        return None
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process LRU with per-entry expiry"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, CacheValue]]" = OrderedDict()
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[CacheValue]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: CacheValue, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def size(self) -> Optional[int]:
+        return len(self._entries)
+
+
+def _load_backend(path: str, max_entries: int) -> CacheBackend:
+    if path == "memory":
+        return MemoryCacheBackend(max_entries)
+    module_name, _, class_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)(max_entries)
+
+
+class DocumentCache:
+    """Read-through cache in front of `select(Document).where(Document.id == doc_id)`"""
+
+    def __init__(self, backend: Optional[CacheBackend], ttl: float, negative_ttl: float):
+        self.backend = backend  # None disables caching
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    async def get(self, db: AsyncSession, doc_id: str) -> Optional[CachedDocument]:
+        """The document with `doc_id`, or None if it does not exist"""
+        if self.backend is not None:
+            cached = await self.backend.get(doc_id)
+            if cached == MISSING:
+                self.negative_hits += 1
+                return None
+            if cached is not None:
+                self.hits += 1
+                return cached
+        self.misses += 1
+
+        result = await db.execute(select(Document).where(Document.id == doc_id))
+        row = result.scalar_one_or_none()
+        doc = CachedDocument.from_row(row) if row is not None else None
+        await self.put(doc_id, doc)
+        return doc
+
+    async def put(self, doc_id: str, doc: Optional[CachedDocument]):
+        """Cache `doc` (or a miss when None), capped at the document's expiry"""
+        if self.backend is None:
+            return
+        if doc is None:
+            await self.backend.set(doc_id, MISSING, self.negative_ttl)
+            return
+        remaining = (doc.expires_at - datetime.utcnow()).total_seconds()
+        # Expired rows only change by being reaped, so treat them like misses
+        ttl = min(self.ttl, remaining) if remaining > 0 else self.negative_ttl
+        if ttl > 0:
+            await self.backend.set(doc_id, doc, ttl)
+
+    async def invalidate(self, doc_id: str):
+        if self.backend is not None:
+            await self.backend.delete(doc_id)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "enabled": self.backend is not None,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 3) if lookups else 0.0,
+            "entries": self.backend.size() if self.backend is not None else 0
+        }
+
+
+# Singleton instance
+document_cache = DocumentCache(
+    _load_backend(DOCUMENT_CACHE_BACKEND, DOCUMENT_CACHE_SIZE) if DOCUMENT_CACHE_ENABLED else None,
+    DOCUMENT_CACHE_TTL,
+    DOCUMENT_CACHE_NEGATIVE_TTL
+)
@@ -1,31 +1,483 @@
-from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
-import base64
+from dataclasses import dataclass
+from fastapi import UploadFile
+from typing import AsyncIterator, Iterator, Optional, Tuple
 import os
-from app.core.config import ENCRYPTION_KEY
+import struct
+import sys
+from app.core.config import ENCRYPTION_CHUNK_SIZE, UPLOAD_READ_SIZE, DOWNLOAD_READ_SIZE, MAX_FILE_SIZE
+from app.core.executor import cpu_executor
+from app.core.metrics import stage, count_bytes
+from app.services.keyring import keyring, Keyring, LEGACY_KEY_ID
+from app.services.compression import Compressor, Decompressor, CODEC_NONE, CODEC_MASK, compression_policy
+
+# Segmented streaming format (version 2)
+#
+#   header: magic "SDSE" | version (1) | flags (1) | key_id (2) | chunk_size (4) | salt (16)
+#   body:   segment_0 | segment_1 | ... | segment_n
+#
+# Every segment is AES-256-GCM over `chunk_size` plaintext bytes (the last one may
+# be shorter), so it occupies `chunk_size + 16` bytes on disk. The per-blob key is
+# derived from the master key and the header salt with HKDF. The nonce is the
+# segment counter plus a final-segment flag and the header is passed as associated
+# data, so reordered, truncated or re-headered blobs fail authentication. The key ID
+# selects the keyring master key, so rotated keys never need trial decryption.
+#
+# The low bits of `flags` name the codec the plaintext was compressed with before
+# encryption (see app.services.compression). Segments then hold compressed bytes,
+# so a compressed blob is always decrypted from its first segment.
+#
+# Version 3 headers (client-side encryption, see app.routers.direct) append a
+# per-blob data key wrapped with AES-GCM under a key derived from keyring key
+# `key_id`, with the salt as associated data. The data key replaces the master key
+# in the HKDF step, so browsers can encrypt without ever seeing a server key.
+#
+# Version 1 headers have no key ID and use the legacy key (ID 0). Blobs that do
+# not start with the magic are legacy Fernet tokens. Integers are big-endian.
+STREAM_MAGIC = b"SDSE"
+STREAM_VERSION = 2
+CLIENT_STREAM_VERSION = 3
+WRAPPED_KEY_SIZE = 12 + 32 + 16  # nonce | AES-GCM(data key) | tag
+HEADER_FORMATS = {1: ">4sBBI16s", 2: ">4sBBHI16s", 3: ">4sBBHI16s60s"}
+# Bytes to fetch to be able to parse any header version
+HEADER_SIZE = max(struct.calcsize(fmt) for fmt in HEADER_FORMATS.values())
+SALT_SIZE = 16
+TAG_SIZE = 16
+
+
+@dataclass(frozen=True)
+class StreamHeader:
+    version: int
+    flags: int
+    chunk_size: int
+    salt: bytes
+    key_id: int = LEGACY_KEY_ID
+    wrapped_key: bytes = b""  # Version 3 only
+
+    @property
+    def size(self) -> int:
+        """Size of this header on disk"""
+        return struct.calcsize(HEADER_FORMATS[self.version])
+
+    @property
+    def codec(self) -> int:
+        """Compression codec of the segment payload (CODEC_NONE if uncompressed)"""
+        return self.flags & CODEC_MASK
+
+    @property
+    def segment_size(self) -> int:
+        """Size of one encrypted segment on disk"""
+        return self.chunk_size + TAG_SIZE
+
+    def pack(self) -> bytes:
+        if self.version == 1:
+            return struct.pack(HEADER_FORMATS[1], STREAM_MAGIC, 1, self.flags, self.chunk_size, self.salt)
+        if self.version == CLIENT_STREAM_VERSION:
+            return struct.pack(
+                HEADER_FORMATS[self.version], STREAM_MAGIC, self.version, self.flags,
+                self.key_id, self.chunk_size, self.salt, self.wrapped_key
+            )
+        return struct.pack(
+            HEADER_FORMATS[self.version], STREAM_MAGIC, self.version, self.flags,
+            self.key_id, self.chunk_size, self.salt
+        )
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "StreamHeader":
+        if len(data) <= len(STREAM_MAGIC) or not data.startswith(STREAM_MAGIC):
+            raise ValueError("Not a streaming encrypted blob")
+        version = data[len(STREAM_MAGIC)]
+        if version not in HEADER_FORMATS:
+            raise ValueError(f"Unsupported blob version: {version}")
+        fmt = HEADER_FORMATS[version]
+        if len(data) < struct.calcsize(fmt):
+            raise ValueError("Truncated blob header")
+        wrapped_key = b""
+        if version == 1:
+            _, _, flags, chunk_size, salt = struct.unpack(fmt, data[:struct.calcsize(fmt)])
+            key_id = LEGACY_KEY_ID
+        elif version == CLIENT_STREAM_VERSION:
+            _, _, flags, key_id, chunk_size, salt, wrapped_key = struct.unpack(fmt, data[:struct.calcsize(fmt)])
+        else:
+            _, _, flags, key_id, chunk_size, salt = struct.unpack(fmt, data[:struct.calcsize(fmt)])
+        if chunk_size <= 0:
+            raise ValueError("Corrupt blob header")
+        return cls(
+            version=version, flags=flags, chunk_size=chunk_size, salt=salt,
+            key_id=key_id, wrapped_key=wrapped_key
+        )
+
+    def segment_count(self, encrypted_size: int) -> int:
+        """Number of segments in a blob of `encrypted_size` bytes (header included)"""
+        body = encrypted_size - self.size
+        if body < TAG_SIZE:
+            raise ValueError("Truncated encrypted blob")
+        return -(-body // self.segment_size)
+
+    def segment_offset(self, index: int) -> int:
+        """Encrypted byte offset of segment `index`"""
+        return self.size + index * self.segment_size
+
+    def encrypted_size(self, plaintext_size: int) -> int:
+        """Size of an uncompressed blob holding `plaintext_size` bytes (header included)"""
+        segments = max(1, -(-plaintext_size // self.chunk_size))
+        return self.size + plaintext_size + segments * TAG_SIZE
+
+    def plaintext_size(self, encrypted_size: int) -> int:
+        """Bytes held by the segments (the compressed size for compressed blobs)"""
+        return encrypted_size - self.size - self.segment_count(encrypted_size) * TAG_SIZE
+
+    def segment_range(self, encrypted_size: int, start: int = 0, end: Optional[int] = None) -> "SegmentRange":
+        """
+        Map the inclusive plaintext range `start`..`end` onto the encrypted
+        segments that have to be fetched and decrypted to serve it.
+        """
+        total = self.segment_count(encrypted_size)
+        if self.codec != CODEC_NONE:
+            # Compressed offsets do not map onto plaintext offsets: decrypt everything, trim afterwards
+            return SegmentRange(
+                first_segment=0,
+                total_segments=total,
+                offset=self.size,
+                length=encrypted_size - self.size,
+                skip=start,
+                size=sys.maxsize if end is None else max(0, end - start + 1)
+            )
+        size = self.plaintext_size(encrypted_size)
+        if end is None or end >= size:
+            end = size - 1
+        first = min(start // self.chunk_size, total - 1)
+        last = min(max(start, end) // self.chunk_size, total - 1)
+        offset = self.segment_offset(first)
+        return SegmentRange(
+            first_segment=first,
+            total_segments=total,
+            offset=offset,
+            length=min(self.segment_offset(last + 1), encrypted_size) - offset,
+            skip=start - first * self.chunk_size,
+            size=max(0, end - start + 1)
+        )
+
+
+@dataclass(frozen=True)
+class SegmentRange:
+    """Encrypted byte span that covers a plaintext range"""
+    first_segment: int
+    total_segments: int
+    offset: int  # encrypted offset of the first segment
+    length: int  # encrypted bytes to read from `offset`
+    skip: int  # plaintext bytes to drop from the first decrypted segment
+    size: int  # plaintext bytes to emit
+
+
+def _segment_nonce(index: int, final: bool) -> bytes:
+    return index.to_bytes(11, "big") + (b"\x01" if final else b"\x00")
+
+
+def _wrapping_cipher(master_key: bytes) -> AESGCM:
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"secure-doc-share key wrap v1",
+        backend=default_backend()
+    )
+    return AESGCM(hkdf.derive(master_key))
+
+
+def _blob_cipher(master_key: bytes, salt: bytes) -> AESGCM:
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        info=b"secure-doc-share stream v1",
+        backend=default_backend()
+    )
+    return AESGCM(hkdf.derive(master_key))
+
+
+class StreamEncryptor:
+    """
+    Incrementally encrypts plaintext into the segmented stream format,
+    compressing it first when a codec is given.
+    """
+
+    def __init__(
+        self,
+        master_key: bytes,
+        key_id: int,
+        chunk_size: int,
+        codec: int = CODEC_NONE,
+        level: Optional[int] = None
+    ):
+        self.header = StreamHeader(
+            version=STREAM_VERSION,
+            flags=codec,
+            chunk_size=chunk_size,
+            salt=os.urandom(SALT_SIZE),
+            key_id=key_id
+        )
+        self._aad = self.header.pack()
+        self._cipher = _blob_cipher(master_key, self.header.salt)
+        self._compressor = Compressor(codec, level) if codec != CODEC_NONE else None
+        self._buffer = bytearray()
+        self._index = 0
+        self.plaintext_size = 0  # Uncompressed bytes received
+
+    def _seal(self, chunk: bytes, final: bool) -> bytes:
+        sealed = self._cipher.encrypt(_segment_nonce(self._index, final), chunk, self._aad)
+        self._index += 1
+        return sealed
+
+    def update(self, data: bytes) -> bytes:
+        """
+        Buffer plaintext and return ciphertext for every complete segment.
+        The last full segment is held back until `finalize` so it can be marked final.
+        """
+        self.plaintext_size += len(data)
+        self._buffer += self._compressor.compress(data) if self._compressor else data
+        return self._seal_full_segments()
+
+    def _seal_full_segments(self) -> bytes:
+        chunk_size = self.header.chunk_size
+        out = bytearray()
+        offset = 0
+        while len(self._buffer) - offset > chunk_size:
+            out += self._seal(bytes(self._buffer[offset:offset + chunk_size]), final=False)
+            offset += chunk_size
+        del self._buffer[:offset]
+        return bytes(out)
+
+    def finalize(self) -> bytes:
+        """Encrypt the remaining buffered plaintext, ending with the final segment"""
+        out = b""
+        if self._compressor:
+            self._buffer += self._compressor.flush()
+            out = self._seal_full_segments()
+        sealed = self._seal(bytes(self._buffer), final=True)
+        self._buffer.clear()
+        return out + sealed
+
+
+class StreamDecryptor:
+    """
+    Incrementally decrypts segments `first_segment` .. of a streaming blob.
+    `total_segments` is the segment count of the whole blob, used to tell which
+    segment must carry the final flag.
+    """
+
+    def __init__(self, master_key: bytes, header: StreamHeader, total_segments: int, first_segment: int = 0):
+        self.header = header
+        self._aad = header.pack()
+        self._cipher = _blob_cipher(master_key, header.salt)
+        self._total = total_segments
+        self._index = first_segment
+        self._buffer = bytearray()
+
+    def _open(self, segment: bytes) -> bytes:
+        if self._index >= self._total:
+            raise ValueError("Encrypted blob has trailing data")
+        final = self._index == self._total - 1
+        plaintext = self._cipher.decrypt(_segment_nonce(self._index, final), segment, self._aad)
+        self._index += 1
+        return plaintext
+
+    def update(self, data: bytes) -> bytes:
+        """Buffer ciphertext and return plaintext for every complete segment"""
+        self._buffer += data
+        segment_size = self.header.segment_size
+        out = bytearray()
+        offset = 0
+        while len(self._buffer) - offset >= segment_size:
+            out += self._open(bytes(self._buffer[offset:offset + segment_size]))
+            offset += segment_size
+        del self._buffer[:offset]
+        return bytes(out)
+
+    def finalize(self) -> bytes:
+        """Decrypt a trailing short (final) segment, if any"""
+        if not self._buffer:
+            return b""
+        plaintext = self._open(bytes(self._buffer))
+        self._buffer.clear()
+        return plaintext
+
 
 class EncryptionService:
-    def __init__(self):
-        # Derive a key from the encryption key using PBKDF2
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=b'secure_doc_share_salt',  # In production, use a random salt per file
-            iterations=100000,
-            backend=default_backend()
+    def __init__(self, keys: Keyring = keyring):
+        # Keys are resolved lazily, so importing this module does no key derivation
+        self.keyring = keys
+        self.chunk_size = ENCRYPTION_CHUNK_SIZE
+
+    @property
+    def cipher(self):
+        """Fernet cipher for legacy whole-file blobs"""
+        return self.keyring.fernet
+
+    @staticmethod
+    def is_stream_blob(prefix: bytes) -> bool:
+        """True if the blob starting with `prefix` uses the streaming format"""
+        return prefix[:len(STREAM_MAGIC)] == STREAM_MAGIC
+
+    @staticmethod
+    def blob_key_id(prefix: bytes) -> int:
+        """Key ID a blob was encrypted with, from its first HEADER_SIZE bytes"""
+        if not EncryptionService.is_stream_blob(prefix):
+            return LEGACY_KEY_ID
+        return StreamHeader.unpack(prefix).key_id
+
+    def encryptor(self, codec: int = CODEC_NONE, level: Optional[int] = None) -> StreamEncryptor:
+        """Start a new streaming blob under the primary key, optionally compressed with `codec`"""
+        key_id, master_key = self.keyring.primary()
+        return StreamEncryptor(master_key, key_id, self.chunk_size, codec, level)
+
+    def encryptor_for(self, mime_type: Optional[str]) -> StreamEncryptor:
+        """Encryptor for an upload, compressed when the compression policy allows its MIME type"""
+        return self.encryptor(compression_policy.codec_for(mime_type), compression_policy.level)
+
+    def client_header(self) -> Tuple[StreamHeader, bytes]:
+        """
+        Header and data key for a blob encrypted outside the server (version 3).
+        The data key is wrapped under the primary key inside the header itself.
+        """
+        key_id, master_key = self.keyring.primary()
+        salt = os.urandom(SALT_SIZE)
+        data_key = os.urandom(32)
+        nonce = os.urandom(12)
+        wrapped_key = nonce + _wrapping_cipher(master_key).encrypt(nonce, data_key, salt)
+        header = StreamHeader(
+            version=CLIENT_STREAM_VERSION,
+            flags=CODEC_NONE,
+            chunk_size=self.chunk_size,
+            salt=salt,
+            key_id=key_id,
+            wrapped_key=wrapped_key
         )
-        key = base64.urlsafe_b64encode(kdf.derive(ENCRYPTION_KEY))
-        self.cipher = Fernet(key)
-    
-    def encrypt(self, data: bytes) -> bytes:
+        return header, data_key
+
+    def unwrap_data_key(self, header: StreamHeader) -> bytes:
+        """Data key of a version 3 blob"""
+        wrapped_key = header.wrapped_key
+        cipher = _wrapping_cipher(self.keyring.get(header.key_id))
+        return cipher.decrypt(wrapped_key[:12], wrapped_key[12:], header.salt)
+
+    def decryptor(self, header: StreamHeader, total_segments: int, first_segment: int = 0) -> StreamDecryptor:
+        """Decrypt a streaming blob starting at `first_segment`"""
+        if header.version == CLIENT_STREAM_VERSION:
+            blob_key = self.unwrap_data_key(header)
+        else:
+            blob_key = self.keyring.get(header.key_id)
+        return StreamDecryptor(blob_key, header, total_segments, first_segment)
+
+    async def encrypt_upload(
+        self,
+        file: UploadFile,
+        encryptor: StreamEncryptor,
+        max_size: int = MAX_FILE_SIZE
+    ) -> AsyncIterator[bytes]:
+        """
+        Read an upload incrementally and yield the encrypted blob piece by piece.
+        Raises ValueError as soon as more than `max_size` bytes have been read.
+        """
+        yield encryptor.header.pack()
+        while True:
+            with stage("read"):
+                data = await file.read(UPLOAD_READ_SIZE)
+            if not data:
+                break
+            count_bytes("upload_read", len(data))
+            if encryptor.plaintext_size + len(data) > max_size:
+                raise ValueError(f"File size exceeds maximum allowed size of {max_size / (1024*1024)}MB")
+            with stage("encrypt"):
+                encrypted = await cpu_executor.run(encryptor.update, data, wait=True)
+            if encrypted:
+                yield encrypted
+        with stage("encrypt"):
+            final = await cpu_executor.run(encryptor.finalize, wait=True)
+        yield final
+
+    async def decrypt_segments(
+        self,
+        header: StreamHeader,
+        span: SegmentRange,
+        encrypted_chunks: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        """
+        Decrypt the encrypted bytes of `span` as they arrive and yield only the
+        plaintext that falls inside the requested range.
+        """
+        decryptor = self.decryptor(header, span.total_segments, span.first_segment)
+        decompressor = Decompressor(header.codec) if header.codec != CODEC_NONE else None
+        skip, remaining = span.skip, span.size
+
+        def next_piece(pieces: Iterator[bytes]) -> Optional[bytes]:
+            return next(pieces, None)
+
+        def trim(plaintext: bytes) -> bytes:
+            nonlocal skip, remaining
+            if skip:
+                dropped = min(skip, len(plaintext))
+                plaintext = plaintext[dropped:]
+                skip -= dropped
+            plaintext = plaintext[:remaining]
+            remaining -= len(plaintext)
+            return plaintext
+
+        async def expand(compressed: bytes, final: bool) -> AsyncIterator[bytes]:
+            # Decompressed piece by piece: a 1MB read of a highly compressible
+            # blob could otherwise inflate to the whole file at once
+            pieces = decompressor.decompress_bounded(compressed, DOWNLOAD_READ_SIZE, final)
+            while True:
+                with stage("decrypt"):
+                    piece = await cpu_executor.run(next_piece, pieces, wait=True)
+                if piece is None:
+                    return
+                yield piece
+
+        async def opened(plaintext: bytes, final: bool = False) -> AsyncIterator[bytes]:
+            if decompressor is None:
+                yield plaintext
+                return
+            if plaintext or final:
+                async for piece in expand(plaintext, final):
+                    yield piece
+
+        async for encrypted in encrypted_chunks:
+            with stage("decrypt"):
+                plaintext = await cpu_executor.run(decryptor.update, encrypted, wait=True)
+            async for piece in opened(plaintext):
+                piece = trim(piece)
+                if piece:
+                    yield piece
+                if remaining <= 0:
+                    # Range served (compressed blobs are read from the start)
+                    return
+        with stage("decrypt"):
+            plaintext = await cpu_executor.run(decryptor.finalize, wait=True)
+        async for piece in opened(plaintext, final=True):
+            piece = trim(piece)
+            if piece:
+                yield piece
+
+    def encrypt(self, data: bytes, codec: int = CODEC_NONE) -> bytes:
         """Encrypt file data"""
-        return self.cipher.encrypt(data)
-    
+        encryptor = self.encryptor(codec)
+        return encryptor.header.pack() + encryptor.update(data) + encryptor.finalize()
+
     def decrypt(self, encrypted_data: bytes) -> bytes:
-        """Decrypt file data"""
-        return self.cipher.decrypt(encrypted_data)
+        """Decrypt file data (streaming or legacy Fernet blob)"""
+        if not self.is_stream_blob(encrypted_data):
+            return self.cipher.decrypt(encrypted_data)
+        header = StreamHeader.unpack(encrypted_data)
+        decryptor = self.decryptor(header, header.segment_count(len(encrypted_data)))
+        plaintext = decryptor.update(encrypted_data[header.size:]) + decryptor.finalize()
+        if header.codec != CODEC_NONE:
+            decompressor = Decompressor(header.codec)
+            plaintext = decompressor.decompress(plaintext) + decompressor.flush()
+        return plaintext
 
 # Singleton instance
 encryption_service = EncryptionService()
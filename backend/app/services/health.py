@@ -0,0 +1,91 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+from sqlalchemy import text
+from app.core.config import USE_S3, HEALTH_PROBE_INTERVAL, HEALTH_RESULT_TTL
+from app.core.database import engine
+
+
+async def probe_database():
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def probe_s3():
+    from app.services.s3_storage import get_s3_storage_service
+    s3_storage = await get_s3_storage_service()
+    await s3_storage.check_bucket()
+
+
+class HealthMonitor:
+    """
+    Probes dependencies (database, S3) on a background task and caches the
+    results, so health endpoints never do I/O themselves.
+    """
+
+    def __init__(self, interval: float, ttl: float):
+        self.interval = interval
+        self.ttl = ttl
+        self.probes: Dict[str, Callable[[], Awaitable[None]]] = {"database": probe_database}
+        if USE_S3:
+            self.probes["s3"] = probe_s3
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_probe(self, name: str):
+        started = time.perf_counter()
+        result = {"status": "ok"}
+        try:
+            await asyncio.wait_for(self.probes[name](), timeout=self.interval)
+        except Exception as e:
+            result = {"status": "error", "error": str(e) or type(e).__name__}
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        result["checked_at"] = datetime.now(timezone.utc).isoformat()
+        result["_monotonic"] = time.monotonic()
+        self.results[name] = result
+
+    async def probe_all(self):
+        await asyncio.gather(*(self.run_probe(name) for name in self.probes))
+
+    async def _loop(self):
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start background probing (first round runs immediately)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Last result per probe; results older than the TTL are reported as stale"""
+        now = time.monotonic()
+        snapshot = {}
+        for name in self.probes:
+            result = self.results.get(name)
+            if result is None:
+                snapshot[name] = {"status": "pending"}
+                continue
+            entry = {key: value for key, value in result.items() if not key.startswith("_")}
+            if now - result["_monotonic"] > self.ttl:
+                entry["status"] = "stale"
+            snapshot[name] = entry
+        return snapshot
+
+    def is_ready(self, snapshot: Optional[Dict[str, Dict[str, Any]]] = None) -> bool:
+        snapshot = snapshot if snapshot is not None else self.snapshot()
+        return all(entry["status"] == "ok" for entry in snapshot.values())
+
+
+# Singleton instance
+health_monitor = HealthMonitor(HEALTH_PROBE_INTERVAL, HEALTH_RESULT_TTL)
@@ -0,0 +1,119 @@
+"""
+Encryption keyring.
+
+Keys are 32-byte master keys identified by a numeric key ID. Key ID 0 is the
+legacy key derived from ENCRYPTION_KEY with PBKDF2; it is only derived (once)
+when no pre-derived key 0 is configured and a blob actually needs it.
+
+    python -m app.services.keyring derive        # Pre-derive key 0 for ENCRYPTION_KEYS
+    python -m app.services.keyring generate 2    # New random key with ID 2
+"""
+import base64
+import json
+import os
+import sys
+from typing import Dict, Optional
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.backends import default_backend
+from app.core.config import ENCRYPTION_KEY, ENCRYPTION_KEYS, ENCRYPTION_KEYS_FILE, ENCRYPTION_PRIMARY_KEY_ID
+
+LEGACY_KEY_ID = 0
+KEY_SIZE = 32
+
+
+def derive_legacy_key(passphrase: bytes) -> bytes:
+    """PBKDF2 derivation used for key ID 0 (and for all legacy Fernet blobs)"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=KEY_SIZE,
+        salt=b'secure_doc_share_salt',  # Fixed for compatibility with existing blobs; new keys are random
+        iterations=100000,
+        backend=default_backend()
+    )
+    return kdf.derive(passphrase)
+
+
+def encode_key(key_id: int, key: bytes) -> str:
+    return f"{key_id}:{base64.urlsafe_b64encode(key).decode()}"
+
+
+def _decode_key(key_id: int, encoded: str) -> bytes:
+    key = base64.urlsafe_b64decode(encoded.strip())
+    if len(key) != KEY_SIZE:
+        raise ValueError(f"Encryption key {key_id} must be {KEY_SIZE} bytes (urlsafe base64)")
+    return key
+
+
+class Keyring:
+    """Master keys by ID, loaded from the environment or a file and cached in memory"""
+
+    def __init__(
+        self,
+        passphrase: bytes,
+        keys_env: str = "",
+        keys_file: Optional[str] = None,
+        primary_id: Optional[int] = None
+    ):
+        self._passphrase = passphrase
+        self._keys_env = keys_env
+        self._keys_file = keys_file
+        self._primary_id = primary_id
+        self._keys: Optional[Dict[int, bytes]] = None
+        self._fernet: Optional[Fernet] = None
+
+    def _configured(self) -> Dict[int, bytes]:
+        if self._keys is None:
+            keys = {}
+            if self._keys_file:
+                with open(self._keys_file) as f:
+                    for key_id, encoded in json.load(f).items():
+                        keys[int(key_id)] = _decode_key(int(key_id), encoded)
+            for entry in filter(None, (part.strip() for part in self._keys_env.split(","))):
+                key_id, _, encoded = entry.partition(":")
+                keys[int(key_id)] = _decode_key(int(key_id), encoded)
+            self._keys = keys
+        return self._keys
+
+    @property
+    def primary_id(self) -> int:
+        """Key ID used for new blobs (defaults to the highest configured ID)"""
+        if self._primary_id is not None:
+            return self._primary_id
+        return max(self._configured(), default=LEGACY_KEY_ID)
+
+    def get(self, key_id: int) -> bytes:
+        keys = self._configured()
+        if key_id not in keys:
+            if key_id != LEGACY_KEY_ID:
+                raise ValueError(f"Unknown encryption key ID: {key_id}")
+            # Derive the legacy key once, on first use
+            keys[key_id] = derive_legacy_key(self._passphrase)
+        return keys[key_id]
+
+    def primary(self):
+        key_id = self.primary_id
+        return key_id, self.get(key_id)
+
+    @property
+    def fernet(self) -> Fernet:
+        """Cipher for legacy whole-file Fernet blobs"""
+        if self._fernet is None:
+            self._fernet = Fernet(base64.urlsafe_b64encode(self.get(LEGACY_KEY_ID)))
+        return self._fernet
+
+
+# Singleton instance
+keyring = Keyring(ENCRYPTION_KEY, ENCRYPTION_KEYS, ENCRYPTION_KEYS_FILE, ENCRYPTION_PRIMARY_KEY_ID)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "derive":
+        print(encode_key(LEGACY_KEY_ID, derive_legacy_key(ENCRYPTION_KEY)))
+    elif command == "generate" and len(sys.argv) == 3:
+        print(encode_key(int(sys.argv[2]), os.urandom(KEY_SIZE)))
+    else:
+        print("usage: python -m app.services.keyring derive | generate <key_id>")
+        sys.exit(1)
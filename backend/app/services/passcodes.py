@@ -0,0 +1,266 @@
+"""
+Passcode hashing with a cost calibrated to a target verification time.
+
+At startup the configured algorithm is timed at a cheap cost and the cost is
+scaled so one verification takes about PASSCODE_VERIFY_TARGET_MS on this
+hardware, within a per-algorithm security floor and ceiling. Every hash
+records its algorithm and parameters:
+
+    bcrypt  $2b$12$...                             (rounds)
+    scrypt  $scrypt$ln=15,r=8,p=1$<salt>$<key>     (log2 N)
+    argon2  $argon2id$v=19$m=65536,t=3,p=1$...     (time cost; needs argon2-cffi)
+
+so hashes made with older or weaker settings keep verifying. After a
+successful verification such a hash is replaced in the background.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import math
+import os
+import time
+from typing import Optional, Set, Tuple
+import bcrypt
+from app.core.config import PASSCODE_HASH_ALGORITHM, PASSCODE_VERIFY_TARGET_MS, PASSCODE_HASH_COST, PASSCODE_MEMORY_KB
+from app.core.executor import cpu_executor, ExecutorSaturatedError
+from app.core.metrics import stage
+
+try:
+    import argon2
+    from argon2.exceptions import VerifyMismatchError
+except ImportError:  # Optional dependency, only needed for argon2
+    argon2 = None
+
+ALGORITHMS = ("bcrypt", "scrypt", "argon2")
+# Security floor and practical ceiling of the cost parameter. The bcrypt floor is
+# the cost every hash had before calibration, so new hashes are never weaker.
+COST_LIMITS = {"bcrypt": (12, 16), "scrypt": (15, 18), "argon2": (2, 20)}
+# Cheap cost the calibration run is timed at
+CALIBRATION_COST = {"bcrypt": 8, "scrypt": 12, "argon2": 1}
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+
+
+def _require_argon2():
+    if argon2 is None:
+        raise ValueError("argon2 passcode hashing requires the 'argon2-cffi' package")
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def _scrypt(passcode: bytes, salt: bytes, ln: int, r: int, p: int) -> bytes:
+    n = 1 << ln
+    # maxmem must cover the 128 * r * N bytes scrypt allocates
+    return hashlib.scrypt(passcode, salt=salt, n=n, r=r, p=p, maxmem=129 * r * n + 1024 * 1024, dklen=32)
+
+
+def hash_with(algorithm: str, passcode: str, cost: int, memory_kb: int) -> str:
+    """Hash `passcode` (runs on the CPU executor, possibly in a worker process)"""
+    if algorithm == "bcrypt":
+        return bcrypt.hashpw(passcode.encode(), bcrypt.gensalt(cost)).decode()
+    if algorithm == "scrypt":
+        salt = os.urandom(SALT_SIZE)
+        key = _scrypt(passcode.encode(), salt, cost, SCRYPT_R, SCRYPT_P)
+        return f"$scrypt$ln={cost},r={SCRYPT_R},p={SCRYPT_P}${_b64(salt)}${_b64(key)}"
+    if algorithm == "argon2":
+        _require_argon2()
+        return argon2.PasswordHasher(time_cost=cost, memory_cost=memory_kb, parallelism=1).hash(passcode)
+    raise ValueError(f"Unknown passcode hash algorithm: {algorithm}")
+
+
+def verify_hash(passcode: str, stored: str) -> bool:
+    """Check `passcode` against a stored hash of any supported algorithm"""
+    if stored.startswith("$scrypt$"):
+        _, _, params, salt, key = stored.split("$")
+        values = dict(item.split("=") for item in params.split(","))
+        candidate = _scrypt(passcode.encode(), _unb64(salt), int(values["ln"]), int(values["r"]), int(values["p"]))
+        return hmac.compare_digest(candidate, _unb64(key))
+    if stored.startswith("$argon2"):
+        _require_argon2()
+        try:
+            return argon2.PasswordHasher().verify(stored, passcode)
+        except VerifyMismatchError:
+            return False
+    return bcrypt.checkpw(passcode.encode(), stored.encode())
+
+
+def hash_parameters(stored: str) -> Tuple[str, int, int]:
+    """(algorithm, cost, memory in KB) of a stored hash; memory is 0 where it is not a parameter"""
+    parts = stored.split("$")
+    if stored.startswith("$scrypt$"):
+        values = dict(item.split("=") for item in parts[2].split(","))
+        ln = int(values["ln"])
+        return "scrypt", ln, 128 * int(values["r"]) * (1 << ln) // 1024
+    if stored.startswith("$argon2"):
+        values = dict(item.split("=") for item in parts[3].split(","))
+        return "argon2", int(values["t"]), int(values["m"])
+    if stored.startswith("$2"):
+        return "bcrypt", int(parts[2]), 0
+    raise ValueError("Unrecognized passcode hash")
+
+
+def calibrate_cost(algorithm: str, target_seconds: float, memory_kb: int) -> int:
+    """Cost at which one hash (or verification) takes about `target_seconds` on this machine"""
+    base = CALIBRATION_COST[algorithm]
+    hash_with(algorithm, "calibration", base, memory_kb)  # Warm-up
+    samples = []
+    for _ in range(2):
+        started = time.perf_counter()
+        hash_with(algorithm, "calibration", base, memory_kb)
+        samples.append(time.perf_counter() - started)
+    elapsed = max(min(samples), 1e-6)
+    if algorithm == "argon2":
+        # Time grows linearly with the time cost
+        cost = math.floor(base * target_seconds / elapsed)
+    else:
+        # bcrypt rounds and scrypt log2(N) double the work per step
+        cost = base + math.floor(math.log2(target_seconds / elapsed))
+    low, high = COST_LIMITS[algorithm]
+    return max(low, min(high, cost))
+
+
+class PasscodeHasher:
+    """Hashes and verifies passcodes at the calibrated cost; rehashes outdated hashes"""
+
+    def __init__(self, algorithm: str, target_ms: float, cost: Optional[int], memory_kb: int):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"PASSCODE_HASH_ALGORITHM must be one of {', '.join(ALGORITHMS)}")
+        if algorithm == "argon2":
+            _require_argon2()
+        self.algorithm = algorithm
+        self.target_ms = target_ms
+        self.cost = cost
+        self.memory_kb = memory_kb if algorithm == "argon2" else 0
+        self._calibration: Optional[asyncio.Future] = None
+        self._pending: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.rehashed = 0
+        self.rehash_failures = 0
+
+    def _start_calibration(self) -> asyncio.Future:
+        if self._calibration is None:
+            self._calibration = asyncio.ensure_future(cpu_executor.run(
+                calibrate_cost, self.algorithm, self.target_ms / 1000, self.memory_kb
+            ))
+            self._calibration.add_done_callback(self._calibrated)
+        return self._calibration
+
+    def _calibrated(self, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            # Not kept: a saturated executor must not fail every later hash
+            self._calibration = None
+            return
+        if self.cost is None:
+            self.cost = future.result()
+            print(f"✓ Passcode hashing: {self.algorithm} cost {self.cost} (target {self.target_ms:.0f}ms per verification)")
+
+    async def calibrate(self) -> int:
+        """Pick the cost for this hardware once (no-op with PASSCODE_HASH_COST); a failed run is retried on the next call"""
+        if self.cost is not None:
+            return self.cost
+        cost = await asyncio.shield(self._start_calibration())
+        return self.cost if self.cost is not None else cost
+
+    async def hash(self, passcode: str) -> str:
+        """Hash a passcode on the CPU executor, at the floor cost if calibration failed"""
+        try:
+            cost = await self.calibrate()
+        except Exception:
+            # Outdated hashes are rehashed once calibration succeeds
+            cost = COST_LIMITS[self.algorithm][0]
+        with stage("passcode"):
+            return await cpu_executor.run(hash_with, self.algorithm, passcode, cost, self.memory_kb, process=True)
+
+    async def verify(self, passcode: str, stored: str, doc_id: Optional[str] = None) -> bool:
+        """
+        Check a passcode on the CPU executor. With `doc_id`, a matching hash made
+        with outdated parameters is replaced in the background.
+        """
+        with stage("passcode"):
+            valid = await cpu_executor.run(verify_hash, passcode, stored, process=True)
+        if valid and doc_id is not None:
+            if self.cost is None:
+                # Instances that never hash (e.g. fast startup, no uploads) still calibrate, so they can rehash
+                self._start_calibration()
+            elif self.needs_rehash(stored):
+                self._schedule_rehash(doc_id, passcode, stored)
+        return valid
+
+    def needs_rehash(self, stored: str) -> bool:
+        """
+        True if `stored` uses another algorithm or weaker parameters than the
+        current ones. Stronger hashes are kept, so instances calibrated on
+        different hardware do not keep rewriting each other's hashes.
+        """
+        if self.cost is None:
+            return False
+        try:
+            algorithm, cost, memory_kb = hash_parameters(stored)
+        except (ValueError, KeyError, IndexError):
+            return False
+        if algorithm != self.algorithm:
+            return True
+        return cost < self.cost or memory_kb < self.memory_kb
+
+    def _schedule_rehash(self, doc_id: str, passcode: str, old_hash: str):
+        if doc_id in self._pending:
+            return
+        self._pending.add(doc_id)
+        task = asyncio.create_task(self._rehash(doc_id, passcode, old_hash))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _rehash(self, doc_id: str, passcode: str, old_hash: str):
+        from sqlalchemy import update
+        from app.core.database import SessionLocal
+        from app.models.document import Document
+        from app.services.document_cache import document_cache
+        try:
+            new_hash = await self.hash(passcode)
+            async with SessionLocal() as db:
+                # Only replace the hash we verified against
+                result = await db.execute(
+                    update(Document)
+                    .where(Document.id == doc_id, Document.passcode_hash == old_hash)
+                    .values(passcode_hash=new_hash)
+                )
+                await db.commit()
+            if result.rowcount:
+                await document_cache.invalidate(doc_id)
+                self.rehashed += 1
+        except ExecutorSaturatedError:
+            pass  # Busy; the next successful verification tries again
+        except Exception as e:
+            self.rehash_failures += 1
+            print(f"Passcode rehash failed for document {doc_id}: {str(e)}")
+        finally:
+            self._pending.discard(doc_id)
+
+    async def stop(self):
+        """Cancel background rehashes on shutdown"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "algorithm": self.algorithm,
+            "cost": self.cost,
+            "memory_kb": self.memory_kb or None,
+            "target_ms": self.target_ms,
+            "rehashed": self.rehashed,
+            "rehash_failures": self.rehash_failures,
+            "rehash_pending": len(self._pending),
+        }
+
+
+# Singleton instance
+passcode_hasher = PasscodeHasher(PASSCODE_HASH_ALGORITHM, PASSCODE_VERIFY_TARGET_MS, PASSCODE_HASH_COST, PASSCODE_MEMORY_KB)
@@ -0,0 +1,195 @@
+"""
+Expired document reaper.
+
+Runs in-process on a background task (see the startup hook in app.main) or once
+from the command line:
+
+    python -m app.services.reaper
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from sqlalchemy import select, update, delete, and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import REAPER_INTERVAL, REAPER_BATCH_SIZE, REAPER_LEASE_TTL
+from app.core.database import engine, SessionLocal
+from app.models.document import Document
+from app.models.lease import Lease
+from app.services.storage import get_storage_service
+from app.services.document_cache import document_cache
+from app.services.dedup import blob_registry
+
+LEASE_NAME = "expired-document-reaper"
+
+
+class ExpiredDocumentReaper:
+    """
+    Deletes expired documents: pages through rows by `expires_at`, deletes their
+    blobs in batches and then the rows in bulk. A database lease ensures only one
+    instance reaps at a time.
+    """
+
+    def __init__(self, interval: float, batch_size: int, lease_ttl: float):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease_ttl = lease_ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.documents_reaped = 0
+        self.blob_failures = 0
+        self.last_run: Dict[str, Any] = {}
+
+    async def _acquire_lease(self, session: AsyncSession) -> bool:
+        """Take or renew the reaper lease; False if another instance holds it"""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_ttl)
+        result = await session.execute(
+            update(Lease)
+            .where(Lease.name == LEASE_NAME, or_(Lease.holder == self.holder, Lease.expires_at < now))
+            .values(holder=self.holder, expires_at=expires_at)
+        )
+        if result.rowcount == 0:
+            session.add(Lease(name=LEASE_NAME, holder=self.holder, expires_at=expires_at))
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Lease row exists and is held by someone else
+                await session.rollback()
+                return False
+            return True
+        await session.commit()
+        return True
+
+    async def _release_lease(self, session: AsyncSession):
+        await session.execute(
+            update(Lease)
+            .where(Lease.name == LEASE_NAME, Lease.holder == self.holder)
+            .values(expires_at=datetime.utcnow())
+        )
+        await session.commit()
+
+    async def reap_once(self) -> Dict[str, Any]:
+        """Run one reaping pass and return its throughput stats"""
+        started = time.perf_counter()
+        reaped = 0
+        failures = 0
+        async with SessionLocal() as session:
+            if not await self._acquire_lease(session):
+                return {"status": "skipped", "reason": "lease held by another instance"}
+
+            storage = await get_storage_service()
+            cutoff = datetime.utcnow()
+            last_key = None
+            try:
+                while True:
+                    # Keyset pagination on (expires_at, id) so blobs that fail to delete are skipped, not re-read
+                    query = select(Document.id, Document.encrypted_filename, Document.expires_at, Document.blob_id).where(
+                        Document.expires_at < cutoff
+                    )
+                    if last_key is not None:
+                        query = query.where(or_(
+                            Document.expires_at > last_key[0],
+                            and_(Document.expires_at == last_key[0], Document.id > last_key[1])
+                        ))
+                    query = query.order_by(Document.expires_at, Document.id).limit(self.batch_size)
+                    rows = (await session.execute(query)).all()
+                    if not rows:
+                        break
+                    last_key = (rows[-1].expires_at, rows[-1].id)
+
+                    # Blobs owned by a single document go first, rows stay if that fails
+                    owned = [row for row in rows if row.blob_id is None]
+                    failed = set(await storage.delete_files([row.encrypted_filename for row in owned]))
+                    reaped_ids = [row.id for row in owned if row.encrypted_filename not in failed]
+                    # Deduplicated rows release a reference; unreferenced blobs go after the commit
+                    shared = [row for row in rows if row.blob_id is not None]
+                    reaped_ids += [row.id for row in shared]
+                    orphaned = await blob_registry.release(session, [row.blob_id for row in shared])
+                    if reaped_ids:
+                        await session.execute(delete(Document).where(Document.id.in_(reaped_ids)))
+                    await session.commit()
+                    orphan_failures = await storage.delete_files(orphaned)
+                    if orphan_failures:
+                        print(f"Reaper: failed to delete unreferenced blob(s): {orphan_failures}")
+                    failed.update(orphan_failures)
+                    for doc_id in reaped_ids:
+                        await document_cache.invalidate(doc_id)
+                    reaped += len(reaped_ids)
+                    failures += len(failed)
+
+                    if len(rows) < self.batch_size:
+                        break
+                    # Keep the lease alive across long passes
+                    if not await self._acquire_lease(session):
+                        break
+            finally:
+                await self._release_lease(session)
+
+        duration = time.perf_counter() - started
+        self.runs += 1
+        self.documents_reaped += reaped
+        self.blob_failures += failures
+        self.last_run = {
+            "status": "completed",
+            "finished_at": datetime.utcnow().isoformat(),
+            "documents_reaped": reaped,
+            "blob_failures": failures,
+            "duration_seconds": round(duration, 3),
+            "documents_per_second": round(reaped / duration, 1) if duration > 0 else 0.0
+        }
+        return self.last_run
+
+    async def _loop(self):
+        while True:
+            try:
+                result = await self.reap_once()
+                if result.get("documents_reaped"):
+                    print(f"Reaper: removed {result['documents_reaped']} expired documents "
+                          f"in {result['duration_seconds']}s")
+            except Exception as e:
+                print(f"Reaper error: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "documents_reaped": self.documents_reaped,
+            "blob_failures": self.blob_failures,
+            "last_run": self.last_run
+        }
+
+
+# Singleton instance
+reaper = ExpiredDocumentReaper(REAPER_INTERVAL, REAPER_BATCH_SIZE, REAPER_LEASE_TTL)
+
+
+async def main():
+    try:
+        print(await reaper.reap_once())
+    finally:
+        from app.services.storage import close_storage_service
+        await close_storage_service()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
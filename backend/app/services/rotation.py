@@ -0,0 +1,163 @@
+"""
+Online key rotation: re-encrypts every blob that is not under the primary key
+(including legacy Fernet blobs) while the application keeps serving traffic.
+
+Progress is checkpointed to ROTATION_STATE_FILE, so an interrupted run resumes
+where it stopped. Throughput can be capped with --max-bytes-per-sec.
+
+    python -m app.services.rotation --max-bytes-per-sec 10000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator, Optional
+from sqlalchemy import select, update
+from app.core.config import ROTATION_STATE_FILE
+from app.core.database import engine, SessionLocal
+from app.models.blob import Blob
+from app.models.document import Document
+from app.services.encryption import encryption_service
+from app.services.storage import get_storage_service
+from app.services.document_cache import document_cache
+
+
+class PlaintextReader:
+    """
+    Adapts a decrypted chunk stream to the `read(size)` interface of UploadFile.
+    `content_type` is passed on so the compression policy sees the original MIME type.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes], content_type: Optional[str] = None):
+        self._chunks = chunks
+        self.content_type = content_type
+        self._buffer = bytearray()
+
+    async def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += await self._chunks.__anext__()
+            except StopAsyncIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def _load_state(state_file: str, primary_id: int) -> Optional[str]:
+    """Last processed document ID, if the checkpoint is for the current primary key"""
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file) as f:
+        state = json.load(f)
+    return state.get("last_id") if state.get("primary_key_id") == primary_id else None
+
+
+def _save_state(state_file: str, primary_id: int, last_id: str):
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"primary_key_id": primary_id, "last_id": last_id}, f)
+    os.replace(tmp_file, state_file)
+
+
+async def rotate(
+    max_bytes_per_sec: Optional[float] = None,
+    batch_size: int = 100,
+    state_file: str = ROTATION_STATE_FILE,
+    restart: bool = False
+) -> dict:
+    primary_id = encryption_service.keyring.primary_id
+    storage = await get_storage_service()
+    last_id = None if restart else _load_state(state_file, primary_id)
+    stats = {"primary_key_id": primary_id, "rotated": 0, "up_to_date": 0, "missing": 0, "bytes": 0}
+    started = time.perf_counter()
+    rewritten = set()
+
+    async with SessionLocal() as session:
+        while True:
+            query = select(Document).order_by(Document.id).limit(batch_size)
+            if last_id is not None:
+                query = query.where(Document.id > last_id)
+            documents = (await session.execute(query)).scalars().all()
+            if not documents:
+                break
+
+            for doc in documents:
+                old_filename = doc.encrypted_filename
+                if old_filename in rewritten:
+                    # Deduplicated blob already re-encrypted for another document
+                    stats["up_to_date"] += 1
+                    last_id = doc.id
+                    continue
+                try:
+                    prefix = await storage.read_blob_prefix(old_filename)
+                except FileNotFoundError:
+                    stats["missing"] += 1
+                    prefix = None
+
+                if prefix is not None and (
+                    encryption_service.is_stream_blob(prefix)
+                    and encryption_service.blob_key_id(prefix) == primary_id
+                ):
+                    stats["up_to_date"] += 1
+                elif prefix is not None:
+                    # Write a new blob under the primary key, then swap the row over to it
+                    new_filename = storage.generate_unique_filename(doc.original_filename)
+                    reader = PlaintextReader(storage.get_decrypted_file(old_filename), doc.mime_type)
+                    await storage.save_encrypted_file(reader, new_filename)
+                    # The blob row first: it is locked by uploads taking a reference,
+                    # so their documents are committed before the swap below
+                    await session.execute(
+                        update(Blob)
+                        .where(Blob.encrypted_filename == old_filename)
+                        .values(encrypted_filename=new_filename)
+                    )
+                    # Every document sharing the blob moves over together
+                    result = await session.execute(
+                        update(Document)
+                        .where(Document.encrypted_filename == old_filename)
+                        # Re-encrypted server side, so browsers can no longer decrypt it directly
+                        .values(encrypted_filename=new_filename, encryption_header=None)
+                        .execution_options(synchronize_session=False)
+                    )
+                    await session.commit()
+                    rewritten.add(old_filename)
+                    # Only reaches shared cache backends; app instances re-read on a missing blob
+                    await document_cache.invalidate(doc.id)
+                    # If the document was deleted meanwhile, drop the new blob instead of the old one
+                    stale_filename = old_filename if result.rowcount else new_filename
+                    await storage.delete_files([stale_filename])
+                    stats["rotated"] += 1
+                    stats["bytes"] += doc.file_size
+
+                    if max_bytes_per_sec:
+                        ahead = stats["bytes"] / max_bytes_per_sec - (time.perf_counter() - started)
+                        if ahead > 0:
+                            await asyncio.sleep(ahead)
+
+                last_id = doc.id
+                _save_state(state_file, primary_id, last_id)
+
+    stats["duration_seconds"] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+async def main(args):
+    try:
+        print(json.dumps(await rotate(args.max_bytes_per_sec, args.batch_size, args.state_file, args.restart)))
+    finally:
+        from app.services.storage import close_storage_service
+        await close_storage_service()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-encrypt blobs under the primary encryption key")
+    parser.add_argument("--max-bytes-per-sec", type=float, default=None, help="Throttle re-encryption throughput")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--state-file", default=ROTATION_STATE_FILE)
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+    asyncio.run(main(parser.parse_args()))
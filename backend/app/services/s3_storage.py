@@ -1,17 +1,115 @@
+import asyncio
 import os
 import uuid
+from contextlib import AsyncExitStack
 from pathlib import Path
 from fastapi import UploadFile
-from typing import Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import aioboto3
+from aiobotocore.config import AioConfig
 from botocore.exceptions import ClientError, BotoCoreError
 from app.core.config import (
     S3_BUCKET_NAME, S3_REGION, AWS_ACCESS_KEY_ID, 
-    AWS_SECRET_ACCESS_KEY, S3_ENDPOINT_URL, MAX_FILE_SIZE
+    AWS_SECRET_ACCESS_KEY, S3_ENDPOINT_URL, DOWNLOAD_READ_SIZE,
+    S3_MAX_POOL_CONNECTIONS, S3_CONNECT_TIMEOUT, S3_READ_TIMEOUT,
+    S3_MAX_ATTEMPTS, S3_KEEPALIVE_TIMEOUT, S3_MULTIPART_THRESHOLD,
+    S3_MULTIPART_PART_SIZE, S3_MULTIPART_CONCURRENCY, S3_PART_MAX_ATTEMPTS
 )
-from app.services.encryption import encryption_service
+from app.core.executor import cpu_executor
+from app.core.metrics import stage, count_bytes, metered_stream, instrument_s3_client
+from app.services.encryption import encryption_service, StreamHeader, HEADER_SIZE
+from app.services.blob_cache import blob_cache, CachedBlob
+from app.services.storage_backend import StorageBackend
 
-class S3StorageService:
+# DeleteObjects accepts at most 1000 keys per request
+S3_DELETE_BATCH_SIZE = 1000
+
+class MultipartUpload:
+    """
+    Uploads the parts of one S3 object concurrently.
+    At most S3_MULTIPART_CONCURRENCY parts are buffered or in flight at a time,
+    each part is retried individually and the upload is aborted on failure.
+    """
+    
+    def __init__(self, s3_client, bucket_name: str, key: str, upload_id: str):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.upload_id = upload_id
+        self._slots = asyncio.Semaphore(S3_MULTIPART_CONCURRENCY)
+        self._tasks: List[asyncio.Task] = []
+        self._etags: Dict[int, str] = {}
+    
+    @classmethod
+    async def create(cls, s3_client, bucket_name: str, key: str) -> "MultipartUpload":
+        response = await s3_client.create_multipart_upload(
+            Bucket=bucket_name,
+            Key=key,
+            ServerSideEncryption='AES256'
+        )
+        return cls(s3_client, bucket_name, key, response['UploadId'])
+    
+    async def submit(self, body: bytes):
+        """Queue the next part, waiting while the concurrency limit is reached"""
+        await self._slots.acquire()
+        for task in self._tasks:
+            if task.done() and task.exception():
+                self._slots.release()
+                raise task.exception()
+        part_number = len(self._tasks) + 1
+        self._tasks.append(asyncio.create_task(self._upload_part(part_number, body)))
+    
+    async def _upload_part(self, part_number: int, body: bytes):
+        try:
+            for attempt in range(1, S3_PART_MAX_ATTEMPTS + 1):
+                try:
+                    response = await self.s3_client.upload_part(
+                        Bucket=self.bucket_name,
+                        Key=self.key,
+                        UploadId=self.upload_id,
+                        PartNumber=part_number,
+                        Body=body
+                    )
+                    self._etags[part_number] = response['ETag']
+                    return
+                except (ClientError, BotoCoreError):
+                    if attempt == S3_PART_MAX_ATTEMPTS:
+                        raise
+                    await asyncio.sleep(0.2 * 2 ** (attempt - 1))
+        finally:
+            self._slots.release()
+    
+    async def complete(self):
+        """Wait for all parts and assemble the object"""
+        await asyncio.gather(*self._tasks)
+        await self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={
+                'Parts': [
+                    {'ETag': self._etags[number], 'PartNumber': number}
+                    for number in sorted(self._etags)
+                ]
+            }
+        )
+    
+    async def abort(self):
+        """Cancel outstanding parts and discard the uploaded ones"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            await self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                UploadId=self.upload_id
+            )
+        except (ClientError, BotoCoreError):
+            # Orphaned parts are cleaned up by the bucket's lifecycle rule
+            pass
+
+class S3StorageService(StorageBackend):
     def __init__(self):
         self.bucket_name = S3_BUCKET_NAME
         self.region = S3_REGION
@@ -33,43 +131,93 @@ class S3StorageService:
         
         if S3_ENDPOINT_URL:
             self.s3_config['endpoint_url'] = S3_ENDPOINT_URL
+        
+        # Connection pool, keep-alive, retry and timeout settings for the shared client
+        self.s3_config['config'] = AioConfig(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            connect_timeout=S3_CONNECT_TIMEOUT,
+            read_timeout=S3_READ_TIMEOUT,
+            retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': 'adaptive'},
+            tcp_keepalive=True,
+            connector_args={'keepalive_timeout': S3_KEEPALIVE_TIMEOUT}
+        )
+        
+        # One long-lived client per service, opened by start() and closed by close()
+        self._exit_stack: Optional[AsyncExitStack] = None
+        self._client = None
+        self._client_lock = asyncio.Lock()
+    
+    async def start(self):
+        """Open the shared S3 client (and its connection pool)"""
+        async with self._client_lock:
+            if self._client is None:
+                exit_stack = AsyncExitStack()
+                self._client = await exit_stack.enter_async_context(self.session.client(**self.s3_config))
+                instrument_s3_client(self._client)
+                self._exit_stack = exit_stack
+    
+    async def close(self):
+        """Close the shared S3 client and release pooled connections"""
+        async with self._client_lock:
+            if self._exit_stack is not None:
+                await self._exit_stack.aclose()
+            self._exit_stack = None
+            self._client = None
+    
+    async def get_client(self):
+        """Return the shared S3 client, opening it on first use"""
+        if self._client is None:
+            await self.start()
+        return self._client
+    
+    async def check_bucket(self) -> bool:
+        """
+        Cheap read-only check (a single HEAD request) that the bucket is reachable.
+        Used by the background health probe; raises ValueError if not.
+        """
+        s3_client = await self.get_client()
+        try:
+            await s3_client.head_bucket(Bucket=self.bucket_name)
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code', '')
+            if error_code == '404':
+                raise ValueError(f"S3 bucket '{self.bucket_name}' does not exist")
+            elif error_code == '403':
+                raise ValueError(f"Access denied to S3 bucket '{self.bucket_name}'. Check your AWS credentials.")
+            else:
+                raise ValueError(f"Error accessing S3 bucket: {str(e)}")
+        except BotoCoreError as e:
+            raise ValueError(f"Failed to connect to S3: {str(e)}")
+        return True
     
     async def validate_bucket(self) -> bool:
         """
         Validate that the S3 bucket exists and is accessible.
+        Also writes and deletes a test object, so it only runs at startup.
         Returns True if valid, raises exception if not.
         """
         try:
-            async with self.session.client(**self.s3_config) as s3_client:
-                # Check if bucket exists
-                try:
-                    await s3_client.head_bucket(Bucket=self.bucket_name)
-                except ClientError as e:
-                    error_code = e.response.get('Error', {}).get('Code', '')
-                    if error_code == '404':
-                        raise ValueError(f"S3 bucket '{self.bucket_name}' does not exist")
-                    elif error_code == '403':
-                        raise ValueError(f"Access denied to S3 bucket '{self.bucket_name}'. Check your AWS credentials.")
-                    else:
-                        raise ValueError(f"Error accessing S3 bucket: {str(e)}")
-                
-                # Test write permissions
-                test_key = f".test/{uuid.uuid4()}"
-                try:
-                    await s3_client.put_object(
-                        Bucket=self.bucket_name,
-                        Key=test_key,
-                        Body=b"test"
-                    )
-                    # Clean up test object
-                    await s3_client.delete_object(
-                        Bucket=self.bucket_name,
-                        Key=test_key
-                    )
-                except ClientError as e:
-                    raise ValueError(f"No write permission to S3 bucket '{self.bucket_name}': {str(e)}")
+            # Check if bucket exists
+            await self.check_bucket()
+            s3_client = await self.get_client()
+            
+            # Test write permissions
+            test_key = f".test/{uuid.uuid4()}"
+            try:
+                await s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=test_key,
+                    Body=b"test"
+                )
+                # Clean up test object
+                await s3_client.delete_object(
+                    Bucket=self.bucket_name,
+                    Key=test_key
+                )
+            except ClientError as e:
+                raise ValueError(f"No write permission to S3 bucket '{self.bucket_name}': {str(e)}")
                 
-                return True
+            return True
         except BotoCoreError as e:
             raise ValueError(f"Failed to connect to S3: {str(e)}")
         except Exception as e:
@@ -86,52 +234,175 @@ class S3StorageService:
     
     async def save_encrypted_file(self, file: UploadFile, encrypted_filename: str) -> int:
         """
-        Save and encrypt uploaded file to S3.
+        Stream, encrypt and upload file to S3.
+        Small blobs go up in a single PUT; once the ciphertext passes
+        S3_MULTIPART_THRESHOLD it is uploaded as concurrent multipart parts.
         Returns the file size.
         """
-        # Read file content
-        content = await file.read()
-        
-        # Check file size
-        if len(content) > MAX_FILE_SIZE:
-            raise ValueError(f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB")
-        
-        # Encrypt the content
-        encrypted_content = encryption_service.encrypt(content)
-        
-        # Upload to S3
+        # Compressed before encryption unless the MIME type is already compressed
+        encryptor = encryption_service.encryptor_for(getattr(file, "content_type", None))
+        await self.upload_encrypted(encrypted_filename, encryption_service.encrypt_upload(file, encryptor))
+        return encryptor.plaintext_size  # Return original file size
+    
+    async def upload_encrypted(self, encrypted_filename: str, encrypted_chunks: AsyncIterator[bytes]) -> int:
+        """
+        Upload already encrypted data as blob `encrypted_filename`, in a single
+        PUT or as multipart parts past S3_MULTIPART_THRESHOLD. Returns the bytes written.
+        """
+        s3_client = await self.get_client()
+        buffer = bytearray()
+        written = 0
+        upload: Optional[MultipartUpload] = None
+        completed = False
         try:
-            async with self.session.client(**self.s3_config) as s3_client:
-                await s3_client.put_object(
-                    Bucket=self.bucket_name,
-                    Key=encrypted_filename,
-                    Body=encrypted_content,
-                    ServerSideEncryption='AES256'  # Additional S3 server-side encryption
-                )
-        except ClientError as e:
+            async for encrypted_chunk in encrypted_chunks:
+                buffer += encrypted_chunk
+                if upload is None:
+                    if len(buffer) < S3_MULTIPART_THRESHOLD:
+                        continue
+                    upload = await MultipartUpload.create(s3_client, self.bucket_name, encrypted_filename)
+                while len(buffer) >= S3_MULTIPART_PART_SIZE:
+                    # Waits while S3_MULTIPART_CONCURRENCY parts are already in flight
+                    with stage("storage_put"):
+                        await upload.submit(bytes(buffer[:S3_MULTIPART_PART_SIZE]))
+                    count_bytes("storage_written", S3_MULTIPART_PART_SIZE)
+                    written += S3_MULTIPART_PART_SIZE
+                    del buffer[:S3_MULTIPART_PART_SIZE]
+            
+            if upload is None:
+                # Upload to S3
+                with stage("storage_put"):
+                    await s3_client.put_object(
+                        Bucket=self.bucket_name,
+                        Key=encrypted_filename,
+                        Body=bytes(buffer),
+                        ServerSideEncryption='AES256'  # Additional S3 server-side encryption
+                    )
+            else:
+                with stage("storage_put"):
+                    if buffer:
+                        await upload.submit(bytes(buffer))
+                    await upload.complete()
+            completed = True
+            count_bytes("storage_written", len(buffer))
+            written += len(buffer)
+        except (ClientError, BotoCoreError) as e:
             raise ValueError(f"Failed to upload file to S3: {str(e)}")
-        
-        return len(content)  # Return original file size
+        finally:
+            # Also on cancellation (client disconnect), which is not an Exception;
+            # shielded so a second cancel cannot leave the parts uploading
+            if upload is not None and not completed:
+                await asyncio.shield(upload.abort())
+        return written
+    
+    async def read_blob_prefix(self, encrypted_filename: str) -> bytes:
+        """Read the first HEADER_SIZE bytes of an encrypted file (enough to parse its header)"""
+        s3_client = await self.get_client()
+        try:
+            response = await s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=encrypted_filename,
+                Range=f"bytes=0-{HEADER_SIZE - 1}"
+            )
+            return await response['Body'].read()
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code', '')
+            if error_code == 'NoSuchKey':
+                raise FileNotFoundError(f"File not found in S3: {encrypted_filename}")
+            raise ValueError(f"Failed to retrieve file from S3: {str(e)}")
+    
+    async def _fetch_blob(self, s3_client, encrypted_filename: str) -> bytes:
+        """Whole encrypted object, for the blob cache"""
+        with stage("storage_get"):
+            response = await s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=encrypted_filename
+            )
+            encrypted_content = await response['Body'].read()
+        count_bytes("storage_read", len(encrypted_content))
+        return encrypted_content
+    
+    async def _decrypt_blob(self, blob: CachedBlob, start: int, end: Optional[int]) -> AsyncIterator[bytes]:
+        """Decrypt the segments covering `start`..`end` of a blob from the cache (or fetched whole); closes it"""
+        try:
+            prefix = await blob.read(0, HEADER_SIZE)
+            if not encryption_service.is_stream_blob(prefix):
+                encrypted_content = await blob.read(0, blob.size)
+                decrypted_content = await cpu_executor.run(encryption_service.decrypt, encrypted_content, wait=True)
+                yield decrypted_content[start:None if end is None else end + 1]
+                return
+            
+            header = StreamHeader.unpack(prefix)
+            span = header.segment_range(blob.size, start, end)
+            
+            async def read_encrypted() -> AsyncIterator[bytes]:
+                for offset in range(span.offset, span.offset + span.length, DOWNLOAD_READ_SIZE):
+                    yield await blob.read(offset, min(DOWNLOAD_READ_SIZE, span.offset + span.length - offset))
+            
+            async for chunk in encryption_service.decrypt_segments(header, span, read_encrypted()):
+                yield chunk
+        finally:
+            blob.close()
     
-    async def get_decrypted_file(self, encrypted_filename: str) -> bytes:
+    async def get_decrypted_file(
+        self,
+        encrypted_filename: str,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
         """
-        Retrieve and decrypt file from S3.
+        Retrieve and decrypt file from S3 chunk by chunk.
+        Only the segments covering the inclusive byte range `start`..`end` are fetched.
+        Blobs small enough for the blob cache are fetched whole, once, and served from it.
         """
         try:
-            async with self.session.client(**self.s3_config) as s3_client:
-                # Get object from S3
+            s3_client = await self.get_client()
+            fetch = lambda: self._fetch_blob(s3_client, encrypted_filename)
+            if encrypted_filename in blob_cache:
+                async for chunk in self._decrypt_blob(await blob_cache.get(encrypted_filename, fetch), start, end):
+                    yield chunk
+                return
+            
+            # Fetch the blob header first to locate the segments
+            with stage("storage_get"):
                 response = await s3_client.get_object(
                     Bucket=self.bucket_name,
-                    Key=encrypted_filename
+                    Key=encrypted_filename,
+                    Range=f"bytes=0-{HEADER_SIZE - 1}"
                 )
+                prefix = await response['Body'].read()
+            content_range = response.get('ContentRange')
+            encrypted_size = int(content_range.rsplit('/', 1)[1]) if content_range else response['ContentLength']
+            
+            # Small blobs are fetched whole into the cache, once for all concurrent downloads;
+            # legacy Fernet blobs can only be decrypted as a whole
+            cacheable = blob_cache.cacheable(encrypted_size)
+            if cacheable or not encryption_service.is_stream_blob(prefix):
+                if cacheable:
+                    blob = await blob_cache.get(encrypted_filename, fetch)
+                else:
+                    encrypted_content = await fetch()
+                    blob = CachedBlob(len(encrypted_content), data=encrypted_content)
+                async for chunk in self._decrypt_blob(blob, start, end):
+                    yield chunk
+                return
                 
-                # Read encrypted content
-                encrypted_content = await response['Body'].read()
-                
-                # Decrypt the content
-                decrypted_content = encryption_service.decrypt(encrypted_content)
-                
-                return decrypted_content
+            header = StreamHeader.unpack(prefix)
+            span = header.segment_range(encrypted_size, start, end)
+            with stage("storage_get"):
+                response = await s3_client.get_object(
+                    Bucket=self.bucket_name,
+                    Key=encrypted_filename,
+                    Range=f"bytes={span.offset}-{span.offset + span.length - 1}"
+                )
+            body = response['Body']
+            try:
+                encrypted_chunks = metered_stream(body.iter_chunks(DOWNLOAD_READ_SIZE), "storage_get", "storage_read")
+                async for chunk in encryption_service.decrypt_segments(header, span, encrypted_chunks):
+                    yield chunk
+            finally:
+                # A client disconnect stops the download mid-body; drop the connection now, not at GC
+                body.close()
         except ClientError as e:
             error_code = e.response.get('Error', {}).get('Code', '')
             if error_code == 'NoSuchKey':
@@ -139,20 +410,108 @@ class S3StorageService:
             else:
                 raise ValueError(f"Failed to retrieve file from S3: {str(e)}")
     
+    async def presign_put(self, encrypted_filename: str, expires_in: int) -> Tuple[str, Dict[str, str]]:
+        """
+        Presigned PUT URL for a single-request direct upload.
+        Returns the URL and the headers the client must send with it.
+        """
+        s3_client = await self.get_client()
+        url = await s3_client.generate_presigned_url(
+            'put_object',
+            Params={'Bucket': self.bucket_name, 'Key': encrypted_filename, 'ServerSideEncryption': 'AES256'},
+            ExpiresIn=expires_in
+        )
+        return url, {'x-amz-server-side-encryption': 'AES256'}
+    
+    async def presign_multipart(self, encrypted_filename: str, part_count: int, expires_in: int) -> Tuple[str, List[str]]:
+        """Start a multipart upload and presign one URL per part; returns the upload ID and part URLs"""
+        s3_client = await self.get_client()
+        upload_id = (await MultipartUpload.create(s3_client, self.bucket_name, encrypted_filename)).upload_id
+        urls = [
+            await s3_client.generate_presigned_url(
+                'upload_part',
+                Params={
+                    'Bucket': self.bucket_name,
+                    'Key': encrypted_filename,
+                    'UploadId': upload_id,
+                    'PartNumber': part_number
+                },
+                ExpiresIn=expires_in
+            )
+            for part_number in range(1, part_count + 1)
+        ]
+        return upload_id, urls
+    
+    async def complete_multipart(self, encrypted_filename: str, upload_id: str, etags: Dict[int, str]):
+        """Assemble a multipart upload whose parts were sent by the client"""
+        s3_client = await self.get_client()
+        try:
+            await s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=encrypted_filename,
+                UploadId=upload_id,
+                MultipartUpload={
+                    'Parts': [{'ETag': etags[number], 'PartNumber': number} for number in sorted(etags)]
+                }
+            )
+        except ClientError as e:
+            raise ValueError(f"Failed to complete multipart upload: {str(e)}")
+    
+    async def presign_get(self, encrypted_filename: str, expires_in: int) -> str:
+        """Presigned GET URL for a direct download of the encrypted blob"""
+        s3_client = await self.get_client()
+        return await s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket_name, 'Key': encrypted_filename},
+            ExpiresIn=expires_in
+        )
+    
+    async def stat(self, encrypted_filename: str) -> int:
+        """Size of a stored blob; FileNotFoundError if it does not exist"""
+        s3_client = await self.get_client()
+        try:
+            response = await s3_client.head_object(Bucket=self.bucket_name, Key=encrypted_filename)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code', '') in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(f"File not found in S3: {encrypted_filename}")
+            raise ValueError(f"Failed to retrieve file from S3: {str(e)}")
+        return response['ContentLength']
+    
     async def delete_file(self, encrypted_filename: str) -> bool:
         """
         Delete encrypted file from S3.
         """
+        await blob_cache.invalidate([encrypted_filename])
         try:
-            async with self.session.client(**self.s3_config) as s3_client:
-                await s3_client.delete_object(
-                    Bucket=self.bucket_name,
-                    Key=encrypted_filename
-                )
-                return True
+            s3_client = await self.get_client()
+            await s3_client.delete_object(
+                Bucket=self.bucket_name,
+                Key=encrypted_filename
+            )
+            return True
         except ClientError as e:
             # Log error but don't fail if file doesn't exist
             return False
+    
+    async def delete_files(self, encrypted_filenames: List[str]) -> List[str]:
+        """
+        Delete many encrypted files with batched DeleteObjects calls (up to 1000 keys each).
+        Returns the filenames that could not be deleted.
+        """
+        await blob_cache.invalidate(encrypted_filenames)
+        s3_client = await self.get_client()
+        failed = []
+        for i in range(0, len(encrypted_filenames), S3_DELETE_BATCH_SIZE):
+            batch = encrypted_filenames[i:i + S3_DELETE_BATCH_SIZE]
+            try:
+                response = await s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+                failed.extend(error['Key'] for error in response.get('Errors', []))
+            except (ClientError, BotoCoreError):
+                failed.extend(batch)
+        return failed
 
 # Singleton instance (will be initialized if USE_S3 is True)
 s3_storage_service: Optional[S3StorageService] = None
@@ -162,8 +521,17 @@ async def get_s3_storage_service() -> Optional[S3StorageService]:
     global s3_storage_service
     if s3_storage_service is None:
         try:
-            s3_storage_service = S3StorageService()
-            await s3_storage_service.validate_bucket()
+            # Bucket validation happens once in the startup hook, not on first use
+            service = S3StorageService()
+            await service.start()
+            s3_storage_service = service
         except Exception as e:
             raise ValueError(f"S3 storage initialization failed: {str(e)}")
     return s3_storage_service
+
+async def close_s3_storage_service():
+    """Close the shared S3 client on application shutdown"""
+    global s3_storage_service
+    if s3_storage_service is not None:
+        await s3_storage_service.close()
+        s3_storage_service = None
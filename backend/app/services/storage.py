@@ -1,15 +1,57 @@
+import asyncio
+import hashlib
 import uuid
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from fastapi import UploadFile
-from typing import Union
-from app.core.config import STORAGE_DIR, MAX_FILE_SIZE, USE_S3
-from app.services.encryption import encryption_service
+import importlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from app.core.config import STORAGE_DIR, STORAGE_BACKEND, USE_S3, DOWNLOAD_READ_SIZE, LOCAL_IO_WORKERS, STORAGE_SHARD_LEVELS, LOCAL_FSYNC
+from app.core.executor import cpu_executor
+from app.core.metrics import stage, count_bytes, metered_stream
+from app.services.encryption import encryption_service, StreamHeader, HEADER_SIZE
+from app.services.storage_backend import StorageBackend
 
-class LocalStorageService:
+class LocalStorageService(StorageBackend):
+    """
+    Encrypted blobs on the local filesystem (or a mounted volume).
+    All file system calls run on a dedicated I/O thread pool so a slow disk never
+    blocks the event loop. Blobs are sharded into hashed subdirectories.
+    """
+    
     def __init__(self):
         self.storage_dir = Path(STORAGE_DIR)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self._io_pool: Optional[ThreadPoolExecutor] = None
+    
+    async def _io(self, fn: Callable, *args: Any) -> Any:
+        """Run a blocking file system call on the storage I/O pool"""
+        if self._io_pool is None:
+            self._io_pool = ThreadPoolExecutor(max_workers=LOCAL_IO_WORKERS, thread_name_prefix="storage-io")
+        return await asyncio.get_running_loop().run_in_executor(self._io_pool, fn, *args)
+    
+    async def close(self):
+        if self._io_pool is not None:
+            pool, self._io_pool = self._io_pool, None
+            # Waiting for in-flight file operations blocks; do it off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown, True)
+    
+    def blob_path(self, encrypted_filename: str) -> Path:
+        """Sharded location: <storage>/ab/cd/<name> with ab, cd from a hash of the name"""
+        digest = hashlib.sha256(encrypted_filename.encode()).hexdigest()
+        shards = [digest[2 * level:2 * level + 2] for level in range(STORAGE_SHARD_LEVELS)]
+        return self.storage_dir.joinpath(*shards, encrypted_filename)
+    
+    def _existing_path(self, encrypted_filename: str) -> Path:
+        """Sharded path, falling back to the flat layout used before sharding"""
+        path = self.blob_path(encrypted_filename)
+        if not path.exists():
+            legacy_path = self.storage_dir / encrypted_filename
+            if legacy_path.exists():
+                return legacy_path
+            raise FileNotFoundError(f"File not found: {encrypted_filename}")
+        return path
     
     def generate_unique_filename(self, original_filename: str) -> str:
         """
@@ -22,68 +64,234 @@ class LocalStorageService:
         unique_id = str(uuid.uuid4())
         return f"{unique_id}{ext}"
     
+    @staticmethod
+    def _open_temp(path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        return temp_path, open(temp_path, 'wb')
+    
+    @staticmethod
+    def _commit_temp(f, temp_path: Path, path: Path):
+        """Flush, fsync (per LOCAL_FSYNC) and atomically move the temp file into place"""
+        f.flush()
+        if LOCAL_FSYNC in ("file", "always"):
+            os.fsync(f.fileno())
+        f.close()
+        os.replace(temp_path, path)
+        if LOCAL_FSYNC == "always":
+            # Make the rename itself durable
+            dir_fd = os.open(path.parent, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+    
+    @staticmethod
+    def _discard_temp(f, temp_path: Path):
+        f.close()
+        temp_path.unlink(missing_ok=True)
+    
     async def save_encrypted_file(self, file: UploadFile, encrypted_filename: str) -> int:
         """
-        Save and encrypt uploaded file.
+        Stream, encrypt and save uploaded file segment by segment.
+        Data goes to a temp file that is renamed into place once complete,
+        so a crash never leaves a partial blob under its final name.
         Returns the file size.
         """
-        # Read file content
-        content = await file.read()
+        # Compressed before encryption unless the MIME type is already compressed
+        encryptor = encryption_service.encryptor_for(getattr(file, "content_type", None))
+        file_path = self.blob_path(encrypted_filename)
+        temp_path, f = await self._io(self._open_temp, file_path)
+        try:
+            async for encrypted_chunk in encryption_service.encrypt_upload(file, encryptor):
+                with stage("storage_put"):
+                    await self._io(f.write, encrypted_chunk)
+                count_bytes("storage_written", len(encrypted_chunk))
+            with stage("storage_put"):
+                await self._io(self._commit_temp, f, temp_path, file_path)
+        except BaseException:
+            # Never leave a partial blob behind (e.g. size limit hit mid-stream)
+            await asyncio.shield(self._io(self._discard_temp, f, temp_path))
+            raise
         
-        # Check file size
-        if len(content) > MAX_FILE_SIZE:
-            raise ValueError(f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB")
-        
-        # Encrypt the content
-        encrypted_content = encryption_service.encrypt(content)
-        
-        # Save encrypted file with unique filename
-        file_path = self.storage_dir / encrypted_filename
-        with open(file_path, 'wb') as f:
-            f.write(encrypted_content)
-        
-        return len(content)  # Return original file size
+        return encryptor.plaintext_size  # Return original file size
+    
+    def _read_prefix(self, encrypted_filename: str) -> bytes:
+        with open(self._existing_path(encrypted_filename), 'rb') as f:
+            return f.read(HEADER_SIZE)
+    
+    async def read_blob_prefix(self, encrypted_filename: str) -> bytes:
+        """Read the first HEADER_SIZE bytes of an encrypted file (enough to parse its header)"""
+        return await self._io(self._read_prefix, encrypted_filename)
+    
+    async def stat(self, encrypted_filename: str) -> int:
+        """Size of a stored blob; FileNotFoundError if it does not exist"""
+        path = await self._io(self._existing_path, encrypted_filename)
+        return (await self._io(path.stat)).st_size
     
-    async def get_decrypted_file(self, encrypted_filename: str) -> bytes:
+    def _open_blob(self, encrypted_filename: str):
+        f = open(self._existing_path(encrypted_filename), 'rb')
+        try:
+            return f, f.read(HEADER_SIZE), os.fstat(f.fileno()).st_size
+        except BaseException:
+            f.close()
+            raise
+    
+    @staticmethod
+    def _read_at(f, offset: int, size: int) -> bytes:
+        f.seek(offset)
+        return f.read(size)
+    
+    async def get_decrypted_file(
+        self,
+        encrypted_filename: str,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
         """
-        Retrieve and decrypt file.
+        Retrieve and decrypt file chunk by chunk.
+        Only the segments covering the inclusive byte range `start`..`end` are read,
+        DOWNLOAD_READ_SIZE bytes at a time on the I/O pool.
         """
-        file_path = self.storage_dir / encrypted_filename
-        
-        if not file_path.exists():
-            raise FileNotFoundError(f"File not found: {encrypted_filename}")
-        
-        # Read encrypted file
-        with open(file_path, 'rb') as f:
-            encrypted_content = f.read()
-        
-        # Decrypt the content
-        decrypted_content = encryption_service.decrypt(encrypted_content)
-        
-        return decrypted_content
+        f, prefix, encrypted_size = await self._io(self._open_blob, encrypted_filename)
+        try:
+            # Legacy Fernet blobs can only be decrypted as a whole
+            if not encryption_service.is_stream_blob(prefix):
+                with stage("storage_get"):
+                    encrypted_data = await self._io(self._read_at, f, 0, encrypted_size)
+                count_bytes("storage_read", len(encrypted_data))
+                decrypted_content = await cpu_executor.run(encryption_service.decrypt, encrypted_data, wait=True)
+                yield decrypted_content[start:None if end is None else end + 1]
+                return
+            
+            header = StreamHeader.unpack(prefix)
+            span = header.segment_range(encrypted_size, start, end)
+            
+            async def read_encrypted() -> AsyncIterator[bytes]:
+                offset, remaining = span.offset, span.length
+                while remaining > 0:
+                    data = await self._io(self._read_at, f, offset, min(DOWNLOAD_READ_SIZE, remaining))
+                    if not data:
+                        break
+                    offset += len(data)
+                    remaining -= len(data)
+                    yield data
+            
+            encrypted_chunks = metered_stream(read_encrypted(), "storage_get", "storage_read")
+            async for chunk in encryption_service.decrypt_segments(header, span, encrypted_chunks):
+                yield chunk
+        finally:
+            f.close()
+    
+    async def read_encrypted(self, encrypted_filename: str) -> AsyncIterator[bytes]:
+        """The stored ciphertext as is, DOWNLOAD_READ_SIZE bytes at a time"""
+        f = await self._io(open, await self._io(self._existing_path, encrypted_filename), 'rb')
+        try:
+            while True:
+                data = await self._io(f.read, DOWNLOAD_READ_SIZE)
+                if not data:
+                    break
+                yield data
+        finally:
+            f.close()
     
-    def delete_file(self, encrypted_filename: str) -> bool:
+    def _unlink(self, encrypted_filename: str) -> bool:
+        deleted = False
+        for path in (self.blob_path(encrypted_filename), self.storage_dir / encrypted_filename):
+            try:
+                path.unlink()
+                deleted = True
+            except FileNotFoundError:
+                pass
+        return deleted
+    
+    async def delete_file(self, encrypted_filename: str) -> bool:
         """
         Delete encrypted file from storage.
         """
-        file_path = self.storage_dir / encrypted_filename
-        
-        if file_path.exists():
-            file_path.unlink()
-            return True
-        return False
+        return await self._io(self._unlink, encrypted_filename)
+    
+    async def delete_files(self, encrypted_filenames: List[str]) -> List[str]:
+        """
+        Delete many encrypted files with concurrent unlinks.
+        Returns the filenames that could not be deleted (missing files count as deleted).
+        """
+        results = await asyncio.gather(
+            *(self._io(self._unlink, name) for name in encrypted_filenames),
+            return_exceptions=True
+        )
+        return [name for name, result in zip(encrypted_filenames, results) if isinstance(result, Exception)]
 
-# Storage service factory
-async def get_storage_service():
-    """
-    Get the appropriate storage service based on configuration.
-    Returns S3StorageService if USE_S3=true, otherwise LocalStorageService.
-    """
+# Local storage singleton (shares one I/O pool), created on first use
+# so that S3 deployments never touch STORAGE_DIR
+storage_service: Optional[LocalStorageService] = None
+
+def get_local_storage_service() -> LocalStorageService:
+    global storage_service
+    if storage_service is None:
+        storage_service = LocalStorageService()
+    return storage_service
+
+async def close_local_storage_service():
+    """Shut down the local storage I/O pool on application shutdown"""
+    global storage_service
+    if storage_service is not None:
+        await storage_service.close()
+        storage_service = None
+
+async def _local_backend() -> StorageBackend:
+    return get_local_storage_service()
+
+async def _s3_backend() -> StorageBackend:
+    from app.services.s3_storage import get_s3_storage_service
+    return await get_s3_storage_service()
+
+async def _tiered_backend() -> StorageBackend:
+    from app.services.tiered_storage import create_tiered_storage_service
+    return await create_tiered_storage_service()
+
+# Backend name -> async factory; modules are imported only for the selected backend
+STORAGE_BACKENDS: Dict[str, Callable[[], Awaitable[StorageBackend]]] = {
+    "local": _local_backend,
+    "s3": _s3_backend,
+    "tiered": _tiered_backend,
+}
+
+def register_backend(name: str, factory: Callable[[], Awaitable[StorageBackend]]):
+    """Make a backend selectable as STORAGE_BACKEND=<name>"""
+    STORAGE_BACKENDS[name] = factory
+
+async def _load_backend(path: str) -> StorageBackend:
+    if path in STORAGE_BACKENDS:
+        return await STORAGE_BACKENDS[path]()
+    module_name, _, class_name = path.partition(":")
+    backend = getattr(importlib.import_module(module_name), class_name)()
+    await backend.start()
+    return backend
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = asyncio.Lock()
+
+async def get_storage_service() -> StorageBackend:
+    """The storage backend selected by STORAGE_BACKEND, created on first use"""
+    global _backend
+    if _backend is None:
+        async with _backend_lock:
+            if _backend is None:
+                _backend = await _load_backend(STORAGE_BACKEND)
+    return _backend
+
+async def close_storage_service():
+    """Close the selected backend and the shared clients it used"""
+    global _backend
+    backend, _backend = _backend, None
+    if backend is not None:
+        await backend.close()
     if USE_S3:
-        from app.services.s3_storage import get_s3_storage_service
-        return await get_s3_storage_service()
-    else:
-        return LocalStorageService()
+        from app.services.s3_storage import close_s3_storage_service
+        await close_s3_storage_service()
+    await close_local_storage_service()
 
-# Singleton instance for local storage (backward compatibility)
-storage_service = LocalStorageService()
+def storage_stats() -> Dict[str, Any]:
+    """Counters of the selected backend, if it has been created"""
+    return {"backend": STORAGE_BACKEND, **(_backend.stats() if _backend is not None else {})}
@@ -0,0 +1,53 @@
+"""
+Interface shared by the blob storage backends.
+
+Blobs are immutable encrypted files identified by their encrypted filename.
+Backends are registered by name in app.services.storage and selected with
+STORAGE_BACKEND ("local", "s3", "tiered", or "package.module:ClassName" for a
+StorageBackend subclass constructed without arguments).
+"""
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import UploadFile
+
+
+class StorageBackend:
+    """Async blob store: put, ranged get, stat and (batch) delete"""
+
+    async def start(self):
+        """Open clients or start background work; called once before first use"""
+
+    async def close(self):
+        """Release what start() acquired"""
+
+    def generate_unique_filename(self, original_filename: str) -> str:
+        raise NotImplementedError
+
+    async def save_encrypted_file(self, file: UploadFile, encrypted_filename: str) -> int:
+        """Encrypt `file` as it streams in and store it; returns the plaintext size"""
+        raise NotImplementedError
+
+    def get_decrypted_file(self, encrypted_filename: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Decrypted plaintext of the inclusive byte range `start`..`end`, chunk by
+        chunk. Raises FileNotFoundError (on the first chunk) for missing blobs.
+        """
+        raise NotImplementedError
+
+    async def read_blob_prefix(self, encrypted_filename: str) -> bytes:
+        """The first HEADER_SIZE bytes of a blob (enough to parse its header)"""
+        raise NotImplementedError
+
+    async def stat(self, encrypted_filename: str) -> int:
+        """Encrypted size of a stored blob; FileNotFoundError if it does not exist"""
+        raise NotImplementedError
+
+    async def delete_file(self, encrypted_filename: str) -> bool:
+        raise NotImplementedError
+
+    async def delete_files(self, encrypted_filenames: List[str]) -> List[str]:
+        """Delete many blobs; returns the filenames that could not be deleted"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """Backend-specific counters for GET /api/health"""
+        return {}
@@ -0,0 +1,372 @@
+"""
+Tiered storage (STORAGE_BACKEND=tiered): local disk in front of S3.
+
+Uploads are encrypted to local disk and acknowledged once the blob is there;
+background workers then copy the ciphertext to S3, so S3 latency is off the
+upload path. The write-back queue is durable: a marker file under
+STORAGE_DIR/.pending is fsynced before a blob is written and removed once it
+is in S3, and markers left by a crash or restart are uploaded on start().
+
+Reads are served from the local copy while it exists and fall back to S3.
+Local copies are deleted TIERED_LOCAL_RETENTION seconds after their upload.
+Until a blob is uploaded only the instance that received it can serve it.
+Local copies found on start that are not in S3 (e.g. from STORAGE_BACKEND=local)
+are queued for upload, so switching an existing deployment to tiered is safe.
+
+A blob can be deleted by another instance (or its reaper) before this one has
+uploaded it; that delete finds nothing in S3. So a marker is only removed once
+a document row is seen referencing the blob. A blob with no row after
+TIERED_ORPHAN_GRACE seconds was deleted elsewhere and is removed from both tiers.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Set
+from fastapi import UploadFile
+from app.core.config import (
+    TIERED_UPLOAD_CONCURRENCY, TIERED_LOCAL_RETENTION, TIERED_SHUTDOWN_DRAIN, TIERED_ORPHAN_GRACE, LOCAL_FSYNC
+)
+from app.services.storage import LocalStorageService, get_local_storage_service
+from app.services.storage_backend import StorageBackend
+
+if TYPE_CHECKING:
+    # Imported on first use only, so aioboto3 is not loaded with this module
+    from app.services.s3_storage import S3StorageService
+
+PENDING_DIR = ".pending"
+
+
+class TieredStorageService(StorageBackend):
+    """Write-back local+S3 backend"""
+
+    def __init__(self, local: LocalStorageService, remote: "S3StorageService"):
+        self.local = local
+        self.remote = remote
+        self.pending_dir = local.storage_dir / PENDING_DIR
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._queued: Set[str] = set()  # Queued or uploading, so a blob is never uploaded twice at once
+        self._tasks: List[asyncio.Task] = []
+        # Local copies already in S3 -> upload time, oldest first
+        self._uploaded: "OrderedDict[str, float]" = OrderedDict()
+        # Uploaded, but no document row seen yet -> when last checked
+        self._unconfirmed: Dict[str, float] = {}
+        # Write-backs that failed outside the S3 retry loop; the sweeper queues them again
+        self._retry: Set[str] = set()
+        self.uploads = 0
+        self.upload_failures = 0
+        self.local_reads = 0
+        self.remote_reads = 0
+        self.evictions = 0
+        self.orphans = 0
+
+    # Durable queue: one marker file per blob awaiting upload
+
+    def _marker(self, encrypted_filename: str) -> Path:
+        return self.pending_dir / encrypted_filename
+
+    def _mark(self, encrypted_filename: str):
+        with open(self._marker(encrypted_filename), "wb") as f:
+            if LOCAL_FSYNC in ("file", "always"):
+                os.fsync(f.fileno())
+        if LOCAL_FSYNC == "always":
+            dir_fd = os.open(self.pending_dir, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def _unmark(self, encrypted_filenames: List[str]) -> List[str]:
+        """Remove markers; returns the filenames that still had one"""
+        removed = []
+        for name in encrypted_filenames:
+            try:
+                self._marker(name).unlink()
+                removed.append(name)
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def _enqueue(self, encrypted_filename: str):
+        if encrypted_filename not in self._queued:
+            self._queued.add(encrypted_filename)
+            self._queue.put_nowait(encrypted_filename)
+
+    def _marker_age(self, encrypted_filename: str) -> Optional[float]:
+        """Seconds since the blob was queued; None once its marker is gone (deleted)"""
+        try:
+            return time.time() - os.stat(self._marker(encrypted_filename)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _pending(self) -> List[str]:
+        self.pending_dir.mkdir(parents=True, exist_ok=True)
+        return sorted(path.name for path in self.pending_dir.iterdir())
+
+    def _local_copies(self) -> List[tuple]:
+        """(mtime, name) of stored local blobs that are not awaiting upload"""
+        pending = set(self._pending())
+        copies = []
+        for root, dirs, files in os.walk(self.local.storage_dir):
+            dirs[:] = [d for d in dirs if d != PENDING_DIR]
+            for name in files:
+                if not name.startswith(".") and name not in pending:
+                    copies.append((os.stat(os.path.join(root, name)).st_mtime, name))
+        return sorted(copies)
+
+    async def start(self):
+        """Re-queue uploads a previous run did not finish and start the workers"""
+        for name in await self.local._io(self._pending):
+            self._enqueue(name)
+        self._tasks = [asyncio.create_task(self._upload_worker()) for _ in range(TIERED_UPLOAD_CONCURRENCY)]
+        self._tasks.append(asyncio.create_task(self._evict_worker()))
+
+    async def close(self):
+        """Let queued uploads finish for up to TIERED_SHUTDOWN_DRAIN seconds; the rest resume on restart"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=TIERED_SHUTDOWN_DRAIN)
+        except asyncio.TimeoutError:
+            print(f"⚠ {self._queue.qsize()} blob(s) not yet in S3; they are uploaded on the next start")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _upload_worker(self):
+        while True:
+            name = await self._queue.get()
+            try:
+                await self._upload(name)
+            except Exception as e:
+                # Local I/O or database errors must not end the worker; the marker stays
+                self.upload_failures += 1
+                self._retry.add(name)
+                print(f"Write-back of {name} failed, retrying later: {str(e)}")
+            finally:
+                self._queued.discard(name)
+                self._queue.task_done()
+
+    @staticmethod
+    async def _referenced(encrypted_filename: str) -> bool:
+        """True if a document (or dedup blob) row points at the blob"""
+        from sqlalchemy import select
+        from app.core.database import SessionLocal
+        from app.models.document import Document
+        from app.models.blob import Blob
+        async with SessionLocal() as db:
+            for column in (Document.encrypted_filename, Blob.encrypted_filename):
+                if await db.scalar(select(column).where(column == encrypted_filename).limit(1)) is not None:
+                    return True
+        return False
+
+    async def _orphaned(self, encrypted_filename: str) -> bool:
+        """
+        True if the blob has been queued for TIERED_ORPHAN_GRACE seconds and no
+        row references it: it was deleted elsewhere before reaching S3.
+        """
+        age = await self.local._io(self._marker_age, encrypted_filename)
+        if age is None or age < TIERED_ORPHAN_GRACE:
+            return False
+        try:
+            return not await self._referenced(encrypted_filename)
+        except Exception as e:
+            print(f"Could not check references of {encrypted_filename}: {str(e)}")
+            return False
+
+    async def _remove_orphan(self, encrypted_filename: str):
+        self.orphans += 1
+        await self.delete_files([encrypted_filename])
+
+    async def _upload(self, encrypted_filename: str):
+        """Copy one local blob to S3, retrying with backoff until it succeeds or the blob is gone"""
+        if await self._orphaned(encrypted_filename):
+            await self._remove_orphan(encrypted_filename)
+            return
+        attempt = 0
+        while True:
+            if not await self.local._io(self._marker(encrypted_filename).exists):
+                return  # Deleted while queued
+            try:
+                await self.remote.upload_encrypted(encrypted_filename, self.local.read_encrypted(encrypted_filename))
+                break
+            except FileNotFoundError:
+                # Never finished writing (crash mid-upload); nothing to copy
+                await self.local._io(self._unmark, [encrypted_filename])
+                return
+            except Exception as e:
+                self.upload_failures += 1
+                attempt += 1
+                print(f"Write-back of {encrypted_filename} to S3 failed (attempt {attempt}): {str(e)}")
+                await asyncio.sleep(min(60, 2 ** attempt))
+
+        self.uploads += 1
+        await self._confirm(encrypted_filename)
+
+    async def _confirm(self, encrypted_filename: str):
+        """
+        Settle an uploaded blob: drop its marker once a row references it, or
+        remove it everywhere if it was deleted meanwhile, here or elsewhere.
+        Unsettled blobs keep their marker and are checked again by the sweeper.
+        """
+        self._unconfirmed.pop(encrypted_filename, None)
+        try:
+            referenced = await self._referenced(encrypted_filename)
+        except Exception as e:
+            print(f"Could not check references of {encrypted_filename}: {str(e)}")
+            referenced = False
+        if not referenced:
+            if await self._orphaned(encrypted_filename):
+                await self._remove_orphan(encrypted_filename)
+            elif await self.local._io(self._marker(encrypted_filename).exists):
+                # The upload's row may not be committed yet
+                self._unconfirmed[encrypted_filename] = time.time()
+            else:
+                # Deleted here while it was being uploaded
+                await self.remote.delete_files([encrypted_filename])
+            return
+        if not await self.local._io(self._unmark, [encrypted_filename]):
+            # Deleted while it was being uploaded
+            await self.remote.delete_files([encrypted_filename])
+            return
+        self._uploaded[encrypted_filename] = time.time()
+        if TIERED_LOCAL_RETENTION <= 0:
+            await self._evict(time.time())
+
+    async def _evict(self, now: float):
+        """Delete local copies uploaded more than TIERED_LOCAL_RETENTION seconds ago"""
+        expired = []
+        while self._uploaded:
+            name, uploaded_at = next(iter(self._uploaded.items()))
+            if now - uploaded_at < TIERED_LOCAL_RETENTION:
+                break
+            self._uploaded.popitem(last=False)
+            expired.append(name)
+        if expired:
+            # Reads that already opened a copy keep reading it; new reads go to S3
+            await self.local.delete_files(expired)
+            self.evictions += len(expired)
+
+    async def _adopt_local_copies(self):
+        """
+        Track local copies left from before a restart (aged from their mtime).
+        Ones missing from S3, e.g. written by the local backend, are queued for upload.
+        """
+        adopted = {}
+        for mtime, name in await self.local._io(self._local_copies):
+            try:
+                await self.remote.stat(name)
+            except FileNotFoundError:
+                await self.local._io(self._mark, name)
+                self._enqueue(name)
+                continue
+            adopted[name] = mtime
+        adopted.update(self._uploaded)
+        self._uploaded = OrderedDict(sorted(adopted.items(), key=lambda item: item[1]))
+
+    async def _evict_worker(self):
+        try:
+            await self._adopt_local_copies()
+        except Exception as e:
+            print(f"Tiered storage could not scan local copies: {str(e)}")
+        while True:
+            try:
+                for name in list(self._retry):
+                    self._retry.discard(name)
+                    self._enqueue(name)
+                for name in list(self._unconfirmed):
+                    await self._confirm(name)
+                await self._evict(time.time())
+            except Exception as e:
+                print(f"Tiered storage eviction failed: {str(e)}")
+            await asyncio.sleep(max(1.0, min(TIERED_LOCAL_RETENTION / 10, 60.0)))
+
+    # StorageBackend
+
+    def generate_unique_filename(self, original_filename: str) -> str:
+        return self.local.generate_unique_filename(original_filename)
+
+    async def save_encrypted_file(self, file: UploadFile, encrypted_filename: str) -> int:
+        """Encrypt to local disk and queue the S3 upload; returns once the blob is durable locally"""
+        # Marker first: a blob on disk is never left without its queued upload
+        await self.local._io(self._mark, encrypted_filename)
+        try:
+            file_size = await self.local.save_encrypted_file(file, encrypted_filename)
+        except BaseException:
+            await asyncio.shield(self.local._io(self._unmark, [encrypted_filename]))
+            raise
+        self._enqueue(encrypted_filename)
+        return file_size
+
+    async def get_decrypted_file(
+        self,
+        encrypted_filename: str,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """Decrypt from the local copy if there is one, else from S3"""
+        chunks = self.local.get_decrypted_file(encrypted_filename, start, end)
+        try:
+            first_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            return
+        except FileNotFoundError:
+            self.remote_reads += 1
+            async for chunk in self.remote.get_decrypted_file(encrypted_filename, start, end):
+                yield chunk
+            return
+        self.local_reads += 1
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+
+    async def read_blob_prefix(self, encrypted_filename: str) -> bytes:
+        try:
+            return await self.local.read_blob_prefix(encrypted_filename)
+        except FileNotFoundError:
+            return await self.remote.read_blob_prefix(encrypted_filename)
+
+    async def stat(self, encrypted_filename: str) -> int:
+        try:
+            return await self.local.stat(encrypted_filename)
+        except FileNotFoundError:
+            return await self.remote.stat(encrypted_filename)
+
+    async def delete_file(self, encrypted_filename: str) -> bool:
+        return not await self.delete_files([encrypted_filename])
+
+    async def delete_files(self, encrypted_filenames: List[str]) -> List[str]:
+        """
+        Delete local copies and S3 objects. Pending uploads are cancelled by
+        removing their markers; one already in progress deletes its object when done.
+        """
+        await self.local._io(self._unmark, encrypted_filenames)
+        for name in encrypted_filenames:
+            self._uploaded.pop(name, None)
+            self._unconfirmed.pop(name, None)
+            self._retry.discard(name)
+        failed = set(await self.local.delete_files(encrypted_filenames))
+        failed.update(await self.remote.delete_files(encrypted_filenames))
+        return [name for name in encrypted_filenames if name in failed]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_uploads": self._queue.qsize(),
+            "uploads": self.uploads,
+            "upload_failures": self.upload_failures,
+            "local_reads": self.local_reads,
+            "remote_reads": self.remote_reads,
+            "local_copies": len(self._uploaded),
+            "evictions": self.evictions,
+            "unconfirmed": len(self._unconfirmed),
+            "orphans_removed": self.orphans
+        }
+
+
+async def create_tiered_storage_service() -> TieredStorageService:
+    from app.services.s3_storage import get_s3_storage_service
+    service = TieredStorageService(get_local_storage_service(), await get_s3_storage_service())
+    await service.start()
+    return service
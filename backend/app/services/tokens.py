@@ -0,0 +1,70 @@
+import hashlib
+import hmac
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from jose import jwt, JWTError
+from app.core.config import DOWNLOAD_TOKEN_SECRET, DOWNLOAD_TOKEN_TTL, ENCRYPTION_KEY
+
+TOKEN_ALGORITHM = "HS256"
+TOKEN_SCOPE = "download"
+
+
+class DownloadTokenService:
+    """
+    Short-lived, document-scoped signed tokens issued by /access after the
+    passcode check, so /download can authorize requests without bcrypt.
+    """
+
+    def __init__(self, secret: bytes, ttl: int):
+        self.secret = secret
+        self.ttl = ttl
+        # doc_id -> unix time until which all tokens for that document are rejected
+        self._revoked: Dict[str, float] = {}
+
+    def issue(self, doc_id: str, doc_expires_at: datetime) -> Tuple[str, int]:
+        """Return a token for `doc_id` and its expiry (unix time), capped at the document expiry"""
+        now = int(time.time())
+        expires = min(now + self.ttl, int((doc_expires_at - datetime.utcnow()).total_seconds()) + now)
+        claims = {
+            "sub": doc_id,
+            "scope": TOKEN_SCOPE,
+            "iat": now,
+            "exp": expires,
+            "jti": uuid.uuid4().hex,
+        }
+        return jwt.encode(claims, self.secret, algorithm=TOKEN_ALGORITHM), expires
+
+    def verify(self, token: str, doc_id: str) -> bool:
+        """True if `token` is a valid, unexpired, unrevoked token for `doc_id`"""
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=[TOKEN_ALGORITHM])
+        except JWTError:
+            return False
+        if claims.get("sub") != doc_id or claims.get("scope") != TOKEN_SCOPE:
+            return False
+        revoked_until = self._revoked.get(doc_id)
+        return revoked_until is None or revoked_until < time.time()
+
+    def revoke(self, doc_id: str):
+        """Reject every outstanding token for `doc_id` (e.g. after deletion)"""
+        now = time.time()
+        self._revoked[doc_id] = now + self.ttl
+        # Tokens outlive entries by at most the TTL, so expired entries can go
+        for key in [key for key, until in self._revoked.items() if until < now]:
+            del self._revoked[key]
+
+
+def _token_secret(configured: Optional[str]) -> bytes:
+    if configured:
+        return configured.encode()
+    # Same on every instance that shares ENCRYPTION_KEY, without reusing it directly
+    return hmac.new(ENCRYPTION_KEY, b"download-token-secret", hashlib.sha256).digest()
+
+
+# Shared by every token the API signs (download tokens, direct upload tickets)
+TOKEN_SECRET = _token_secret(DOWNLOAD_TOKEN_SECRET)
+
+# Singleton instance
+download_tokens = DownloadTokenService(TOKEN_SECRET, DOWNLOAD_TOKEN_TTL)
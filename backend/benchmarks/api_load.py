@@ -0,0 +1,201 @@
+"""
+End-to-end load test of /api/upload, /api/access and /api/download.
+
+For each storage backend (local disk, and S3 via an in-process moto server)
+the app runs in a fresh interpreter, because storage and database settings are
+read at import time. Requests go through the ASGI app in-process, so the
+numbers describe one worker with no network in between. At each concurrency
+level the worker:
+
+1. uploads --requests files of --file-size bytes
+2. calls /access for each of them (bcrypt check, issues a download token)
+3. downloads each of them with its token and checks the size
+
+and reports throughput, latency percentiles and errors per endpoint, plus peak
+RSS during the upload phase and the RSS growth per concurrent upload.
+`saturation_concurrency` is the level after which throughput grows by less
+than 10%, where a single worker stops scaling. Prints a JSON report.
+
+    python -m benchmarks.api_load --concurrency 1 4 16 64 --requests 64 --file-size 1048576
+    python -m benchmarks.api_load --backend local --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import BACKEND_DIR, RssSampler, latency_summary, run_metadata, saturation_point
+
+MB = 1024 * 1024
+
+
+async def run_batch(items, concurrency, operation):
+    """Run `operation(item)` for every item, `concurrency` at a time; returns (results, latencies, elapsed)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def bounded(item):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await operation(item)
+            if result is not None:
+                latencies.append(time.perf_counter() - started)
+            return result
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(bounded(item) for item in items))
+    return results, latencies, time.perf_counter() - started
+
+
+def phase_report(latencies, elapsed, requests, bytes_moved):
+    report = latency_summary(latencies, elapsed)
+    report["errors"] = requests - len(latencies)
+    report["mb_per_sec"] = round(bytes_moved / MB / elapsed, 1) if bytes_moved else None
+    return report
+
+
+async def worker(concurrency_levels, requests, file_size):
+    """Runs inside the child interpreter configured by the environment"""
+    import httpx
+    from app.core.database import engine
+    from app.core.migrations import upgrade
+    from app.main import app, shutdown
+
+    await upgrade()
+    payload = os.urandom(file_size)
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    levels = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        async def upload(_):
+            response = await client.post(
+                "/api/upload",
+                files={"file": ("bench.bin", payload, "application/octet-stream")},
+                data={"passcode": "bench"}
+            )
+            return response.json()["doc_id"] if response.status_code == 200 else None
+
+        async def access(doc_id):
+            response = await client.post(f"/api/access/{doc_id}", json={"passcode": "bench"})
+            return (doc_id, response.json()["token"]) if response.status_code == 200 else None
+
+        async def download(grant):
+            doc_id, token = grant
+            response = await client.get(f"/api/download/{doc_id}", params={"token": token})
+            return True if response.status_code == 200 and len(response.content) == file_size else None
+
+        async def delete(doc_id):
+            await client.delete(f"/api/documents/{doc_id}", params={"passcode": "bench"})
+
+        for concurrency in concurrency_levels:
+            with RssSampler() as rss:
+                doc_ids, upload_latencies, upload_elapsed = await run_batch(range(requests), concurrency, upload)
+            doc_ids = [doc_id for doc_id in doc_ids if doc_id]
+            grants, access_latencies, access_elapsed = await run_batch(doc_ids, concurrency, access)
+            grants = [grant for grant in grants if grant]
+            _, download_latencies, download_elapsed = await run_batch(grants, concurrency, download)
+
+            levels.append({
+                "concurrency": concurrency,
+                "upload": phase_report(upload_latencies, upload_elapsed, requests, len(upload_latencies) * file_size),
+                "access": phase_report(access_latencies, access_elapsed, len(doc_ids), 0),
+                "download": phase_report(download_latencies, download_elapsed, len(grants), len(download_latencies) * file_size),
+                "peak_rss_mb": round(rss.peak / MB, 1),
+                "rss_per_upload_mb": round((rss.peak - rss.baseline) / MB / concurrency, 2),
+            })
+            # Deleting goes through the API too, so storage is cleaned on both backends
+            await run_batch(doc_ids, concurrency, delete)
+
+    # Closes the S3 client / storage I/O pool and the CPU executor
+    await shutdown()
+    await engine.dispose()
+    return levels
+
+
+def run_backend(env, args):
+    """Run the worker for one backend in a child interpreter and parse its JSON result"""
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.api_load", "--worker",
+         json.dumps([args.concurrency, args.requests, args.file_size])],
+        cwd=BACKEND_DIR, env={**os.environ, "REAPER_ENABLED": "false", **env},
+        capture_output=True, text=True
+    )
+    if output.returncode != 0:
+        return {"error": output.stderr.strip().splitlines()[-1] if output.stderr.strip() else "failed"}
+    levels = json.loads(output.stdout.strip().splitlines()[-1])
+    return {
+        "levels": levels,
+        "saturation_concurrency": {
+            phase: saturation_point([{"concurrency": level["concurrency"], **level[phase]} for level in levels])
+            for phase in ("upload", "access", "download")
+        }
+    }
+
+
+def start_moto(port):
+    import boto3
+    from moto.server import ThreadedMotoServer
+    server = ThreadedMotoServer(port=port, verbose=False)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port}"
+    boto3.client(
+        "s3", endpoint_url=endpoint, region_name="us-east-1",
+        aws_access_key_id="bench", aws_secret_access_key="bench"
+    ).create_bucket(Bucket="bench-api-load")
+    return server, {
+        "USE_S3": "true",
+        "S3_BUCKET_NAME": "bench-api-load",
+        "S3_REGION": "us-east-1",
+        "S3_ENDPOINT_URL": endpoint,
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+    }
+
+
+def main(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        if "local" in args.backend:
+            results["local"] = run_backend({
+                "DATABASE_URL": f"sqlite+aiosqlite:///{tmp}/local.db",
+                "STORAGE_DIR": f"{tmp}/storage",
+                "USE_S3": "false",
+            }, args)
+        if "s3" in args.backend:
+            server, s3_env = start_moto(args.moto_port)
+            try:
+                results["s3_moto"] = run_backend({"DATABASE_URL": f"sqlite+aiosqlite:///{tmp}/s3.db", **s3_env}, args)
+            finally:
+                server.stop()
+
+    report = json.dumps({
+        "benchmark": "api_load",
+        "metadata": run_metadata(),
+        "requests_per_level": args.requests,
+        "file_size": args.file_size,
+        "results": results
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", nargs="+", choices=["local", "s3"], default=["local", "s3"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=64, help="Uploads (and accesses/downloads) per concurrency level")
+    parser.add_argument("--file-size", type=int, default=MB)
+    parser.add_argument("--moto-port", type=int, default=5078)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(asyncio.run(worker(*json.loads(args.worker)))))
+    else:
+        main(args)
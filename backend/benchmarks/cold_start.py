@@ -0,0 +1,111 @@
+"""
+Cold-start cost of the application, measured in fresh interpreters.
+
+Each run imports `app.main`, runs the startup hooks and encrypts a first blob,
+timing the three steps. Scenarios:
+
+- passphrase_pbkdf2: key 0 is derived from ENCRYPTION_KEY with PBKDF2 on first use
+- pre_derived_key: key 0 comes pre-derived from ENCRYPTION_KEYS
+- fast_startup: pre-derived key plus FAST_STARTUP=true (no migrations, bucket
+  validation or passcode calibration in the startup hook)
+
+Prints a JSON report. With --max-fast-startup-ms the run fails when the
+fast_startup total exceeds the budget, so CI can guard against regressions.
+
+    python -m benchmarks.cold_start --runs 5
+    python -m benchmarks.cold_start --runs 3 --max-fast-startup-ms 1500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+modules = len(sys.modules)
+
+async def lifecycle():
+    begin = time.perf_counter()
+    await app.main.app.router.startup()
+    ready = time.perf_counter()
+    from app.services.encryption import encryption_service
+    encryption_service.encrypt(b"warm-up")
+    encrypted = time.perf_counter()
+    await app.main.app.router.shutdown()
+    return ready - begin, encrypted - ready
+
+startup, first_encrypt = asyncio.run(lifecycle())
+print(json.dumps({
+    "import": imported - started,
+    "startup": startup,
+    "first_encrypt": first_encrypt,
+    "modules": modules,
+    "botocore_imported": "botocore" in sys.modules,
+}))
+"""
+
+
+def measure(env, runs):
+    samples = []
+    for _ in range(runs):
+        stdout = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        # The app prints status lines (migrations, calibration) before the probe's report
+        samples.append(json.loads(stdout.strip().splitlines()[-1]))
+
+    def median_ms(*steps):
+        return round(statistics.median(sum(sample[step] for step in steps) for sample in samples) * 1000, 1)
+
+    return {
+        "import_app_main_ms": median_ms("import"),
+        "startup_hooks_ms": median_ms("startup"),
+        "first_encrypt_ms": median_ms("first_encrypt"),
+        "total_ms": median_ms("import", "startup", "first_encrypt"),
+        "modules_loaded": samples[-1]["modules"],
+        "botocore_imported": samples[-1]["botocore_imported"],
+    }
+
+
+def main(args):
+    base_env = {key: value for key, value in os.environ.items() if key not in ("ENCRYPTION_KEYS", "FAST_STARTUP")}
+    base_env.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+    # Background tasks would only add noise to the measured startup
+    base_env.setdefault("REAPER_ENABLED", "false")
+
+    derived = subprocess.run(
+        [sys.executable, "-m", "app.services.keyring", "derive"], cwd=BACKEND_DIR, env=base_env,
+        capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+    results = {
+        "passphrase_pbkdf2": measure(base_env, args.runs),
+        "pre_derived_key": measure({**base_env, "ENCRYPTION_KEYS": derived}, args.runs),
+        "fast_startup": measure({**base_env, "ENCRYPTION_KEYS": derived, "FAST_STARTUP": "true"}, args.runs),
+    }
+    report = {"benchmark": "cold_start", "runs": args.runs, "results": results}
+    if args.max_fast_startup_ms is not None:
+        report["budget_ms"] = args.max_fast_startup_ms
+        report["within_budget"] = results["fast_startup"]["total_ms"] <= args.max_fast_startup_ms
+    print(json.dumps(report, indent=2))
+    if not report.get("within_budget", True):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--max-fast-startup-ms", type=float, default=None,
+        help="Exit with status 1 if the fast_startup total (import + startup + first encrypt) exceeds this"
+    )
+    main(parser.parse_args())
@@ -0,0 +1,99 @@
+"""Helpers shared by the benchmarks: latency summaries, RSS sampling and run metadata."""
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def latency_summary(latencies, elapsed):
+    """Throughput and latency percentiles (ms) of one batch of operations"""
+    if not latencies:
+        return {"requests": 0}
+    return {
+        "requests": len(latencies),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (Linux /proc, else peak RSS from getrusage)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    """Samples RSS on a background thread; `peak` is the highest value seen while running"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        return False
+
+
+def saturation_point(levels, key="requests_per_sec", min_gain=0.1):
+    """
+    First concurrency level after which throughput grows by less than `min_gain`
+    (10% by default), i.e. where a single worker stops scaling. `levels` is a
+    list of {"concurrency": n, key: value} in increasing concurrency.
+    """
+    for previous, current in zip(levels, levels[1:]):
+        if previous.get(key) and current.get(key, 0) < previous[key] * (1 + min_gain):
+            return previous["concurrency"]
+    return levels[-1]["concurrency"] if levels else None
+
+
+def run_metadata() -> dict:
+    """Where and on what a report was produced, for comparing runs across releases"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
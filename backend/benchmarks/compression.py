@@ -0,0 +1,129 @@
+"""
+Size and throughput tradeoff of compressing before encryption.
+
+Runs every corpus file through the blob pipeline (compress + AES-GCM segments
+and back) for each codec and level. Reports the stored size ratio,
+upload-side and download-side throughput, and how long the stored blob takes
+to transfer over a slow link. The built-in corpus is synthetic CSV, JSON, logs,
+XML, an uncompressed raster (TIFF-like) and random bytes standing in for
+JPEG/ZIP/MP4. Pass --corpus DIR to use real files instead. Prints a JSON report.
+
+    python -m benchmarks.compression --size-mb 8 --link-mbps 10
+"""
+import argparse
+import json
+import mimetypes
+import random
+import time
+from pathlib import Path
+from app.services.compression import CODECS, compression_policy, zstandard
+from app.services.encryption import encryption_service
+
+
+def synthetic_corpus(size: int) -> dict:
+    rng = random.Random(42)
+    words = ["alpha", "beta", "gamma", "delta", "report", "invoice", "total", "pending", "shipped", "error"]
+
+    def repeat(make_line) -> bytes:
+        out = bytearray()
+        i = 0
+        while len(out) < size:
+            out += make_line(i).encode()
+            i += 1
+        return bytes(out[:size])
+
+    raster = bytearray()
+    width = 1024
+    while len(raster) < size:
+        row = len(raster) // (width * 3)
+        raster += bytes(
+            (x + row + rng.randint(0, 3)) % 256 for x in range(width) for _ in range(3)
+        )
+    return {
+        "data.csv": ("text/csv", repeat(
+            lambda i: f"{i},{rng.choice(words)},{rng.randint(1, 10**6)},{rng.random():.6f},2026-01-{i % 28 + 1:02d}\n"
+        )),
+        "records.json": ("application/json", repeat(
+            lambda i: json.dumps({"id": i, "status": rng.choice(words), "amount": rng.randint(1, 10**5),
+                                  "tags": rng.sample(words, 3)}) + ",\n"
+        )),
+        "app.log": ("text/plain", repeat(
+            lambda i: f"2026-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}Z INFO worker-{i % 8} "
+                      f"processed {rng.choice(words)} request id={rng.getrandbits(32):08x} in {rng.randint(1, 900)}ms\n"
+        )),
+        "document.xml": ("application/xml", repeat(
+            lambda i: f"<row id=\"{i}\"><name>{rng.choice(words)}</name><value>{rng.randint(0, 9999)}</value></row>\n"
+        )),
+        "scan.tiff": ("image/tiff", bytes(raster[:size])),
+        "photo.jpg": ("image/jpeg", rng.randbytes(size)),
+    }
+
+
+def directory_corpus(path: str) -> dict:
+    corpus = {}
+    for file_path in sorted(Path(path).iterdir()):
+        if file_path.is_file():
+            mime_type = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+            corpus[file_path.name] = (mime_type, file_path.read_bytes())
+    return corpus
+
+
+def run_pipeline(data: bytes, codec: int, level, read_size: int):
+    started = time.perf_counter()
+    encryptor = encryption_service.encryptor(codec, level)
+    pieces = [encryptor.header.pack()]
+    for offset in range(0, len(data), read_size):
+        pieces.append(encryptor.update(data[offset:offset + read_size]))
+    pieces.append(encryptor.finalize())
+    blob = b"".join(pieces)
+    encrypt_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    assert encryption_service.decrypt(blob) == data
+    decrypt_seconds = time.perf_counter() - started
+    return len(blob), encrypt_seconds, decrypt_seconds
+
+
+def main(args):
+    corpus = directory_corpus(args.corpus) if args.corpus else synthetic_corpus(int(args.size_mb * 1024 * 1024))
+    variants = [("none", None)] + [("zlib", level) for level in (1, 6)]
+    if zstandard is not None:
+        variants += [("zstd", level) for level in (1, 3, 9)]
+
+    results = {}
+    for name, (mime_type, data) in corpus.items():
+        rows = []
+        for codec_name, level in variants:
+            stored, encrypt_seconds, decrypt_seconds = run_pipeline(data, CODECS[codec_name], level, args.read_size)
+            mb = len(data) / (1024 * 1024)
+            rows.append({
+                "codec": codec_name,
+                "level": level,
+                "stored_bytes": stored,
+                "ratio": round(len(data) / stored, 2),
+                "upload_mb_per_sec": round(mb / encrypt_seconds, 1),
+                "download_mb_per_sec": round(mb / decrypt_seconds, 1),
+                "transfer_seconds": round(stored * 8 / (args.link_mbps * 1_000_000), 2)
+            })
+        results[name] = {
+            "mime_type": mime_type,
+            "size": len(data),
+            "skipped_by_policy": compression_policy.skips(mime_type),
+            "variants": rows
+        }
+
+    print(json.dumps({
+        "benchmark": "compression",
+        "chunk_size": encryption_service.chunk_size,
+        "link_mbps": args.link_mbps,
+        "results": results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Directory of real files to use instead of the synthetic corpus")
+    parser.add_argument("--size-mb", type=float, default=8, help="Size of each synthetic corpus file")
+    parser.add_argument("--read-size", type=int, default=1024 * 1024, help="Plaintext bytes per encryptor update")
+    parser.add_argument("--link-mbps", type=float, default=10, help="Link speed for transfer_seconds")
+    main(parser.parse_args())
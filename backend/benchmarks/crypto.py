@@ -0,0 +1,115 @@
+"""
+Micro-benchmarks of the CPU-bound primitives behind every request.
+
+- encryption: EncryptionService.encrypt / decrypt (segmented AES-256-GCM) per
+  file size, as MB/s and ms per call
+- bcrypt: hashpw (upload) and checkpw (access, passcode downloads) per cost
+  factor, as ms per call and the calls/sec one core sustains
+- passcode calibration: the cost app.services.passcodes picks on this machine
+  for --target-ms per algorithm (bcrypt, scrypt, and argon2 when installed),
+  with the measured verification time at that cost
+
+Runs in-process with no network access. Prints a JSON report.
+
+    python -m benchmarks.crypto --sizes 65536 1048576 16777216 --rounds 10 12 14
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import bcrypt
+
+from app.services.encryption import encryption_service
+from app.services import passcodes
+from benchmarks.common import run_metadata
+
+
+def timed(fn, repeat):
+    """Durations in seconds of `repeat` calls of `fn()`, after one warm-up call"""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_encryption(sizes, repeat):
+    rows = []
+    for size in sizes:
+        data = os.urandom(size)
+        blob = encryption_service.encrypt(data)
+        encrypt = timed(lambda: encryption_service.encrypt(data), repeat)
+        decrypt = timed(lambda: encryption_service.decrypt(blob), repeat)
+        mb = size / (1024 * 1024)
+        rows.append({
+            "size": size,
+            "stored_bytes": len(blob),
+            "encrypt_ms": round(statistics.mean(encrypt) * 1000, 3),
+            "encrypt_mb_per_sec": round(mb / statistics.mean(encrypt), 1),
+            "decrypt_ms": round(statistics.mean(decrypt) * 1000, 3),
+            "decrypt_mb_per_sec": round(mb / statistics.mean(decrypt), 1),
+        })
+    return rows
+
+
+def bench_bcrypt(rounds_list, repeat):
+    rows = []
+    for rounds in rounds_list:
+        passcode = b"benchmark-passcode"
+        hashed = bcrypt.hashpw(passcode, bcrypt.gensalt(rounds))
+        hash_seconds = statistics.mean(timed(lambda: bcrypt.hashpw(passcode, bcrypt.gensalt(rounds)), repeat))
+        check_seconds = statistics.mean(timed(lambda: bcrypt.checkpw(passcode, hashed), repeat))
+        rows.append({
+            "rounds": rounds,
+            "hash_ms": round(hash_seconds * 1000, 2),
+            "check_ms": round(check_seconds * 1000, 2),
+            "checks_per_sec_per_core": round(1 / check_seconds, 1),
+        })
+    return rows
+
+
+def bench_calibration(target_ms, memory_kb):
+    rows = []
+    for algorithm in passcodes.ALGORITHMS:
+        if algorithm == "argon2" and passcodes.argon2 is None:
+            continue
+        cost = passcodes.calibrate_cost(algorithm, target_ms / 1000, memory_kb)
+        hashed = passcodes.hash_with(algorithm, "benchmark-passcode", cost, memory_kb)
+        verify_seconds = statistics.mean(timed(lambda: passcodes.verify_hash("benchmark-passcode", hashed), 2))
+        rows.append({
+            "algorithm": algorithm,
+            "cost": cost,
+            "verify_ms": round(verify_seconds * 1000, 2),
+            "hash_length": len(hashed),
+        })
+    return rows
+
+
+def main(args):
+    print(json.dumps({
+        "benchmark": "crypto",
+        "metadata": run_metadata(),
+        "chunk_size": encryption_service.chunk_size,
+        "encryption": bench_encryption(args.sizes, args.repeat),
+        "bcrypt": bench_bcrypt(args.rounds, args.bcrypt_repeat),
+        "passcode_calibration": {
+            "target_ms": args.target_ms,
+            "algorithms": bench_calibration(args.target_ms, passcodes.PASSCODE_MEMORY_KB),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64 * 1024, 1024 * 1024, 16 * 1024 * 1024],
+                        help="Plaintext sizes in bytes")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls per size")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13], help="bcrypt cost factors")
+    parser.add_argument("--bcrypt-repeat", type=int, default=3, help="Timed calls per cost factor")
+    parser.add_argument("--target-ms", type=float, default=passcodes.PASSCODE_VERIFY_TARGET_MS,
+                        help="Verification time the passcode cost is calibrated to")
+    main(parser.parse_args())
@@ -0,0 +1,128 @@
+"""
+Per-request S3 latency: a fresh client per operation vs the shared pooled client.
+
+Runs against S3_ENDPOINT_URL (e.g. a local MinIO) when set, otherwise starts an
+in-process moto server. Prints a JSON report.
+
+    python -m benchmarks.s3_client_latency --requests 200 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+
+import aioboto3
+from aiobotocore.config import AioConfig
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def run(client_factory, bucket, requests, concurrency, payload):
+    """Issue `requests` PUT+GET pairs, `concurrency` at a time"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            key = f"bench/{uuid.uuid4()}"
+            started = time.perf_counter()
+            async with client_factory() as s3:
+                await s3.put_object(Bucket=bucket, Key=key, Body=payload)
+                response = await s3.get_object(Bucket=bucket, Key=key)
+                await response["Body"].read()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+class _Borrowed:
+    """Async context manager that hands out an already-open client"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def __aenter__(self):
+        return self.client
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+async def main(args):
+    endpoint = os.getenv("S3_ENDPOINT_URL")
+    server = None
+    if not endpoint:
+        from moto.server import ThreadedMotoServer
+        server = ThreadedMotoServer(port=args.moto_port, verbose=False)
+        server.start()
+        endpoint = f"http://127.0.0.1:{args.moto_port}"
+
+    client_kwargs = {
+        "service_name": "s3",
+        "region_name": os.getenv("S3_REGION", "us-east-1"),
+        "endpoint_url": endpoint,
+        "aws_access_key_id": os.getenv("AWS_ACCESS_KEY_ID", "bench"),
+        "aws_secret_access_key": os.getenv("AWS_SECRET_ACCESS_KEY", "bench"),
+    }
+    bucket = os.getenv("S3_BUCKET_NAME", "bench-latency")
+    session = aioboto3.Session()
+    payload = os.urandom(args.payload_bytes)
+
+    try:
+        async with session.client(**client_kwargs) as admin:
+            if server is not None:
+                await admin.create_bucket(Bucket=bucket)
+
+        results = {}
+        # Before: a new client (and connection) per request
+        results["per_request_client"] = await run(
+            lambda: session.client(**client_kwargs),
+            bucket, args.requests, args.concurrency, payload
+        )
+        # After: one long-lived client with a connection pool
+        pooled_config = AioConfig(max_pool_connections=args.pool, tcp_keepalive=True)
+        async with session.client(config=pooled_config, **client_kwargs) as shared:
+            results["pooled_client"] = await run(
+                lambda: _Borrowed(shared),
+                bucket, args.requests, args.concurrency, payload
+            )
+    finally:
+        if server is not None:
+            server.stop()
+
+    print(json.dumps({
+        "benchmark": "s3_client_latency",
+        "endpoint": "moto" if server is not None else endpoint,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "payload_bytes": args.payload_bytes,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--payload-bytes", type=int, default=4096)
+    parser.add_argument("--pool", type=int, default=50, help="max_pool_connections for the pooled client")
+    parser.add_argument("--moto-port", type=int, default=5077)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,112 @@
+"""
+Throughput of the streamed share ZIP, with a round-trip check of the archive.
+
+Builds the archive that GET /api/shares/{share_id}/download streams from
+synthetic documents served in DOWNLOAD_READ_SIZE chunks, so only the ZIP
+framing is measured (no decryption or storage I/O). The result is then read
+back with zipfile: every entry must pass its CRC check, match its document
+byte for byte, be deflated at level 0 and carry a data descriptor. Exits with
+status 1 if the round trip fails. Prints a JSON report.
+
+    python -m benchmarks.share_zip --files 20 --file-size 4194304
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import sys
+import time
+import zipfile
+from types import SimpleNamespace
+from app.core.config import DOWNLOAD_READ_SIZE
+from app.routers.shares import archive_names, zip_stream
+
+MB = 1024 * 1024
+DATA_DESCRIPTOR_FLAG = 0x08
+
+
+class MemoryStorage:
+    """Serves document contents the way a storage backend streams them"""
+
+    def __init__(self, contents):
+        self.contents = contents
+
+    async def get_decrypted_file(self, encrypted_filename, start=0, end=None):
+        data = self.contents[encrypted_filename]
+        for offset in range(0, len(data), DOWNLOAD_READ_SIZE):
+            yield data[offset:offset + DOWNLOAD_READ_SIZE]
+
+
+def documents(count, size):
+    rng = random.Random(42)
+    docs, contents = [], {}
+    for i in range(count):
+        # Alternate compressible and random content; repeat one name to exercise de-duplication
+        data = (f"row {i}," * size).encode()[:size] if i % 2 else rng.randbytes(size)
+        name = "report.csv" if i % 3 == 0 else f"file-{i}.bin"
+        docs.append(SimpleNamespace(original_filename=name, encrypted_filename=f"blob-{i}", file_size=size))
+        contents[f"blob-{i}"] = data
+    return docs, contents
+
+
+def check_archive(archive_bytes, docs, contents):
+    """Problems found reading the archive back; empty if it round-trips"""
+    problems = []
+    with zipfile.ZipFile(io.BytesIO(archive_bytes)) as archive:
+        bad = archive.testzip()
+        if bad is not None:
+            problems.append(f"CRC mismatch in {bad}")
+        infos = archive.infolist()
+        if [info.filename for info in infos] != archive_names(docs):
+            problems.append("entry names differ from the documents")
+        for info, doc in zip(infos, docs):
+            if info.compress_type != zipfile.ZIP_DEFLATED:
+                problems.append(f"{info.filename}: compression method {info.compress_type}, expected deflate")
+            if info.compress_size < info.file_size:
+                problems.append(f"{info.filename}: compressed, expected deflate level 0 (stored blocks)")
+            if not info.flag_bits & DATA_DESCRIPTOR_FLAG:
+                problems.append(f"{info.filename}: no data descriptor")
+            if archive.read(info) != contents[doc.encrypted_filename]:
+                problems.append(f"{info.filename}: content differs")
+    return problems
+
+
+async def build(docs, contents):
+    parts = []
+    async for chunk in zip_stream(MemoryStorage(contents), docs):
+        if chunk:
+            parts.append(chunk)
+    return b"".join(parts)
+
+
+def main(args):
+    docs, contents = documents(args.files, args.file_size)
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        archive_bytes = asyncio.run(build(docs, contents))
+        timings.append(time.perf_counter() - started)
+    problems = check_archive(archive_bytes, docs, contents)
+
+    total = args.files * args.file_size
+    print(json.dumps({
+        "benchmark": "share_zip",
+        "files": args.files,
+        "file_size": args.file_size,
+        "archive_bytes": len(archive_bytes),
+        "overhead_bytes": len(archive_bytes) - total,
+        "mb_per_sec": round(total / MB / min(timings), 1),
+        "round_trip_ok": not problems,
+        "problems": problems
+    }, indent=2))
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--file-size", type=int, default=4 * MB)
+    parser.add_argument("--repeat", type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+"""
+Run the benchmark suite and collect every report into one JSON document.
+
+Each benchmark runs as its own `python -m benchmarks.<name>` process with the
+arguments below (or smaller ones with --quick), entirely offline: S3 is an
+in-process moto server. Keep the output files of each release to compare
+throughput and latency across versions.
+
+    python -m benchmarks.suite --output bench-$(git rev-parse --short HEAD).json
+    python -m benchmarks.suite --quick --only crypto api_load
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from benchmarks.common import BACKEND_DIR, run_metadata
+
+# name -> (full arguments, --quick arguments)
+BENCHMARKS = {
+    "crypto": (
+        [],
+        ["--sizes", "65536", "1048576", "--repeat", "3", "--rounds", "10", "12", "--bcrypt-repeat", "1"],
+    ),
+    "api_load": (
+        [],
+        ["--concurrency", "1", "4", "--requests", "8", "--file-size", "262144"],
+    ),
+    "compression": (
+        [],
+        ["--size-mb", "1"],
+    ),
+    "s3_client_latency": (
+        [],
+        ["--requests", "50"],
+    ),
+    "db_concurrency": (
+        [],
+        ["--concurrency", "1", "8", "--requests", "40"],
+    ),
+    "cold_start": (
+        [],
+        ["--runs", "2"],
+    ),
+    "share_zip": (
+        [],
+        ["--files", "6", "--file-size", "262144", "--repeat", "1"],
+    ),
+}
+
+
+def run_benchmark(name, arguments):
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-m", f"benchmarks.{name}", *arguments],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    elapsed = round(time.perf_counter() - started, 1)
+    if output.returncode != 0:
+        lines = output.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else "failed", "seconds": elapsed}
+    # The report is the JSON document at the end of stdout; the app may print status lines before it
+    stdout = output.stdout
+    start = 0 if stdout.startswith("{") else stdout.index("\n{") + 1
+    report = json.loads(stdout[start:])
+    report.pop("metadata", None)
+    report["seconds"] = elapsed
+    return report
+
+
+def main(args):
+    names = args.only or list(BENCHMARKS)
+    results = {}
+    for name in names:
+        full, quick = BENCHMARKS[name]
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = run_benchmark(name, quick if args.quick else full)
+
+    report = json.dumps({
+        "suite": "quick" if args.quick else "full",
+        "metadata": run_metadata(),
+        "results": results
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Run only these benchmarks")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes and fewer requests, for CI smoke runs")
+    parser.add_argument("--output", help="Also write the combined JSON report to this file")
+    main(parser.parse_args())
@@ -1,7 +1,71 @@
+import { encryptFile, decryptBlob } from './streamCrypto'
+
 // Use environment variable for API URL, fallback to relative path for local dev
 const API_BASE_URL = import.meta.env.VITE_API_URL || '/api'
 
+const errorDetail = async (response, fallback) => {
+  try {
+    const error = await response.json()
+    return error.detail || error.message || `${fallback}: ${response.status}`
+  } catch (e) {
+    return `${fallback}: ${response.status} ${response.statusText}`
+  }
+}
+
+// Encrypt in the browser and PUT straight to S3. Returns null when the server
+// has direct transfers disabled, so the caller can use the regular upload.
+const uploadDirect = async (file, passcode) => {
+  const start = await fetch(`${API_BASE_URL}/direct/uploads`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, mime_type: file.type || null, size: file.size, passcode })
+  })
+  if (start.status === 404) {
+    return null
+  }
+  if (!start.ok) {
+    throw new Error(await errorDetail(start, 'Upload failed'))
+  }
+
+  const session = await start.json()
+  const encrypted = await encryptFile(file, session.header, session.data_key, session.chunk_size)
+  const upload = session.upload
+  const parts = []
+
+  if (upload.method === 'PUT') {
+    const response = await fetch(upload.url, { method: 'PUT', headers: upload.headers, body: encrypted })
+    if (!response.ok) {
+      throw new Error(`Storage upload failed: ${response.status}`)
+    }
+  } else {
+    for (let index = 0; index < upload.part_urls.length; index++) {
+      const body = encrypted.slice(index * upload.part_size, (index + 1) * upload.part_size)
+      const response = await fetch(upload.part_urls[index], { method: 'PUT', body })
+      if (!response.ok) {
+        throw new Error(`Storage upload failed: ${response.status}`)
+      }
+      // The bucket CORS rule must expose ETag
+      parts.push({ part_number: index + 1, etag: response.headers.get('ETag') })
+    }
+  }
+
+  const complete = await fetch(`${API_BASE_URL}/direct/uploads/${session.doc_id}/complete`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ ticket: session.ticket, parts })
+  })
+  if (!complete.ok) {
+    throw new Error(await errorDetail(complete, 'Upload failed'))
+  }
+  return await complete.json()
+}
+
 export const uploadDocument = async (file, passcode) => {
+  const direct = await uploadDirect(file, passcode)
+  if (direct) {
+    return direct
+  }
+
   const formData = new FormData()
   formData.append('file', file)
   formData.append('passcode', passcode)
@@ -51,20 +115,7 @@ export const accessDocument = async (docId, passcode) => {
   return await response.json()
 }
 
-export const downloadDocument = async (docId, passcode, filename) => {
-  const response = await fetch(`${API_BASE_URL}/download/${docId}?passcode=${encodeURIComponent(passcode)}`, {
-    method: 'GET'
-  })
-
-  if (!response.ok) {
-    const error = await response.json()
-    throw new Error(error.detail || 'Download failed')
-  }
-
-  // Get the blob from response
-  const blob = await response.blob()
-  
-  // Create download link
+const saveBlob = (blob, filename) => {
   const url = window.URL.createObjectURL(blob)
   const a = document.createElement('a')
   a.href = url
@@ -73,6 +124,47 @@ export const downloadDocument = async (docId, passcode, filename) => {
   a.click()
   window.URL.revokeObjectURL(url)
   document.body.removeChild(a)
-  
+}
+
+// Fetch a browser-encrypted document straight from S3 and decrypt it locally.
+// Returns null if the document has to go through /download instead.
+const downloadDirect = async (docId, token) => {
+  const response = await fetch(`${API_BASE_URL}/direct/downloads/${docId}?token=${encodeURIComponent(token)}`)
+  if (!response.ok) {
+    return null
+  }
+  const grant = await response.json()
+  const stored = await fetch(grant.url)
+  if (!stored.ok) {
+    return null
+  }
+  return decryptBlob(await stored.arrayBuffer(), grant.data_key, grant.mime_type)
+}
+
+export const downloadDocument = async (docId, passcode, filename, token) => {
+  const direct = token ? await downloadDirect(docId, token) : null
+  if (direct) {
+    saveBlob(direct, filename)
+    return { success: true }
+  }
+
+  // Prefer the short-lived token from accessDocument (no passcode re-check on the server)
+  let response = token
+    ? await fetch(`${API_BASE_URL}/download/${docId}?token=${encodeURIComponent(token)}`, { method: 'GET' })
+    : null
+
+  // Token missing or expired: fall back to the passcode
+  if (!response || response.status === 401) {
+    response = await fetch(`${API_BASE_URL}/download/${docId}?passcode=${encodeURIComponent(passcode)}`, {
+      method: 'GET'
+    })
+  }
+
+  if (!response.ok) {
+    const error = await response.json()
+    throw new Error(error.detail || 'Download failed')
+  }
+
+  saveBlob(await response.blob(), filename)
   return { success: true }
 }
@@ -0,0 +1,69 @@
+// Browser side of the segmented AES-256-GCM blob format used for direct S3 transfers.
+// Mirrors backend/app/services/encryption.py: HKDF-SHA256 blob key, 12-byte nonce of an
+// 11-byte big-endian segment counter plus a final flag, and the packed header as AAD.
+
+const STREAM_INFO = new TextEncoder().encode('secure-doc-share stream v1')
+const TAG_SIZE = 16
+const HEADER_V3_SIZE = 88
+
+const decodeBase64 = (value) => Uint8Array.from(atob(value), (c) => c.charCodeAt(0))
+
+const blobKey = async (dataKey, salt) => {
+  const material = await crypto.subtle.importKey('raw', dataKey, 'HKDF', false, ['deriveKey'])
+  return crypto.subtle.deriveKey(
+    { name: 'HKDF', hash: 'SHA-256', salt, info: STREAM_INFO },
+    material,
+    { name: 'AES-GCM', length: 256 },
+    false,
+    ['encrypt', 'decrypt']
+  )
+}
+
+const segmentNonce = (index, final) => {
+  const nonce = new Uint8Array(12)
+  const view = new DataView(nonce.buffer)
+  view.setUint32(3, Math.floor(index / 2 ** 32))
+  view.setUint32(7, index >>> 0)
+  nonce[11] = final ? 1 : 0
+  return nonce
+}
+
+const segmentCount = (size, chunkSize) => Math.max(1, Math.ceil(size / chunkSize))
+
+// Encrypt `file` with the header and base64 data key issued by POST /direct/uploads
+export const encryptFile = async (file, headerB64, dataKeyB64, chunkSize) => {
+  const header = decodeBase64(headerB64)
+  const key = await blobKey(decodeBase64(dataKeyB64), header.slice(12, 28))
+  const count = segmentCount(file.size, chunkSize)
+  const pieces = [header]
+  for (let index = 0; index < count; index++) {
+    const chunk = await file.slice(index * chunkSize, (index + 1) * chunkSize).arrayBuffer()
+    const iv = segmentNonce(index, index === count - 1)
+    pieces.push(await crypto.subtle.encrypt({ name: 'AES-GCM', iv, additionalData: header }, key, chunk))
+  }
+  return new Blob(pieces, { type: 'application/octet-stream' })
+}
+
+// Decrypt a downloaded version 3 blob with the base64 data key from GET /direct/downloads
+export const decryptBlob = async (encrypted, dataKeyB64, mimeType) => {
+  const bytes = new Uint8Array(encrypted)
+  if (bytes.length < HEADER_V3_SIZE || bytes[4] !== 3) {
+    throw new Error('Unsupported encrypted blob')
+  }
+  const header = bytes.slice(0, HEADER_V3_SIZE)
+  const chunkSize = new DataView(header.buffer).getUint32(8)
+  const key = await blobKey(decodeBase64(dataKeyB64), header.slice(12, 28))
+  const segmentSize = chunkSize + TAG_SIZE
+  const count = Math.max(1, Math.ceil((bytes.length - HEADER_V3_SIZE) / segmentSize))
+  const pieces = []
+  for (let index = 0; index < count; index++) {
+    const start = HEADER_V3_SIZE + index * segmentSize
+    const iv = segmentNonce(index, index === count - 1)
+    pieces.push(await crypto.subtle.decrypt(
+      { name: 'AES-GCM', iv, additionalData: header },
+      key,
+      bytes.subarray(start, start + segmentSize)
+    ))
+  }
+  return new Blob(pieces, { type: mimeType || 'application/octet-stream' })
+}